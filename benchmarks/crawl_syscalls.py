@@ -0,0 +1,152 @@
+"""
+Compares syscalls and wall time of the crawler with the old os.walk based
+walking from Indexxo._discover. Results are scaled to one million files.
+
+Run from repository root:
+    python -m benchmarks.crawl_syscalls --files 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from server.crawler import Crawler
+from server.filetypes import filetypes
+from server.ignorerules import IgnoreRules
+
+counts: dict[str, int] = {"stat": 0, "listdir": 0}
+
+
+class CountingEntry:
+    """DirEntry wrapper that counts stat calls"""
+
+    def __init__(self, entry: os.DirEntry):
+        self._entry = entry
+
+    def stat(self, *args, **kwargs):
+        counts["stat"] += 1
+        return self._entry.stat(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+
+class CountingScandir:
+    """os.scandir wrapper that counts listed folders"""
+
+    def __init__(self, path):
+        counts["listdir"] += 1
+        self._iterator = real_scandir(path)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return CountingEntry(next(self._iterator))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._iterator.close()
+
+    def close(self):
+        self._iterator.close()
+
+
+real_scandir = os.scandir
+real_stat = os.stat
+real_lstat = os.lstat
+
+
+def counting_stat(*args, **kwargs):
+    counts["stat"] += 1
+    return real_stat(*args, **kwargs)
+
+
+def counting_lstat(*args, **kwargs):
+    counts["stat"] += 1
+    return real_lstat(*args, **kwargs)
+
+
+def make_tree(root: Path, files: int, per_folder: int = 100, fan_out: int = 10):
+    """Create folders with empty files, fan_out subfolders per level"""
+    extensions = list(filetypes)
+    folders = [root]
+    created = 0
+    index = 0
+    while created < files:
+        folder = folders[index]
+        index += 1
+        for i in range(fan_out):
+            sub = folder / f"folder{i}"
+            sub.mkdir()
+            folders.append(sub)
+        for i in range(min(per_folder, files - created)):
+            (folder / f"file{i}.{extensions[created % len(extensions)]}").touch()
+            created += 1
+
+
+def walk_before(path: Path):
+    """Walking as it was done by Indexxo._discover before the crawler"""
+    folder_sizes = {}
+    for directory, folders, files in os.walk(path, topdown=False):
+        directory = Path(directory)
+        sizes = 0
+        for file in files:
+            file_path = directory / Path(file)
+            name, ext = os.path.splitext(file)
+            filetypes.get(ext[1:], "other")
+            sizes += file_path.stat().st_size
+            file_path.stat().st_mtime
+        for folder in folders:
+            sizes += folder_sizes[directory / Path(folder)]
+        directory.stat().st_mtime
+        folder_sizes[directory] = sizes
+
+
+def walk_after(path: Path, workers: int):
+    crawler = Crawler(workers, IgnoreRules(), lambda ext: filetypes.get(ext, "other"))
+    for _ in crawler.crawl(str(path), None, lambda directory: []):
+        pass
+
+
+def measure(name: str, walk, files: int):
+    start = time.perf_counter()
+    walk()
+    elapsed = time.perf_counter() - start
+
+    counts.update(stat=0, listdir=0)
+    os.scandir, os.stat, os.lstat = CountingScandir, counting_stat, counting_lstat
+    try:
+        walk()
+    finally:
+        os.scandir, os.stat, os.lstat = real_scandir, real_stat, real_lstat
+
+    scale = 1_000_000 / files
+    print(f"{name:<20} {elapsed * scale:>10.2f} s {counts['stat'] * scale:>12.0f} "
+          f"{counts['listdir'] * scale:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100_000,
+                        help="Amount of files in generated tree.")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Crawler threads.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        make_tree(root, args.files)
+        print(f"{args.files} files, results per million files")
+        print(f"{'':<20} {'wall time':>12} {'stat calls':>12} {'listings':>12}")
+        measure("before (os.walk)", lambda: walk_before(root), args.files)
+        measure("after (1 worker)", lambda: walk_after(root, 1), args.files)
+        measure(f"after ({args.workers} workers)",
+                lambda: walk_after(root, args.workers), args.files)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Measures loading rows into index with secondary indexes maintained while
+loading and created after loading, then folder open latency with and
+without secondary indexes.
+
+Run from repository root:
+    python -m benchmarks.folder_open --rows 5000000
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from peewee import chunked
+
+from server.indexxocore import Indexxo, FileObjectBase, db
+from server.filetypes import filetypes
+
+
+def generate_rows(rows: int, per_folder: int):
+    """Rows of a flat space with folders that contain per_folder files each"""
+    extensions = list(filetypes)
+    folders = -(-rows // per_folder)
+    yield {"id": 1, "full_path": "/space", "full_name": "/space", "name": "/space",
+           "extension": None, "type": "space", "size": 0, "parent_id": None,
+           "mtime": 0.0}
+    for i in range(rows):
+        folder = f"/space/folder{i // per_folder}"
+        folder_id = 2 + i // per_folder
+        if i % per_folder == 0:
+            yield {"id": folder_id, "full_path": folder, "full_name": folder[7:],
+                   "name": folder[7:], "extension": None, "type": "folder", "size": 0,
+                   "parent_id": 1, "mtime": 0.0}
+        ext = extensions[i % len(extensions)]
+        yield {
+            "id": 2 + folders + i,
+            "full_path": f"{folder}/file{i}.{ext}",
+            "full_name": f"file{i}.{ext}",
+            "name": f"file{i}",
+            "extension": f".{ext}",
+            "type": filetypes[ext],
+            "size": i,
+            "parent_id": folder_id,
+            "mtime": float(i)
+        }
+
+
+def load(indexxo: Indexxo, rows: int, per_folder: int, indexes_after: bool) -> float:
+    """Load rows into empty index, returns seconds"""
+    FileObjectBase.delete().execute()
+    start = time.perf_counter()
+    with db.atomic():
+        if indexes_after:
+            indexxo.drop_indexes()
+        for batch in chunked(generate_rows(rows, per_folder), 100):
+            FileObjectBase.insert_many(batch).execute()
+        if indexes_after:
+            indexxo.create_indexes()
+    seconds = time.perf_counter() - start
+    # Opened folders are found in folders tree
+    indexxo._load_folders()
+    return seconds
+
+
+def open_folders(indexxo: Indexxo, folders: int, samples: int) -> list[float]:
+    """Open random folders, returns milliseconds for every folder"""
+    random.seed(1)
+    times = []
+    for _ in range(samples):
+        path = Path(f"/space/folder{random.randrange(folders)}")
+        start = time.perf_counter()
+        indexxo.get_content(path, limit=500)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name: str, times: list[float]):
+    times = sorted(times)
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print(f"{name:<28} p50 {statistics.median(times):>9.2f} ms   p99 {p99:>9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000,
+                        help="Amount of files in index.")
+    parser.add_argument("--per-folder", type=int, default=100,
+                        help="Amount of files in every folder.")
+    parser.add_argument("--samples", type=int, default=200,
+                        help="Amount of opened folders with indexes.")
+    args = parser.parse_args()
+    folders = args.rows // args.per_folder
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        indexxo = Indexxo(filetypes, [], [], 3600, 1, Path(temp_dir) / "database.sqlite")
+        # Only secondary indexes are measured
+        indexxo._drop_search_triggers()
+
+        print(f"{args.rows} rows, {folders} folders")
+        seconds = load(indexxo, args.rows, args.per_folder, indexes_after=False)
+        print(f"{'load, indexes during':<28} {seconds:>9.2f} s")
+        seconds = load(indexxo, args.rows, args.per_folder, indexes_after=True)
+        print(f"{'load, indexes after':<28} {seconds:>9.2f} s")
+
+        report("open folder, indexes", open_folders(indexxo, folders, args.samples))
+        indexxo.drop_indexes()
+        # Every open is a full scan, fewer samples are enough
+        report("open folder, no indexes",
+               open_folders(indexxo, folders, max(args.samples // 20, 5)))
+
+
+if __name__ == '__main__':
+    main()
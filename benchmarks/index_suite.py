@@ -0,0 +1,254 @@
+"""
+Indexes a synthetic tree (see synthetic_tree) and measures:
+    discover: wall time, files per second, time spent writing rows and
+        building indexes, index file size
+    refresh: wall time of refreshing the unchanged tree
+    memory: peak memory allocated by Python while discovering the tree in a
+        fresh index (separate run, tracing slows it down)
+    latency: percentiles of /api/folder and /api/search through
+        IndexxoServer, uncached (response cache and recent searches are
+        cleared before every request) and cached
+
+Results are printed and written as JSON with --output, so runs can be
+compared to catch regressions.
+
+Run from repository root:
+    python -m benchmarks.index_suite --depth 4 --fan-out 8 --files 20 --output results.json
+"""
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from dataclasses import asdict
+from pathlib import Path
+from typing import Callable
+from unittest import mock
+
+from benchmarks.synthetic_tree import WORDS, make_tree
+from server.filetypes import filetypes
+from server.indexxocore import FileObjectBase, FileSearch, Indexxo, IndexWriter, db
+from server.indexxoweb import IndexxoServer
+from server.recentsearches import RecentSearches
+from server.responsecache import ResponseCache
+
+FILTER_QUERIES = (
+    "type:video size:>100M",
+    "type:image mtime:2021",
+    "ext:pdf,docx mtime:>=2023-06",
+    "photo type:image size:<1M",
+    "report ext:xlsx,csv",
+    "summer mtime:<2019",
+)
+"""Search queries with filters, see SearchQuery"""
+
+
+def create_indexxo(space: Path, database_path: Path, workers: int) -> Indexxo:
+    return Indexxo(filetypes, [space], [], 3600, workers, database_path,
+                   watch_changes=False, hash_rate=0)
+
+
+def timed(owner: object, name: str, totals: dict[str, float], key: str):
+    """Patch a method, so its time is added to totals[key]"""
+    original = getattr(owner, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            totals[key] += time.perf_counter() - start
+    return mock.patch.object(owner, name, wrapper)
+
+
+def discover(indexxo: Indexxo, space: Path) -> dict:
+    """Discover space into index, returns seconds in total and per step"""
+    totals = {"write_seconds": 0.0, "index_seconds": 0.0}
+    with ExitStack() as stack:
+        stack.enter_context(timed(IndexWriter, "flush", totals, "write_seconds"))
+        stack.enter_context(timed(Indexxo, "create_indexes", totals, "index_seconds"))
+        stack.enter_context(timed(FileSearch, "rebuild", totals, "index_seconds"))
+        start = time.perf_counter()
+        indexxo.loop.run_until_complete(indexxo._discover(space))
+        totals["seconds"] = time.perf_counter() - start
+    return totals
+
+
+def index_size(database_path: Path) -> int:
+    """Size of index file once write-ahead log is written into it"""
+    db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    return database_path.stat().st_size
+
+
+def peak_memory(space: Path, database_path: Path, workers: int) -> int:
+    """Peak bytes allocated by Python while discovering space in empty index"""
+    indexxo = create_indexxo(space, database_path, workers)
+    tracemalloc.start()
+    try:
+        indexxo.loop.run_until_complete(indexxo._discover(space))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    db.close()
+    return peak
+
+
+def search_queries(rng: random.Random, samples: int) -> list[str]:
+    """Parts of words that names are made of, from 2 letters to whole words"""
+    parts = sorted({word[start:end] for word in WORDS
+                    for start in range(len(word)) for end in range(start + 2, len(word) + 1)})
+    return rng.sample(parts, min(samples, len(parts)))
+
+
+def percentiles(times: list[float]) -> dict[str, float]:
+    """Milliseconds at p50, p90, p99 and max"""
+    cuts = statistics.quantiles(times, n=100, method="inclusive")
+    return {
+        "samples": len(times),
+        "p50_ms": round(cuts[49], 3),
+        "p90_ms": round(cuts[89], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(max(times), 3),
+    }
+
+
+def measure_requests(
+    server: IndexxoServer,
+    indexxo: Indexxo,
+    requests: list[tuple[str, dict]],
+    uncached: bool
+) -> dict[str, float]:
+    """
+    Request every endpoint with its arguments, returns percentiles. Cached
+    responses are measured after every request was made once.
+    """
+    client = server.app.test_client()
+    if not uncached:
+        for path, args in requests:
+            client.get(path, query_string=args).get_data()
+    times = []
+    for path, args in requests:
+        if uncached:
+            server.cache = ResponseCache(server.cache.max_bytes, server.cache.max_entry_bytes)
+            indexxo.searches = RecentSearches(indexxo.searches.max_queries)
+        start = time.perf_counter()
+        response = client.get(path, query_string=args)
+        response.get_data()
+        times.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} {args}: {response.status_code} {response.text}")
+    return percentiles(times)
+
+
+def measure_latency(indexxo: Indexxo, samples: int, seed: int) -> dict[str, dict]:
+    rng = random.Random(seed)
+    folders = [path for path, in FileObjectBase.select(FileObjectBase.full_path)
+               .where(FileObjectBase.type == "folder").tuples()]
+    groups = {
+        "folder": [("/api/folder", {"path": path, "limit": 100})
+                   for path in rng.sample(folders, min(samples, len(folders)))],
+        "search": [("/api/search", {"query": query, "limit": 100})
+                   for query in search_queries(rng, samples)],
+        "search_filters": [("/api/search", {"query": query, "limit": 100})
+                           for query in FILTER_QUERIES],
+    }
+    server = IndexxoServer(indexxo)
+    results = {}
+    for name, requests in groups.items():
+        results[name] = measure_requests(server, indexxo, requests, uncached=True)
+        results[f"{name}_cached"] = measure_requests(server, indexxo, requests, uncached=False)
+    return results
+
+
+def run(args: argparse.Namespace, report: Callable[[str], None]) -> dict:
+    results = {
+        "benchmark": "index_suite",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "arguments": {k: str(v) if isinstance(v, Path) else v
+                      for k, v in vars(args).items()},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        space = root / "space"
+        start = time.perf_counter()
+        tree = make_tree(space, args.depth, args.fan_out, args.files, args.seed)
+        results["tree"] = asdict(tree)
+        report(f"{tree.folders} folders, {tree.files} files "
+               f"(generated in {time.perf_counter() - start:.1f} s)")
+
+        database_path = root / "database.sqlite"
+        indexxo = create_indexxo(space, database_path, args.workers)
+        steps = discover(indexxo, space)
+        rows = tree.folders + tree.files
+        results["discover"] = {
+            "seconds": round(steps["seconds"], 3),
+            "rows_per_second": round(rows / steps["seconds"]),
+            "write_seconds": round(steps["write_seconds"], 3),
+            "index_seconds": round(steps["index_seconds"], 3),
+            "index_bytes": index_size(database_path),
+        }
+        discovered = results["discover"]
+        report(f"{'discover':<16} {discovered['seconds']:>9.2f} s "
+               f"{discovered['rows_per_second']:>9} rows/s  "
+               f"write {discovered['write_seconds']:.2f} s  "
+               f"indexes {discovered['index_seconds']:.2f} s  "
+               f"index file {discovered['index_bytes'] / 1024 ** 2:.1f} MiB")
+
+        steps = discover(indexxo, space)
+        results["refresh"] = {"seconds": round(steps["seconds"], 3)}
+        report(f"{'refresh':<16} {steps['seconds']:>9.2f} s")
+
+        results["latency"] = measure_latency(indexxo, args.samples, args.seed)
+        for name, latency in results["latency"].items():
+            report(f"{name:<22} p50 {latency['p50_ms']:>8.2f} ms  "
+                   f"p90 {latency['p90_ms']:>8.2f} ms  p99 {latency['p99_ms']:>8.2f} ms")
+        db.close()
+
+        if not args.skip_memory:
+            peak = peak_memory(space, root / "memory.sqlite", args.workers)
+            results["memory"] = {"peak_bytes": peak}
+            report(f"{'peak memory':<16} {peak / 1024 ** 2:>9.1f} MiB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=4,
+                        help="Levels of folders below the space.")
+    parser.add_argument("--fan-out", type=int, default=8,
+                        help="Subfolders of every folder above the deepest level.")
+    parser.add_argument("--files", type=int, default=20,
+                        help="Files in every folder.")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the tree and of sampled requests.")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Crawler threads.")
+    parser.add_argument("--samples", type=int, default=200,
+                        help="Requests of every endpoint.")
+    parser.add_argument("--skip-memory", action="store_true",
+                        help="Don't discover the tree again to measure memory.")
+    parser.add_argument("--output", type=Path,
+                        help="Write results as JSON into this file, - for stdout.")
+    args = parser.parse_args()
+
+    to_stdout = args.output == Path("-")
+    # Human readable lines don't mix with JSON
+    results = run(args, lambda line: print(line, file=sys.stderr if to_stdout else sys.stdout))
+    if to_stdout:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Reproducible synthetic folder trees for benchmarks. The same arguments and
+seed give the same names, sizes and modification dates.
+"""
+import os
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+from server.filetypes import filetypes
+
+WORDS = ("report", "holiday", "invoice", "backup", "photo", "draft", "final",
+         "project", "music", "scan", "notes", "video", "archive", "budget",
+         "family", "meeting", "summer", "build", "export", "camera")
+"""Words that names are made of"""
+
+MTIME_START = 1_500_000_000
+"""Earliest modification date of generated files (July 2017)"""
+MTIME_SPAN = 8 * 365 * 24 * 3600
+"""Modification dates are spread over this many seconds"""
+
+
+@dataclass
+class TreeStats:
+    """What was generated"""
+    folders: int
+    """Folders, top folder included"""
+    files: int
+    bytes: int
+    """Total apparent size of files, files are sparse and take no disk space"""
+    depth: int
+    fan_out: int
+    files_per_folder: int
+    seed: int
+
+
+def random_name(rng: random.Random) -> str:
+    """Name without extension like "holiday_photo 0412" """
+    words = rng.sample(WORDS, rng.randint(1, 3))
+    return f"{'_'.join(words)} {rng.randrange(10_000):04}"
+
+
+def random_size(rng: random.Random) -> int:
+    """Mostly small files with a few big ones, like a home folder"""
+    return min(int(rng.lognormvariate(10, 3)), 8 * 1024 ** 3)
+
+
+def make_tree(
+    root: Path,
+    depth: int,
+    fan_out: int,
+    files_per_folder: int,
+    seed: int = 1
+) -> TreeStats:
+    """
+    Create a tree where every folder above the deepest level has fan_out
+    subfolders, and every folder has files_per_folder files. Extensions are
+    drawn from filetypes, files are sparse so the tree is cheap to create.
+
+    Args:
+        root (Path): Top folder, created if it doesn't exist.
+        depth (int): Levels of folders below the top folder.
+        fan_out (int): Subfolders of every folder above the deepest level.
+        files_per_folder (int): Files in every folder.
+        seed (int): Seed of names, sizes and dates.
+
+    Returns:
+        TreeStats: Amount of generated folders, files and bytes.
+    """
+    rng = random.Random(seed)
+    extensions = sorted(filetypes)
+    stats = TreeStats(0, 0, 0, depth, fan_out, files_per_folder, seed)
+    root.mkdir(parents=True, exist_ok=True)
+    # Depth first, only one branch of paths is kept
+    waiting = [(root, 0)]
+    while waiting:
+        folder, level = waiting.pop()
+        stats.folders += 1
+        names = set()
+        for _ in range(files_per_folder):
+            name = f"{random_name(rng)}.{rng.choice(extensions)}"
+            if name in names:
+                continue
+            names.add(name)
+            path = folder / name
+            size = random_size(rng)
+            with open(path, "wb") as file:
+                file.truncate(size)
+            mtime = MTIME_START + rng.randrange(MTIME_SPAN)
+            os.utime(path, (mtime, mtime))
+            stats.files += 1
+            stats.bytes += size
+        if level < depth:
+            for i in range(fan_out):
+                subfolder = folder / f"{random_name(rng)} {i}"
+                subfolder.mkdir()
+                waiting.append((subfolder, level + 1))
+    return stats
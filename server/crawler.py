@@ -0,0 +1,331 @@
+"""Parallel file system crawler"""
+import logging
+import os
+import stat
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import SimpleQueue
+from typing import Callable, Iterator
+
+from server.ignorerules import IgnoreRules
+from server.metrics import IndexerMetrics
+
+UNLISTED_MTIME = -1.0
+"""
+Modification date of folder rows that couldn't be listed. It never matches
+the folder on disk, so the folder is listed again on the next refresh.
+"""
+
+
+class Crawler():
+    """
+    Walks folders top-down. Listing folders and getting information about files
+    is done in a pool of threads, so slow (network) file systems are walked
+    concurrently.
+
+    Folders are listed with os.scandir. Entry types come from the listing
+    itself and every entry is stat-ed exactly once (folders are stat-ed by
+    their parent, only the top folder is stat-ed separately). Folders that
+    didn't change are not listed, only their files are stat-ed.
+    """
+    workers: int = 8
+    """Maximum amount of threads listing folders at the same time"""
+    ignore: IgnoreRules = IgnoreRules()
+    """Rules of entries of the folder that contains the crawled folder"""
+
+    def __init__(
+        self,
+        workers: int,
+        ignore: IgnoreRules,
+        get_file_type: Callable[[str], str],
+        metrics: IndexerMetrics | None = None
+    ):
+        """
+        Initialize Crawler
+
+        Args:
+            workers (int): Maximum amount of threads listing folders at the same time.
+            ignore (IgnoreRules): Rules of entries of the folder that contains
+            the crawled folder, see IgnoreRules.for_space and for_path.
+            get_file_type (Callable[[str], str]): Returns file type for an extension
+            (without dot).
+            metrics (IndexerMetrics | None): Gets queue depths and folder
+            listing durations if provided.
+        """
+        self.workers = workers
+        self.ignore = ignore
+        self.get_file_type = get_file_type
+        self.metrics = metrics
+
+    def crawl(
+        self,
+        path: str,
+        known: dict | None,
+        known_children: Callable[[str], list[dict]],
+        space: bool = True,
+        relist: bool = False
+    ) -> Iterator[tuple[dict, list[dict], list[str], list[dict]]]:
+        """
+        Walk the folder and yield rows of every folder inside of it as soon as
+        the folder is listed. Ignored folders are not entered at all.
+
+        Folders whose modification date is the same as in known rows are not
+        listed again, their files are taken from known rows and only stat-ed
+        (editing a file doesn't update mtime of its folder). Folders inside
+        of them are still visited, changes deep in the tree don't update mtime
+        of upper folders. Folder whose ignore files changed is listed with
+        everything inside of it, entries that were ignored could be not
+        ignored anymore.
+
+        Folders that can't be listed keep their known children and get
+        UNLISTED_MTIME, so they are listed on the next refresh.
+
+        Folder sizes are known only when everything inside is walked. Folder rows
+        are yielded with size 0, sizes are set on the same dicts when the
+        generator is exhausted.
+
+        New rows have no id and parent_id, they are given by the caller. Known
+        rows of files that didn't change are yielded as they were provided.
+
+        Args:
+            path (str): Folder full path.
+            known (dict | None): Row of this folder that is currently in index.
+            known_children (Callable[[str], list[dict]]): Returns rows that are
+            currently in index for children of a folder. Called in the thread that
+            iterates over this generator.
+            space (bool): Whether the folder is a space. Otherwise it's a folder
+            inside of a space and its row is yielded like every other folder.
+            relist (bool): List every folder even if it didn't change, e.g.
+            when ignore rules changed.
+
+        Yields:
+            tuple[dict, list[dict], list[str], list[dict]]: Folder row, rows of
+            files in it, full paths of its subfolders and known rows of its
+            children. First folder is the top folder, its type is space if space
+            is True. Nothing is yielded if folder can't be accessed.
+        """
+        # Storing folder rows and sizes like this for performance.
+        folders: dict[str, dict] = {}
+        folder_sizes: dict[str, int] = {}
+        # Folders in the order they were visited, parents always go first.
+        visited: list[str] = []
+
+        # Folders to visit with their mtime, known row, ignore rules of their
+        # parent and whether they are listed anyway. Only a few of them are
+        # visited at a time, so memory doesn't grow if rows are consumed
+        # slower than folders are listed.
+        waiting: deque[tuple[str, float | None, dict | None, IgnoreRules, bool]] = deque(
+            [(path, None, known, self.ignore, relist)])
+        # Finished visits, waiting on a queue is cheaper than waiting on a
+        # big set of futures.
+        done: SimpleQueue[Future] = SimpleQueue()
+        # Reported to metrics, see IndexerMetrics.crawling
+        reported = (0, 0)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                in_flight = 0
+                while waiting or in_flight:
+                    while waiting and in_flight < self.workers * 2:
+                        # Depth first, keeps waiting folders list short
+                        directory, mtime, old, rules, listed = waiting.pop()
+                        future = executor.submit(self._visit, directory, mtime, old,
+                                                 known_children(directory), rules, listed)
+                        future.add_done_callback(done.put)
+                        in_flight += 1
+                    if self.metrics is not None:
+                        self.metrics.crawling(len(waiting) - reported[0], in_flight - reported[1])
+                        reported = (len(waiting), in_flight)
+
+                    folder, files, subfolders, children, rules, listed = done.get().result()
+                    in_flight -= 1
+                    if folder is None:
+                        continue
+
+                    directory = folder["full_path"]
+                    if not visited and space:
+                        folder["type"] = "space"
+                    visited.append(directory)
+                    folders[directory] = folder
+                    folder_sizes[directory] = sum(file["size"] for file in files)
+
+                    known_folders = {row["full_path"]: row for row in children
+                                     if row["type"] == "folder"}
+                    for subfolder, mtime in subfolders:
+                        waiting.append(
+                            (subfolder, mtime, known_folders.get(subfolder), rules, listed))
+
+                    yield folder, files, [s for s, _ in subfolders], children
+        finally:
+            # Generator may be closed before it is exhausted
+            if self.metrics is not None:
+                self.metrics.crawling(-reported[0], -reported[1])
+
+        # Children go after parents, so going backwards sums sizes bottom-up
+        for directory in reversed(visited):
+            folders[directory]["size"] = folder_sizes[directory]
+            if directory != visited[0]:
+                folder_sizes[os.path.dirname(directory)] += folder_sizes[directory]
+
+    def _visit(
+        self,
+        directory: str,
+        mtime: float | None,
+        old: dict | None,
+        children: list[dict],
+        rules: IgnoreRules,
+        relist: bool
+    ) -> tuple[dict | None, list[dict], list[tuple[str, float | None]], list[dict],
+               IgnoreRules, bool]:
+        """
+        Get information about one folder. Ignored entries are skipped before
+        they are stat-ed, ignored folders are never listed. Runs in a worker
+        thread.
+
+        Args:
+            directory (str): Folder full path.
+            mtime (float | None): Folder modification date if it's already known
+            from parent folder listing. Folder is stat-ed if None.
+            old (dict | None): Row of this folder that is currently in index.
+            children (list[dict]): Rows of children that are currently in index.
+            rules (IgnoreRules): Ignore rules of the folder that contains it.
+            relist (bool): List the folder even if it didn't change.
+
+        Returns:
+            tuple[dict | None, list[dict], list[tuple[str, float | None]], list[dict],
+            IgnoreRules, bool]: Folder row (size is not calculated yet), rows of
+            files in it, full paths of its subfolders with their modification
+            dates, children as they were provided, ignore rules of its entries
+            and whether subfolders are listed anyway. Folder row is None if
+            folder can't be accessed.
+        """
+        if mtime is None:
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError as e:
+                logging.warning(f"Can't access {directory}: {e}")
+                return None, [], [], children, rules, relist
+
+        folder = {
+            "full_path": directory,
+            "full_name": os.path.basename(directory),
+            "name": os.path.basename(directory),
+            "extension": None,
+            "type": "folder",
+            # Calculated after walking
+            "size": 0,
+            "mtime": mtime
+        }
+        files: list[dict] = []
+        subfolders: list[tuple[str, float | None]] = []
+
+        if (not relist and old is not None and old["type"] in ("folder", "space") and
+                old["mtime"] == mtime and not self._ignore_files_changed(directory, children)):
+            # Nothing was added, removed or renamed here since last refresh.
+            # Ignore files could still be edited, so they are read again.
+            rules = rules.for_folder(directory, (row["full_name"] for row in children))
+            for row in children:
+                # Ignoring if needed, ignore rules could change since last refresh
+                if rules.ignored(row["full_path"], row["full_name"], row["type"] == "folder"):
+                    continue
+                if row["type"] == "folder":
+                    # Was not listed, so modification date is unknown
+                    subfolders.append((row["full_path"], None))
+                    continue
+                # Files edited in place don't change mtime of their folder
+                try:
+                    file_stat = os.lstat(row["full_path"])
+                except OSError:
+                    continue
+                if (file_stat.st_size, file_stat.st_mtime) == (row["size"], row["mtime"]):
+                    files.append(row)
+                elif stat.S_ISDIR(file_stat.st_mode):
+                    subfolders.append((row["full_path"], file_stat.st_mtime))
+                else:
+                    files.append(self.file_row(directory, row["full_name"], file_stat))
+            return folder, files, subfolders, children, rules, False
+
+        start = time.perf_counter()
+        try:
+            with os.scandir(directory) as listing:
+                entries = list(listing)
+        except OSError as e:
+            # Known children are kept as they are, they can't be told apart
+            # from removed ones
+            logging.warning(f"Can't list {directory}: {e}")
+            folder["mtime"] = UNLISTED_MTIME
+            rules = rules.for_folder(directory, (row["full_name"] for row in children))
+            for row in children:
+                if row["type"] == "folder":
+                    subfolders.append((row["full_path"], None))
+                else:
+                    files.append(row)
+            return folder, files, subfolders, children, rules, relist
+
+        # Ignore files apply to entries next to them
+        rules = rules.for_folder(directory, (entry.name for entry in entries))
+        # Ignore files that were added, removed or edited change what is
+        # ignored below, so everything below is listed
+        relist = relist or (self._ignore_files(children) != {
+            (row["full_name"], row["size"], row["mtime"]) for row in files
+            if row["full_name"] in self.ignore.ignore_files})
+        for entry in entries:
+            try:
+                # Symlinks are not followed. Type comes from the listing,
+                # stat is one syscall that is cached by entry.
+                is_dir = entry.is_dir(follow_symlinks=False)
+                # Ignoring if needed
+                if rules.ignored(entry.path, entry.name, is_dir):
+                    continue
+                entry_stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if is_dir:
+                subfolders.append((entry.path, entry_stat.st_mtime))
+                continue
+
+            files.append(self.file_row(directory, entry.name, entry_stat))
+
+        if self.metrics is not None:
+            self.metrics.listing.observe(time.perf_counter() - start)
+        return folder, files, subfolders, children, rules, relist
+
+    def _ignore_files(self, rows: list[dict]) -> set[tuple[str, int, float]]:
+        """Names, sizes and modification dates of ignore files among known rows"""
+        return {(row["full_name"], row["size"], row["mtime"]) for row in rows
+                if row["full_name"] in self.ignore.ignore_files and row["type"] != "folder"}
+
+    def _ignore_files_changed(self, directory: str, rows: list[dict]) -> bool:
+        """Whether ignore files among known rows of a folder were edited or removed"""
+        for name, size, mtime in self._ignore_files(rows):
+            try:
+                file_stat = os.lstat(os.path.join(directory, name))
+            except OSError:
+                return True
+            if (file_stat.st_size, file_stat.st_mtime) != (size, mtime):
+                return True
+        return False
+
+    def file_row(self, directory: str, full_name: str, file_stat: os.stat_result) -> dict:
+        """
+        Build row of a file.
+
+        Args:
+            directory (str): Full path of folder that contains the file.
+            full_name (str): File name with extension.
+            file_stat (os.stat_result): File information (symlinks are not followed).
+
+        Returns:
+            dict: File row without id and parent_id.
+        """
+        name, ext = os.path.splitext(full_name)
+        return {
+            "full_path": os.path.join(directory, full_name),
+            "full_name": full_name,
+            "name": name,
+            "extension": ext,
+            "type": self.get_file_type(ext[1:]),
+            "size": file_stat.st_size,
+            "mtime": file_stat.st_mtime
+        }
@@ -0,0 +1,146 @@
+"""Sending indexed files and folders, see IndexxoServer.download"""
+import logging
+import os
+import stat
+import time
+import unicodedata
+import zipfile
+from typing import BinaryIO, Iterable, Iterator
+from urllib.parse import quote
+
+from werkzeug.datastructures import Headers
+
+BLOCK = 1024 * 1024
+"""Bytes read from a file at once while sending it"""
+
+ZIP64_SIZE = 1024 ** 3
+"""
+Files of this size and bigger get zip64 headers in streamed zip, so they
+can grow a bit while they're sent
+"""
+
+ZIP_EPOCH = 315532800
+"""Zip dates start at 1980-01-01, older files get this date"""
+
+
+def open_file(path: str) -> tuple[BinaryIO, os.stat_result]:
+    """
+    Open a regular file for reading without following a symlink, so links
+    that point outside of a space are never read. FIFOs and devices are
+    opened without blocking and rejected.
+
+    Args:
+        path (str): File full path.
+
+    Returns:
+        tuple[BinaryIO, os.stat_result]: Opened file and its information.
+
+    Raises:
+        OSError: File can't be opened, is a symlink or isn't a regular file.
+    """
+    if not hasattr(os, "O_NOFOLLOW") and os.path.islink(path):
+        raise OSError(f"{path} is a symlink")
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0) | getattr(os, "O_BINARY", 0) |
+                 getattr(os, "O_NONBLOCK", 0) | getattr(os, "O_NOCTTY", 0))
+    file = os.fdopen(fd, "rb")
+    file_stat = os.fstat(fd)
+    if not stat.S_ISREG(file_stat.st_mode):
+        file.close()
+        raise OSError(f"{path} is not a regular file")
+    return file, file_stat
+
+
+def read_range(file: BinaryIO, length: int) -> Iterator[bytes]:
+    """
+    Read length bytes from the current position of file in blocks, file is
+    closed when done. Used when server has no wsgi.file_wrapper.
+    """
+    try:
+        while length > 0:
+            block = file.read(min(BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        file.close()
+
+
+def set_attachment(headers: Headers, name: str):
+    """
+    Set Content-Disposition, so browser saves response as a file with this
+    name. Names that are not ASCII are sent in filename* too.
+    """
+    try:
+        name.encode("ascii")
+        names = {"filename": name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+        quoted = quote(name, safe="!#$&+^`|~", errors="surrogateescape")
+        names = {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    headers.set("Content-Disposition", "attachment", **names)
+
+
+class _Chunks():
+    """Write-only stream that zipfile writes into, written bytes are taken out"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        """Get bytes written since the last call"""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(folder: str, name: str, rows: Iterable[dict]) -> Iterator[bytes]:
+    """
+    Build zip of a folder while it's sent. Files are stored without
+    compression and read in blocks, so memory doesn't depend on their size
+    (only names of entries are kept for the central directory at the end).
+    Files that can't be read anymore are skipped.
+
+    Args:
+        folder (str): Folder full path.
+        name (str): Name of the top folder in zip.
+        rows (Iterable[dict]): Rows of files and folders inside of the folder
+        (full_path, type, size and mtime), parents before children.
+
+    Yields:
+        bytes: Parts of zip.
+    """
+    chunks = _Chunks()
+    with zipfile.ZipFile(chunks, "w", zipfile.ZIP_STORED) as archive:
+        for row in rows:
+            path = row["full_path"]
+            entry_name = f"{name}/{os.path.relpath(path, folder)}".replace(os.sep, "/")
+            date_time = time.localtime(max(row["mtime"], ZIP_EPOCH))[:6]
+            if row["type"] in ("folder", "space"):
+                # Empty folders are kept too
+                info = zipfile.ZipInfo(entry_name + "/", date_time)
+                info.external_attr = (0o40755 << 16) | 0x10
+                archive.writestr(info, b"")
+                continue
+            try:
+                file, _ = open_file(path)
+            except OSError as e:
+                logging.warning(f"Can't add {path} to zip: {e}")
+                continue
+            with file:
+                info = zipfile.ZipInfo(entry_name, date_time)
+                info.external_attr = 0o644 << 16
+                with archive.open(info, "w", force_zip64=row["size"] >= ZIP64_SIZE) as entry:
+                    while block := file.read(BLOCK):
+                        entry.write(block)
+                        yield chunks.take()
+            yield chunks.take()
+    # Central directory
+    yield chunks.take()
@@ -0,0 +1,91 @@
+import io
+import os
+import pathlib
+import tempfile
+import unittest
+import zipfile
+from werkzeug.datastructures import Headers
+from server.download import open_file, read_range, set_attachment, stream_zip
+
+
+class DownloadTest(unittest.TestCase):
+    temp_dir: tempfile.TemporaryDirectory
+    temp_dir_path: pathlib.Path
+
+    def setUp(self):
+        """
+        Creates temporary directory with a folder to zip
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = pathlib.Path(self.temp_dir.name)
+        self.folder = self.temp_dir_path / "folder"
+        (self.folder / "sub").mkdir(parents=True)
+        (self.folder / "a.txt").write_bytes(b"a" * 1000)
+        (self.folder / "sub" / "b.bin").write_bytes(os.urandom(3000))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def row(self, path: pathlib.Path, type: str = "file") -> dict:
+        return {"full_path": str(path), "type": type,
+                "size": 0 if type == "folder" else path.stat().st_size, "mtime": 0.0}
+
+    @unittest.skipIf(os.name == "nt", "Symlinks need privileges on Windows")
+    def test_open_file(self):
+        """
+        Symlinks, folders and FIFOs are not opened
+        """
+        file, file_stat = open_file(str(self.folder / "a.txt"))
+        with file:
+            self.assertEqual(1000, file_stat.st_size)
+        link = self.temp_dir_path / "link"
+        link.symlink_to(self.folder / "a.txt")
+        fifo = self.temp_dir_path / "fifo"
+        os.mkfifo(fifo)
+        for path in (link, self.folder, fifo):
+            with self.assertRaises(OSError):
+                open_file(str(path))
+
+    def test_read_range(self):
+        """
+        Only length bytes are read and file is closed
+        """
+        file = open(self.folder / "a.txt", "rb")
+        file.seek(10)
+        self.assertEqual(b"a" * 20, b"".join(read_range(file, 20)))
+        self.assertTrue(file.closed)
+
+    def test_attachment(self):
+        """
+        Names that are not ASCII get filename* too
+        """
+        headers = Headers()
+        set_attachment(headers, "report.pdf")
+        self.assertEqual("attachment; filename=report.pdf", headers["Content-Disposition"])
+        set_attachment(headers, "café.txt")
+        self.assertEqual("attachment; filename=cafe.txt; filename*=UTF-8''caf%C3%A9.txt",
+                         headers["Content-Disposition"])
+
+    def test_stream_zip(self):
+        """
+        Zip has every file and folder, files that can't be read are skipped
+        """
+        rows = [self.row(self.folder / "a.txt"),
+                {"full_path": str(self.folder / "gone.txt"), "type": "file", "size": 1,
+                 "mtime": 0.0},
+                self.row(self.folder / "sub", "folder"),
+                self.row(self.folder / "sub" / "b.bin")]
+        chunks = list(stream_zip(str(self.folder), "folder", rows))
+        self.assertLess(1, len(chunks))
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(["folder/a.txt", "folder/sub/", "folder/sub/b.bin"],
+                             archive.namelist())
+            self.assertEqual((self.folder / "sub" / "b.bin").read_bytes(),
+                             archive.read("folder/sub/b.bin"))
+            # Dates before 1980 can't be stored
+            self.assertEqual(1980, archive.getinfo("folder/a.txt").date_time[0])
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=False, catchbreak=False)
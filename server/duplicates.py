@@ -0,0 +1,120 @@
+"""Content hashes of files for duplicate search"""
+import hashlib
+import time
+from concurrent.futures import Executor
+from typing import Callable, Iterator
+
+from server.download import open_file
+
+BLOCK = 64 * 1024
+"""Bytes read from the start and the end of a file for partial hash"""
+
+
+def partial_hash(path: str, size: int) -> str | None:
+    """
+    Hash first and last BLOCK of a file. Files that are not bigger than two
+    blocks are read whole, so their partial hash is their full hash.
+
+    Args:
+        path (str): File full path.
+        size (int): File size in index.
+
+    Returns:
+        str | None: Hex digest or None if file can't be read, isn't a regular
+        file (symlinks are not followed) or its size changed.
+    """
+    digest = hashlib.blake2b()
+    try:
+        file, file_stat = open_file(path)
+        with file:
+            if file_stat.st_size != size:
+                return None
+            if size <= 2 * BLOCK:
+                digest.update(file.read())
+            else:
+                digest.update(file.read(BLOCK))
+                file.seek(-BLOCK, 2)
+                digest.update(file.read(BLOCK))
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def full_hash(path: str, size: int) -> str | None:
+    """
+    Hash whole file.
+
+    Args:
+        path (str): File full path.
+        size (int): File size in index.
+
+    Returns:
+        str | None: Hex digest or None if file can't be read, isn't a regular
+        file (symlinks are not followed) or its size changed.
+    """
+    digest = hashlib.blake2b()
+    try:
+        file, file_stat = open_file(path)
+        with file:
+            if file_stat.st_size != size:
+                return None
+            while chunk := file.read(16 * BLOCK):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def read_bytes(size: int, hash_function: Callable[[str, int], str | None]) -> int:
+    """Amount of bytes hash function reads from a file of given size"""
+    if hash_function is partial_hash:
+        return min(size, 2 * BLOCK)
+    return size
+
+
+class Throttle():
+    """Keeps amount of read bytes per second under the rate"""
+
+    def __init__(self, rate: float):
+        """
+        Initialize Throttle
+
+        Args:
+            rate (float): Bytes per second.
+        """
+        self.rate = rate
+        self.start = time.monotonic()
+        self.total = 0
+
+    def wait(self, size: int):
+        """Wait until size more bytes can be read"""
+        self.total += size
+        delay = self.total / self.rate - (time.monotonic() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def hash_files(
+    files: list[tuple[str, int]],
+    hash_function: Callable[[str, int], str | None],
+    executor: Executor,
+    throttle: Throttle
+) -> Iterator[tuple[str, str | None]]:
+    """
+    Hash files in a pool of processes.
+
+    Args:
+        files (list[tuple[str, int]]): Full paths and sizes of files.
+        hash_function (Callable[[str, int], str | None]): partial_hash or full_hash.
+        executor (Executor): Pool that runs hash_function.
+        throttle (Throttle): Limits how fast files are read.
+
+    Yields:
+        tuple[str, str | None]: Full path and hash in the same order as files.
+    """
+    futures = []
+    for path, size in files:
+        throttle.wait(read_bytes(size, hash_function))
+        futures.append((path, executor.submit(hash_function, path, size)))
+    for path, future in futures:
+        yield path, future.result()
@@ -0,0 +1,77 @@
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+from server.duplicates import BLOCK, Throttle, full_hash, partial_hash
+
+
+class DuplicatesTest(unittest.TestCase):
+    temp_dir: tempfile.TemporaryDirectory
+    temp_dir_path: pathlib.Path
+
+    def setUp(self):
+        """
+        Creates temporary directory for files to hash
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = pathlib.Path(self.temp_dir.name)
+
+    def tearDown(self):
+        """
+        Deletes temporary directory
+        """
+        self.temp_dir.cleanup()
+
+    def test_partial_hash(self):
+        """
+        Partial hash doesn't depend on the middle of big files and is the full
+        hash of small files
+        """
+        first = self.temp_dir_path / "first"
+        second = self.temp_dir_path / "second"
+        first.write_bytes(b"1" * BLOCK + b"2" * BLOCK + b"3" * BLOCK)
+        second.write_bytes(b"1" * BLOCK + b"4" * BLOCK + b"3" * BLOCK)
+        self.assertEqual(partial_hash(str(first), 3 * BLOCK), partial_hash(str(second), 3 * BLOCK))
+        self.assertNotEqual(full_hash(str(first), 3 * BLOCK), full_hash(str(second), 3 * BLOCK))
+
+        small = self.temp_dir_path / "small"
+        small.write_bytes(b"1" * 10)
+        self.assertEqual(partial_hash(str(small), 10), full_hash(str(small), 10))
+        self.assertIsNone(partial_hash(str(self.temp_dir_path / "missing"), 10))
+
+    @unittest.skipIf(os.name == "nt", "Symlinks need privileges on Windows")
+    def test_special_files(self):
+        """
+        Symlinks, FIFOs and files whose size changed are not hashed
+        """
+        target = self.temp_dir_path / "target"
+        target.write_bytes(b"1" * 3 * BLOCK)
+        for name in ("link1", "link2"):
+            link = self.temp_dir_path / name
+            link.symlink_to(target)
+            size = link.lstat().st_size
+            self.assertIsNone(partial_hash(str(link), size))
+            self.assertIsNone(full_hash(str(link), size))
+        fifo = self.temp_dir_path / "fifo.mp3"
+        os.mkfifo(fifo)
+        self.assertIsNone(partial_hash(str(fifo), 0))
+        self.assertIsNone(partial_hash(str(target), 10))
+        self.assertIsNone(full_hash(str(target), 10))
+
+    def test_throttle(self):
+        """
+        Reading faster than the rate waits
+        """
+        throttle = Throttle(1000)
+        start = time.monotonic()
+        throttle.wait(100)
+        throttle.wait(100)
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+
+if __name__ == '__main__':
+    unittest.main(
+        failfast=False,
+        catchbreak=False
+    )
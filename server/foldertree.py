@@ -0,0 +1,198 @@
+"""In-memory tree of indexed folders"""
+import os
+import threading
+from array import array
+from typing import Iterator
+
+
+class FolderTree():
+    """
+    Indexed folders (and spaces) with their row ids in index. Every folder keeps
+    only its name, a reference to its parent and its children by name, so paths
+    are not repeated, a folder is found with one dict lookup per path level
+    and a subtree is walked through children instead of comparing paths. Ids
+    and parents are kept in arrays, folders without subfolders have no dict.
+
+    Spaces are roots, their name is their full path. Safe to use from many
+    threads, only writer thread changes it.
+    """
+    _NONE = -1
+
+    def __init__(self):
+        # Folders are nodes, node is an index in these arrays
+        self._ids = array("q")
+        self._parents = array("q")
+        # Nodes of subfolders by name, None if folder has no subfolders
+        self._children: list[dict[str, int] | None] = []
+        # None for removed nodes, they are reused
+        self._names: list[str | None] = []
+        self._free: list[int] = []
+        # Node of every space by full path
+        self._roots: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names) - len(self._free)
+
+    def add(self, id: int, path: str, space: bool):
+        """
+        Add a folder. Does nothing if parent folder is not in tree.
+
+        Args:
+            id (int): Row id of the folder.
+            path (str): Folder full path.
+            space (bool): Whether the folder is a space.
+        """
+        with self._lock:
+            if space:
+                parent, name = self._NONE, path
+            else:
+                parent = self._find(os.path.dirname(path))
+                if parent is None:
+                    return
+                name = os.path.basename(path)
+
+            if self._free:
+                node = self._free.pop()
+                self._ids[node] = id
+                self._parents[node] = parent
+                self._children[node] = None
+                self._names[node] = name
+            else:
+                node = len(self._names)
+                self._ids.append(id)
+                self._parents.append(parent)
+                self._children.append(None)
+                self._names.append(name)
+
+            if parent == self._NONE:
+                self._roots[path] = node
+                return
+            children = self._children[parent]
+            if children is None:
+                children = self._children[parent] = {}
+            old = children.get(name)
+            children[name] = node
+            if old is not None:
+                # Folder is added again, nodes of the old one are freed
+                self._free_subtree(old)
+
+    def remove(self, path: str):
+        """Remove a folder and every folder inside of it"""
+        with self._lock:
+            node = self._find(path)
+            if node is None:
+                return
+
+            parent = self._parents[node]
+            if parent == self._NONE:
+                del self._roots[path]
+            else:
+                children = self._children[parent]
+                del children[self._names[node]]
+                if not children:
+                    self._children[parent] = None
+            self._free_subtree(node)
+
+    def move(self, old_path: str, new_path: str):
+        """
+        Move a folder with everything inside of it. Only the folder node is
+        changed. Folder is removed if new parent folder is not in tree.
+
+        Args:
+            old_path (str): Folder full path before moving.
+            new_path (str): Folder full path after moving.
+        """
+        with self._lock:
+            node = self._find(old_path)
+            if node is None:
+                return
+            parent = self._parents[node]
+            if parent == self._NONE:
+                # Spaces are not moved
+                return
+            children = self._children[parent]
+            del children[self._names[node]]
+            if not children:
+                self._children[parent] = None
+
+            new_parent = self._find(os.path.dirname(new_path))
+            if new_parent is None:
+                self._free_subtree(node)
+                return
+            name = os.path.basename(new_path)
+            self._parents[node] = new_parent
+            self._names[node] = name
+            children = self._children[new_parent]
+            if children is None:
+                children = self._children[new_parent] = {}
+            old = children.get(name)
+            children[name] = node
+            if old is not None:
+                self._free_subtree(old)
+
+    def find(self, path: str) -> int | None:
+        """
+        Find a folder.
+
+        Args:
+            path (str): Folder full path.
+
+        Returns:
+            int | None: Row id of the folder, None if it's not in tree.
+        """
+        with self._lock:
+            node = self._find(path)
+            return None if node is None else self._ids[node]
+
+    def walk(self, path: str) -> Iterator[tuple[int, str]]:
+        """
+        Walk a folder and every folder inside of it, parents first.
+
+        Args:
+            path (str): Folder full path.
+
+        Yields:
+            tuple[int, str]: Row id and full path of every folder. Nothing if
+            folder is not in tree.
+        """
+        with self._lock:
+            node = self._find(path)
+            if node is None:
+                return
+            folders = []
+            waiting = [(node, path)]
+            while waiting:
+                current, current_path = waiting.pop()
+                folders.append((self._ids[current], current_path))
+                for name, child in (self._children[current] or {}).items():
+                    waiting.append((child, os.path.join(current_path, name)))
+        # Not locked while caller handles folders
+        yield from folders
+
+    def _free_subtree(self, node: int):
+        waiting = [node]
+        while waiting:
+            current = waiting.pop()
+            waiting.extend((self._children[current] or {}).values())
+            self._children[current] = None
+            self._names[current] = None
+            self._free.append(current)
+
+    def _find(self, path: str) -> int | None:
+        root = self._roots.get(path)
+        if root is not None:
+            return root
+        for root_path, root in self._roots.items():
+            prefix = os.path.join(root_path, "")
+            if not path.startswith(prefix):
+                continue
+
+            node = root
+            for name in path[len(prefix):].split(os.sep):
+                children = self._children[node]
+                node = children.get(name) if children is not None else None
+                if node is None:
+                    return None
+            return node
+        return None
@@ -0,0 +1,88 @@
+import os
+import unittest
+from server.foldertree import FolderTree
+
+
+class FolderTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates tree with a space and a few folders in it
+        """
+        self.tree = FolderTree()
+        self.tree.add(1, "/space", space=True)
+        self.tree.add(2, "/space/folder1", space=False)
+        self.tree.add(3, "/space/folder1/subfolder", space=False)
+        self.tree.add(4, "/space/folder2", space=False)
+
+    def test_find(self):
+        """
+        Folders are found by full path
+        """
+        self.assertEqual(1, self.tree.find("/space"))
+        self.assertEqual(3, self.tree.find("/space/folder1/subfolder"))
+        self.assertIsNone(self.tree.find("/space/folder3"))
+        self.assertIsNone(self.tree.find("/space/folder1/subfolder/folder"))
+        self.assertIsNone(self.tree.find("/other"))
+
+    def test_walk(self):
+        """
+        Walking a folder gives every folder inside of it, paths are restored from names
+        """
+        self.assertEqual(
+            [(2, "/space/folder1"), (3, os.path.join("/space/folder1", "subfolder"))],
+            list(self.tree.walk("/space/folder1"))
+        )
+        self.assertEqual(4, len(list(self.tree.walk("/space"))))
+        self.assertEqual([], list(self.tree.walk("/space/folder3")))
+
+    def test_remove(self):
+        """
+        Removing a folder removes everything inside of it, its place is reused
+        """
+        self.tree.remove("/space/folder1")
+        self.assertIsNone(self.tree.find("/space/folder1/subfolder"))
+        self.assertEqual([(1, "/space"), (4, os.path.join("/space", "folder2"))],
+                         list(self.tree.walk("/space")))
+        self.assertEqual(2, len(self.tree))
+
+        self.tree.add(5, "/space/folder3", space=False)
+        self.assertEqual(5, self.tree.find("/space/folder3"))
+        self.assertEqual(3, len(self.tree))
+
+    def test_add_again(self):
+        """
+        Folder that is added again replaces the old one and folders inside of it
+        """
+        self.tree.add(5, "/space/folder1", space=False)
+        self.assertEqual(5, self.tree.find("/space/folder1"))
+        self.assertIsNone(self.tree.find("/space/folder1/subfolder"))
+        self.assertEqual(3, len(self.tree))
+
+    def test_move(self):
+        """
+        Moved folder keeps its id and folders inside of it
+        """
+        self.tree.move("/space/folder1", "/space/folder2/moved")
+        self.assertIsNone(self.tree.find("/space/folder1"))
+        self.assertEqual(2, self.tree.find("/space/folder2/moved"))
+        self.assertEqual(3, self.tree.find("/space/folder2/moved/subfolder"))
+        self.assertEqual(4, len(self.tree))
+
+        self.tree.move("/space/folder2/moved", "/space/missing/moved")
+        self.assertIsNone(self.tree.find("/space/folder2/moved"))
+        self.assertEqual(2, len(self.tree))
+
+    def test_add_without_parent(self):
+        """
+        Folder without parent in tree is not added
+        """
+        self.tree.add(5, "/space/missing/folder", space=False)
+        self.assertEqual(4, len(self.tree))
+
+
+if __name__ == '__main__':
+    unittest.main(
+        failfast=False,
+        catchbreak=False
+    )
@@ -0,0 +1,303 @@
+"""Compiled rules of paths that are not indexed"""
+import logging
+import os
+import re
+from typing import Iterable
+
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+"""Characters that make an entry of ignore_paths a pattern"""
+
+
+def translate(pattern: str) -> str:
+    """
+    Translate a .gitignore pattern into a regular expression. "*" and "?"
+    don't match "/", "**/" matches any amount of folders and "/**" everything
+    inside. "\\" escapes the next character.
+
+    Args:
+        pattern (str): Pattern without leading "!" and trailing "/".
+
+    Returns:
+        str: Regular expression that matches a whole path with "/" separators.
+    """
+    result = []
+    i = 0
+    while i < len(pattern):
+        character = pattern[i]
+        i += 1
+        if character == "*":
+            if pattern.startswith("*/", i):
+                result.append("(?:.*/)?")
+                i += 2
+            elif pattern.startswith("*", i):
+                result.append(".*")
+                i += 1
+            else:
+                result.append("[^/]*")
+        elif character == "?":
+            result.append("[^/]")
+        elif character == "[" and (end := pattern.find("]", i + 1)) != -1:
+            characters = pattern[i:end].replace("\\", "\\\\")
+            if characters[0] in "!^":
+                characters = "^" + characters[1:]
+            result.append(f"[{characters}]")
+            i = end + 1
+        elif character == "\\" and i < len(pattern):
+            result.append(re.escape(pattern[i]))
+            i += 1
+        else:
+            result.append(re.escape(character))
+    return "".join(result)
+
+
+class RuleSet():
+    """
+    Patterns of one ignore file (or of ignore_paths) compiled for fast checks.
+    Without negated patterns names are looked up in a set, "*.ext" patterns
+    are one str.endswith call and the rest is joined into one regular
+    expression, so checking an entry costs about the same no matter how many
+    patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        """
+        Initialize RuleSet
+
+        Args:
+            patterns (Iterable[str]): Lines of .gitignore format. Empty lines and
+            comments are skipped.
+        """
+        self.rules: list[tuple[str, re.Pattern, bool, bool, bool]] = []
+        """
+        Pattern, its expression, whether it's negated, whether it matches
+        folders only and whether it matches names (otherwise relative paths),
+        in the order of patterns
+        """
+        for line in patterns:
+            line = line.rstrip("\r\n")
+            if not line.endswith("\\ "):
+                line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            folders_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # Patterns with "/" at the start or in the middle are relative
+            # to the folder of the ignore file, others match names at any depth
+            by_name = "/" not in line
+            line = line.lstrip("/")
+            expression = re.compile(translate(line), re.DOTALL)
+            self.rules.append((line, expression, negated, folders_only, by_name))
+
+        self.negated = any(negated for _, _, negated, _, _ in self.rules)
+        """Whether later patterns can include back what earlier ones ignore"""
+        self.by_path = any(not by_name for *_, by_name in self.rules)
+        """Whether any pattern matches relative paths"""
+        # Names, name suffixes, expression of other names and expression of
+        # relative paths by whether entry is a folder
+        self._compiled: dict[bool, tuple[frozenset, tuple, re.Pattern | None, re.Pattern | None]] = {}
+        for is_dir in (False, True):
+            rules = [r for r in self.rules if is_dir or not r[3]]
+            names = set()
+            suffixes = []
+            by_name = []
+            for pattern, expression, _, _, name in rules:
+                if not name:
+                    continue
+                if not GLOB_CHARACTERS.search(pattern) and "\\" not in pattern:
+                    names.add(pattern)
+                elif (pattern.startswith("*") and not GLOB_CHARACTERS.search(pattern, 1)
+                      and "\\" not in pattern):
+                    suffixes.append(pattern[1:])
+                else:
+                    by_name.append(expression.pattern)
+            by_path = [r[1].pattern for r in rules if not r[4]]
+            self._compiled[is_dir] = (frozenset(names), tuple(suffixes),
+                                      self._join(by_name), self._join(by_path))
+
+    @staticmethod
+    def _join(expressions: list[str]) -> re.Pattern | None:
+        if not expressions:
+            return None
+        return re.compile("|".join(f"(?:{e})" for e in expressions), re.DOTALL)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def match(self, relative_path: str, name: str, is_dir: bool) -> bool | None:
+        """
+        Check an entry against patterns, the last matching pattern wins.
+
+        Args:
+            relative_path (str): Path relative to the folder of the patterns
+            with "/" separators, not used if there are no by_path patterns.
+            name (str): Entry name.
+            is_dir (bool): Whether entry is a folder.
+
+        Returns:
+            bool | None: True if ignored, False if included back by a negated
+            pattern, None if no pattern matches.
+        """
+        if not self.negated:
+            names, suffixes, by_name, by_path = self._compiled[is_dir]
+            if (name in names or (suffixes and name.endswith(suffixes))
+                    or (by_name is not None and by_name.fullmatch(name))
+                    or (by_path is not None and by_path.fullmatch(relative_path))):
+                return True
+            return None
+        for _, expression, negated, folders_only, by_name in reversed(self.rules):
+            if folders_only and not is_dir:
+                continue
+            if expression.fullmatch(name if by_name else relative_path):
+                return not negated
+        return None
+
+
+class IgnoreRules():
+    """
+    Decides which entries are not indexed. Ignored folders are not listed at
+    all, so ignoring a big folder saves the whole cost of crawling it.
+
+    Entries of ignore_paths are full paths or .gitignore patterns:
+        /full/path        - this file or folder (checked with a set lookup)
+        /full/*/path      - full paths matching a pattern
+        node_modules      - files and folders with this name at any depth
+        *.tmp             - names matching a pattern at any depth
+        cache/            - folders only
+        build/output      - paths relative to the top of every space
+        **/build/output   - at any depth
+        !keep.tmp         - include back what earlier patterns ignore
+
+    Ignore files (for example .indexxoignore or .gitignore) have the same
+    patterns and apply to the folder they are in and everything below it.
+    Patterns of deeper folders win. Rules are immutable, rules of a folder
+    are derived from rules of its parent with for_folder.
+    """
+
+    def __init__(self, patterns: Iterable[str] = (), ignore_files: Iterable[str] = ()):
+        """
+        Initialize IgnoreRules
+
+        Args:
+            patterns (Iterable[str]): Entries of ignore_paths.
+            ignore_files (Iterable[str]): Names of ignore files that are read
+            from every folder.
+        """
+        self.paths: set[str] = set()
+        """Ignored full paths"""
+        relative = []
+        absolute = []
+        for pattern in map(str, patterns):
+            if not os.path.isabs(pattern):
+                relative.append(pattern)
+            elif GLOB_CHARACTERS.search(pattern):
+                absolute.append(pattern.replace(os.sep, "/"))
+            else:
+                self.paths.add(os.path.normpath(pattern))
+        self.ignore_files = tuple(ignore_files)
+        self.absolute = RuleSet(absolute)
+        """Patterns of full paths"""
+        self.relative = RuleSet(relative)
+        """Patterns relative to the top of spaces"""
+        self.layers: tuple[tuple[str, RuleSet], ...] = ()
+        """Patterns by full path of the folder they are relative to, the deepest last"""
+
+    def _with_layer(self, directory: str, rules: RuleSet) -> "IgnoreRules":
+        derived = object.__new__(IgnoreRules)
+        derived.__dict__.update(self.__dict__)
+        derived.layers = (*self.layers, (os.path.join(directory, ""), rules))
+        return derived
+
+    def for_space(self, space: str) -> "IgnoreRules":
+        """
+        Get rules of the top folder of a space.
+
+        Args:
+            space (str): Space full path.
+
+        Returns:
+            IgnoreRules: Rules with relative patterns of ignore_paths.
+        """
+        if not self.relative:
+            return self
+        return self._with_layer(space, self.relative)
+
+    def for_folder(self, directory: str, names: Iterable[str]) -> "IgnoreRules":
+        """
+        Get rules of entries of a folder, reads its ignore files. Rules are
+        returned as is if the folder has no ignore files.
+
+        Args:
+            directory (str): Folder full path.
+            names (Iterable[str]): Names of entries of the folder.
+
+        Returns:
+            IgnoreRules: Rules of entries of the folder and folders below it.
+        """
+        if not self.ignore_files:
+            return self
+        present = set(names)
+        lines: list[str] = []
+        for name in self.ignore_files:
+            if name not in present:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path, encoding="utf-8", errors="replace") as file:
+                    lines.extend(file)
+            except OSError as e:
+                logging.warning(f"Can't read {path}: {e}")
+        rules = RuleSet(lines)
+        return self._with_layer(directory, rules) if rules else self
+
+    def for_path(self, directory: str, space: str) -> "IgnoreRules":
+        """
+        Get rules of entries of a folder inside of a space, reads ignore files
+        of every folder from the space down to the folder.
+
+        Args:
+            directory (str): Folder full path.
+            space (str): Full path of the space that contains the folder.
+
+        Returns:
+            IgnoreRules: Rules of entries of the folder.
+        """
+        rules = self.for_space(space)
+        if not self.ignore_files:
+            return rules
+        folders = [directory]
+        while folders[-1] != space and os.path.dirname(folders[-1]) != folders[-1]:
+            folders.append(os.path.dirname(folders[-1]))
+        for folder in reversed(folders):
+            names = [n for n in self.ignore_files if os.path.isfile(os.path.join(folder, n))]
+            rules = rules.for_folder(folder, names)
+        return rules
+
+    def ignored(self, path: str, name: str, is_dir: bool) -> bool:
+        """
+        Check whether an entry is ignored.
+
+        Args:
+            path (str): Entry full path.
+            name (str): Entry name.
+            is_dir (bool): Whether entry is a folder.
+
+        Returns:
+            bool: True if entry is not indexed.
+        """
+        if path in self.paths:
+            return True
+        for directory, rules in reversed(self.layers):
+            # Patterns are matched against paths with "/" separators
+            relative_path = path[len(directory):].replace(os.sep, "/") if rules.by_path else ""
+            ignored = rules.match(relative_path, name, is_dir)
+            if ignored is not None:
+                return ignored
+        if self.absolute:
+            # Leading "/" of patterns is dropped like of any other pattern
+            return bool(self.absolute.match(path.replace(os.sep, "/").lstrip("/"), name, is_dir))
+        return False
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from server.ignorerules import IgnoreRules, RuleSet, translate
+
+
+class IgnoreRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates rules with every kind of ignore_paths entry for a space
+        """
+        self.space = os.path.join(os.sep, "space")
+        self.rules = IgnoreRules([
+            os.path.join(self.space, "private") + os.sep,
+            "/space/*/secret",
+            "node_modules",
+            "*.tmp",
+            "cache/",
+            "build/output",
+            "**/logs/*.log",
+        ]).for_space(self.space)
+
+    def ignored(self, relative_path: str, is_dir: bool = False) -> bool:
+        path = os.path.join(self.space, *relative_path.split("/"))
+        return self.rules.ignored(path, os.path.basename(path), is_dir)
+
+    def test_translate(self):
+        """
+        Wildcards don't cross folders except "**"
+        """
+        self.assertRegex("a/b/c.txt", f"^{translate('a/**/*.txt')}$")
+        self.assertRegex("a/c.txt", f"^{translate('a/**/*.txt')}$")
+        self.assertNotRegex("a/b/c.txt", f"^{translate('a/*.txt')}$")
+        self.assertRegex("file1", f"^{translate('file[0-9]')}$")
+        self.assertNotRegex("file1", f"^{translate('file[!0-9]')}$")
+        self.assertRegex("*.txt", f"^{translate(chr(92) + '*.txt')}$")
+        self.assertNotRegex("a.txt", f"^{translate(chr(92) + '*.txt')}$")
+
+    def test_ignored(self):
+        """
+        Full paths, names at any depth, folders only and relative paths
+        """
+        self.assertTrue(self.ignored("private", is_dir=True))
+        self.assertFalse(self.ignored("private2", is_dir=True))
+        self.assertTrue(self.ignored("docs/secret"))
+        self.assertFalse(self.ignored("docs/more/secret"))
+        self.assertTrue(self.ignored("node_modules", is_dir=True))
+        self.assertTrue(self.ignored("a/b/node_modules", is_dir=True))
+        self.assertTrue(self.ignored("a/b/file.tmp"))
+        self.assertTrue(self.ignored("a/cache", is_dir=True))
+        self.assertFalse(self.ignored("a/cache"))
+        self.assertTrue(self.ignored("build/output", is_dir=True))
+        self.assertFalse(self.ignored("a/build/output", is_dir=True))
+        self.assertTrue(self.ignored("a/b/logs/today.log"))
+        self.assertFalse(self.ignored("a/b/today.log"))
+        self.assertFalse(self.ignored("a/b/file.txt"))
+
+    def test_negated(self):
+        """
+        The last matching pattern wins
+        """
+        rules = RuleSet(["*.log", "!keep.log", "# comment", "", "keep.log.*"])
+        self.assertTrue(rules.match("a.log", "a.log", False))
+        self.assertFalse(rules.match("keep.log", "keep.log", False))
+        self.assertTrue(rules.match("keep.log.1", "keep.log.1", False))
+        self.assertIsNone(rules.match("a.txt", "a.txt", False))
+
+    def test_ignore_files(self):
+        """
+        Patterns of ignore files are relative to their folder and win over
+        patterns above them
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            space = Path(temp_dir)
+            (space / "project" / "src").mkdir(parents=True)
+            (space / ".gitignore").write_text("*.o\n/dist\n")
+            (space / "project" / ".gitignore").write_text("!main.o\ndist\n")
+            rules = IgnoreRules(ignore_files=[".gitignore"])
+
+            top = rules.for_folder(str(space), [".gitignore", "project"])
+            self.assertTrue(top.ignored(str(space / "dist"), "dist", True))
+            self.assertTrue(top.ignored(str(space / "main.o"), "main.o", False))
+
+            project = top.for_folder(str(space / "project"), [".gitignore", "src"])
+            self.assertTrue(project.ignored(str(space / "project" / "dist"), "dist", True))
+            self.assertFalse(project.ignored(str(space / "project" / "main.o"), "main.o", False))
+            self.assertTrue(project.ignored(str(space / "project" / "util.o"), "util.o", False))
+
+            # Read from disk when only a path is known
+            src = rules.for_path(str(space / "project" / "src"), str(space))
+            path = space / "project" / "src" / "main.o"
+            self.assertFalse(src.ignored(str(path), "main.o", False))
+            self.assertIs(rules, rules.for_folder(str(space), ["other"]))
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=False, catchbreak=False)
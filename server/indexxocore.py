@@ -1,296 +1,2618 @@
-"""Core indexer functionality"""
-import asyncio
-import logging
-import os
-from pathlib import Path
-
-from peewee import *
-
-# Database object must be declared like this for dynamic database
-# file support. Prepare database file before using it.
-db = SqliteDatabase(None)
-
-
-class BaseModel(Model):
-    """This is a recommended way from peewee documentation"""
-    class Meta:
-        database = db
-
-
-class FileObjectBase(BaseModel):
-    """Represents one file/folder/space as a row in database"""
-
-    full_path = TextField(primary_key=True)
-    """Full path to this file/folder (Formatted as provided by pathlib)"""
-    full_name = TextField()
-    """Full file name with extension, without path"""
-    name = TextField()
-    """File name without extension"""
-    extension = TextField(null=True)
-    """File extension. Can be None/null for folders"""
-    size = IntegerField()
-    """Size of this file/folder in bytes"""
-
-    type = TextField()
-    """
-    File/folder type. Types are:
-
-    space — Top level folders that were that contain file and folders.
-    
-    folder — Contains folders and files.
-    
-    document — Anything that usually has some sort of text.
-
-    image — Different picture files.
-
-    video — Moving pictures.
-
-    audio — Music, songs, audio files.
-
-    archive — Archives and similar compressed files.
-
-    program — Executable applications.
-
-    other — Anything else.
-    """
-    parent = TextField(null=True)
-    """Parent folder path. Can be None/null for top level folders"""
-    mtime = FloatField()
-    """Last modified date"""
-
-    def to_json(self):
-        """
-        Convert this object into a json. Needed for WEB API.
-        """
-        return {
-            "full_path": self.full_path,
-            "full_name": self.full_name,
-            "name": self.name,
-            "extension": self.extension,
-            "size": self.size,
-            "type": self.type,
-            "parent": self.parent,
-            "mtime": self.mtime
-        }
-
-
-class Indexxo():
-    """File indexer."""
-    filetypes: dict = {}
-    """File types dictionary. Extension (key) and file type (value)."""
-    space_paths: list[Path] = []
-    """List of paths that will be indexed while indexing"""
-    ignore_paths: list[Path] = []
-    """List of paths that will be ignored while indexing"""
-    refresh_interval = 3600
-    """Seconds between refreshing index"""
-    loop = asyncio.new_event_loop()
-    """Loop for async tasks"""
-
-    def __init__(
-        self,
-        filetypes: dict,
-        space_paths: list[Path],
-        ignore_paths: list[Path],
-        refresh_interval: int
-    ):
-        """
-        Initialize Indexer
-
-        Args:
-            filetypes (dict): Key-value pair of extensions and associated types.
-            space_paths (list[Path]): Paths that will be indexed right after indexer start up.
-            ignore_paths (list[Path]): Paths that will not be indexed.
-            refresh_interval (int): Amount of seconds between successful index refreshes.
-        """
-        self.setup_database()
-        self.filetypes = filetypes
-        self.space_paths = space_paths
-        self.ignore_paths = ignore_paths
-        self.refresh_interval = refresh_interval
-
-    def setup_database(self):
-        """
-        Connects to database, creates tables if needed and clears them.
-        """
-        db.init("database.sqlite")
-        db.connect()
-        # This will not fail even if table already exists.
-        db.create_tables([FileObjectBase])
-        FileObjectBase.delete().execute()
-
-    def start_indexing(self):
-        """
-        Start indexer loop. Refreshes index periodically.
-        """
-        async def looper():
-            while True:
-                logging.info("REFRESHING THE INDEX")
-                FileObjectBase.delete().execute()
-
-                all_spaces = self.space_paths.copy()
-                for space in all_spaces:
-                    await self._discover(space)
-
-                await asyncio.sleep(self.refresh_interval)
-                logging.info("REFRESH SUCCESSFUL")
-
-        self.loop.run_until_complete(looper())
-
-    async def add_space(self, path: Path):
-        """
-        Add specified path to list of indexed paths.
-        If space was added while refreshing the index, this space will
-        be indexed concurrently.
-        """
-        await self._discover(path)
-        self.space_paths.append(path)
-
-    def get_spaces(self) -> list[FileObjectBase]:
-        """
-        Get list of all row from database with type 'space'.
-
-        Returns:
-            list[FileObjectBase]: List of spaces (indexed top-level folder)
-        """
-        return (FileObjectBase.select().where(
-            FileObjectBase.type == "space"
-        ))
-
-    def get_content(self, path: Path) -> tuple[list[FileObjectBase], FileObjectBase | None]:
-        """
-        Get content of the specified folder. IF folder doesn't exist, will return same as if 
-        the folder was empty.
-
-        Args:
-            path (Path): Folder full path.
-
-        Returns:
-            tuple[list[FileObjectBase], FileObjectBase | None]: Returns multiple things: list 
-            of children files/folders, parent object. Folder can be empty and parent folder is 
-            None for top-level folders and spaces.
-        """
-        content: list[FileObjectBase] = (FileObjectBase.select().where(
-            FileObjectBase.parent == path
-        ))
-
-        # Need to explicitly set empty list if folder is empty.
-        if content.count() == 0:
-            content = []
-
-        parent: FileObjectBase | None = (FileObjectBase.get_or_none(
-            FileObjectBase.full_path == path.parent
-        ))
-
-        return content, parent
-
-    def find_files(self, query: str) -> list[FileObjectBase]:
-        """Find file or folder with the same full name.
-
-        Args:
-            query (str): String to match.
-
-        Returns:
-            list[FileObjectBase]: List of matches.
-        """
-        query = query.lower()
-        search_res: list[FileObjectBase] = (FileObjectBase.select().where(
-            # No need to lower in database
-            (FileObjectBase.full_name.contains(query))
-        ))
-        return search_res
-
-    async def _discover(self, path: Path):
-        """Indexes folder and adds it's file/folders to index.
-
-        Args:
-            path (Path): Folder full path.
-        """
-        all_files: list[dict] = []
-        # Storing folder sizes like this for performance.
-        folder_sizes: dict[Path] = {}
-        for directory, folders, files in os.walk(path, topdown=False):
-            directory = Path(directory)
-            # Ignoring if needed
-            if directory in self.ignore_paths:
-                continue
-
-            sizes = 0
-
-            for file in files:
-                file_path = directory / Path(file)
-                # Ignoring if needed
-                if file_path in self.ignore_paths:
-                    continue
-
-                full_name = file_path.name
-                name, ext = os.path.splitext(file)
-                type = self._get_file_type(ext[1:])
-                size = file_path.stat().st_size
-                parent = str(file_path.parent)
-                mtime = file_path.stat().st_mtime
-
-                sizes += size
-
-                all_files.append(
-                    {
-                        "full_path": file_path,
-                        "full_name": full_name,
-                        "name": name,
-                        "extension": ext,
-                        "type": type,
-                        "size": size,
-                        "parent": parent,
-                        "mtime": mtime
-                    }
-                )
-
-            # Getting sizes of children folders
-            for folder in folders:
-                full_folder_path = directory / Path(folder)
-                # Ignoring if needed
-                if full_folder_path in self.ignore_paths:
-                    continue
-
-                sizes += folder_sizes[full_folder_path]
-
-            # Adding directory
-            all_files.append(
-                {
-                    "full_path": directory,
-                    "full_name": os.path.basename(directory),
-                    "name": os.path.basename(directory),
-                    "extension": None,
-                    "type": "folder",
-                    # We calculate ignored files too (probably will be changed)
-                    "size": sizes,
-                    "parent": directory.parent,
-                    "mtime": directory.stat().st_mtime
-                }
-            )
-            folder_sizes.update({directory: sizes})
-
-        # Can be 0 for empty folders.
-        if len(all_files) > 1:
-            # Last element is always the top directory, i.e. space
-            space = all_files[-1]
-            space["type"] = "space"
-            space["parent"] = None
-
-        # Bigger chunk sizes crash sqlite
-        for batch in chunked(all_files, 500):
-            FileObjectBase.insert_many(batch).execute()
-
-    def _get_file_type(self, ext: str) -> str:
-        """Get file type by it's extension.
-
-        Args:
-            ext (str): Extension
-
-        Returns:
-            str: File type.
-        """
-        try:
-            return self.filetypes[ext]
-        except KeyError:
-            return "other"
+"""Core indexer functionality"""
+import asyncio
+import base64
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import stat
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from peewee import *
+from peewee import Expression, ModelSelect
+from playhouse.pool import PooledSqliteDatabase
+from playhouse.sqlite_ext import FTS5Model, SearchField
+
+from server.crawler import Crawler
+from server.ignorerules import IgnoreRules
+from server.foldertree import FolderTree
+from server.metrics import IndexerMetrics
+from server.recentsearches import RecentSearches
+from server.scheduler import Scheduler, SpaceSchedule
+from server.searchquery import SearchQuery
+from server.duplicates import BLOCK, Throttle, full_hash, hash_files, partial_hash
+from server.media import MEDIA_TYPES, extract_media, media_key, media_row, thumbnail_path
+from server.watcher import Watcher, WatchLimitError
+
+# Database object must be declared like this for dynamic database
+# file support. Prepare database file before using it.
+db = SqliteDatabase(None)
+"""Writer connection. Only indexer writes into index, see Indexxo.writer"""
+
+READ_CONNECTIONS = 16
+"""Maximum amount of read-only connections that are open at the same time"""
+# Read-only connections for WEB API. Every request takes a connection from the
+# pool and returns it when finished, see IndexxoServer.
+read_db = PooledSqliteDatabase(None, max_connections=READ_CONNECTIONS, timeout=10)
+
+SCHEMA_VERSION = 6
+"""
+Version of database layout. Older index is upgraded with MIGRATIONS, otherwise
+it's rebuilt from scratch when version doesn't match.
+"""
+
+
+class BaseModel(Model):
+    """This is a recommended way from peewee documentation"""
+    class Meta:
+        database = db
+
+
+class FileObjectBase(BaseModel):
+    """Represents one file/folder/space as a row in database"""
+
+    id = IntegerField(primary_key=True)
+    """
+    Row id, same as SQLite rowid. Ids are given by indexer (see Indexxo._new_id)
+    and are kept while the path is in index.
+    """
+    full_path = TextField(unique=True)
+    """Full path to this file/folder (Formatted as provided by pathlib)"""
+    full_name = TextField()
+    """Full file name with extension, without path"""
+    name = TextField()
+    """File name without extension"""
+    extension = TextField(null=True)
+    """File extension. Can be None/null for folders"""
+    size = IntegerField()
+    """Size of this file/folder in bytes"""
+
+    type = TextField()
+    """
+    File/folder type. Types are:
+
+    space — Top level folders that were that contain file and folders.
+    
+    folder — Contains folders and files.
+    
+    document — Anything that usually has some sort of text.
+
+    image — Different picture files.
+
+    video — Moving pictures.
+
+    audio — Music, songs, audio files.
+
+    archive — Archives and similar compressed files.
+
+    program — Executable applications.
+
+    other — Anything else.
+    """
+    parent_id = IntegerField(null=True)
+    """Id of parent folder. Can be None/null for top level folders"""
+    mtime = FloatField()
+    """Last modified date"""
+
+    def to_json(self):
+        """
+        Convert this object into a json. Needed for WEB API.
+        """
+        return row_json({
+            "id": self.id,
+            "full_path": self.full_path,
+            "full_name": self.full_name,
+            "name": self.name,
+            "extension": self.extension,
+            "size": self.size,
+            "type": self.type,
+            "parent_id": self.parent_id,
+            "mtime": self.mtime
+        })
+
+
+def row_json(row: dict) -> dict:
+    """
+    Convert a row of FileObjectBase that was read as dict into a json, same
+    as FileObjectBase.to_json. Full path of parent folder is added for clients
+    that don't use ids.
+    """
+    return dict(row, parent=None if row["parent_id"] is None
+                else os.path.dirname(row["full_path"]))
+
+
+SORT_FIELDS = {
+    "name": FileObjectBase.full_name,
+    "size": FileObjectBase.size,
+    "mtime": FileObjectBase.mtime,
+    "type": FileObjectBase.type,
+}
+"""Fields that lists can be sorted by"""
+
+
+class Page():
+    """
+    One page of a sorted query. Pages are continued from the last row of
+    previous page (keyset pagination), so getting far pages is as fast as the
+    first one.
+
+    Rows are read from database cursor while iterating, so a page can be
+    streamed without keeping all of its rows in memory. Page can be iterated
+    once.
+    """
+    next: str | None = None
+    """
+    Cursor of the next page, None if this is the last page. Known after
+    iterating over the page.
+    """
+
+    def __init__(
+        self,
+        query: ModelSelect,
+        sort: str = "name",
+        order: str = "asc",
+        limit: int | None = None,
+        after: str | None = None
+    ):
+        """
+        Initialize Page
+
+        Args:
+            query (ModelSelect): Query that selects FileObjectBase rows (models
+            or dicts).
+            sort (str): One of SORT_FIELDS.
+            order (str): "asc" or "desc".
+            limit (int | None): Maximum amount of rows in page. All rows if None.
+            after (str | None): Cursor of previous page, see next.
+
+        Raises:
+            ValueError: Unknown sort or order or invalid cursor.
+        """
+        check_sort(sort, order)
+        self.field = SORT_FIELDS[sort]
+        key = Tuple(self.field, FileObjectBase.id)
+        if after is not None:
+            last = Tuple(*_decode_cursor(after))
+            query = query.where(key > last if order == "asc" else key < last)
+        if order == "asc":
+            query = query.order_by(self.field, FileObjectBase.id)
+        else:
+            query = query.order_by(self.field.desc(), FileObjectBase.id.desc())
+        if limit is not None:
+            # One more row tells if there is a next page
+            query = query.limit(limit + 1)
+        self.query = query
+        self.limit = limit
+
+    def __iter__(self) -> Iterator[FileObjectBase | dict]:
+        last_row = None
+        for i, row in enumerate(self.query.iterator()):
+            if i == self.limit:
+                self.next = _encode_cursor(*(
+                    (last_row[self.field.name], last_row["id"])
+                    if isinstance(last_row, dict) else
+                    (getattr(last_row, self.field.name), last_row.id)
+                ))
+                break
+            last_row = row
+            yield row
+
+
+def check_sort(sort: str, order: str):
+    """
+    Check sort and order of a list, see Page.
+
+    Raises:
+        ValueError: Unknown sort or order.
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Can't sort by {sort}, use one of: {', '.join(SORT_FIELDS)}")
+    if order not in ("asc", "desc"):
+        raise ValueError("Order must be asc or desc")
+
+
+def paginate(
+    query: ModelSelect,
+    sort: str = "name",
+    order: str = "asc",
+    limit: int | None = None,
+    after: str | None = None
+) -> tuple[list[FileObjectBase], str | None]:
+    """
+    Sort query and get one page of it, see Page.
+
+    Args:
+        query, sort, order, limit, after: See Page.
+
+    Raises:
+        ValueError: Unknown sort or order or invalid cursor.
+
+    Returns:
+        tuple[list[FileObjectBase], str | None]: Rows in this page and cursor for
+        the next page. Cursor is None if this is the last page.
+    """
+    page = Page(query, sort, order, limit, after)
+    rows = list(page)
+    return rows, page.next
+
+
+def _encode_cursor(value, id: int) -> str:
+    data = json.dumps([value, id]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    # Anything else would only fail when the query runs
+    if (isinstance(value, bool) or not isinstance(value, (str, int, float))
+            or isinstance(id, bool) or not isinstance(id, int)):
+        raise ValueError("Invalid cursor")
+    return value, id
+
+
+def _phrase(query: str) -> str:
+    """Whole query is one phrase, trigram phrase matches any substring"""
+    return '"' + query.replace('"', '""') + '"'
+
+
+def in_subtree(field: Field, path: str) -> Expression:
+    """
+    Build expression that matches the path itself and everything inside of it.
+    Uses range comparison instead of LIKE, so index on the field can be used
+    and the match is case sensitive.
+
+    Args:
+        field (Field): Field with full paths.
+        path (str): Folder full path.
+
+    Returns:
+        Expression: Expression to use in where clause.
+    """
+    prefix = os.path.join(path, "")
+    # Every path that starts with prefix is between prefix and the next string
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (field == path) | ((field >= prefix) & (field < upper))
+
+
+def current_version(model: type[Model]) -> Expression:
+    """
+    Build expression that matches a row of FileHash or FileMedia with the row
+    of its file. Rows are valid while size and last modified date of the file
+    are the same as when they were written.
+
+    Args:
+        model (type[Model]): FileHash or FileMedia.
+
+    Returns:
+        Expression: Join condition with FileObjectBase.
+    """
+    return ((model.id == FileObjectBase.id) & (model.mtime == FileObjectBase.mtime) &
+            (model.size == FileObjectBase.size))
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Start a pool of processes. Processes are spawned, forking a process with
+    running threads is not safe.
+    """
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+class FileSearch(FTS5Model):
+    """
+    Full text search index of file/folder names. Uses trigram tokenizer, so any
+    substring of 3 or more characters can be found without scanning the whole
+    index. Doesn't store names itself, see SEARCH_TRIGGERS.
+    """
+
+    full_name = SearchField()
+    """Same as FileObjectBase.full_name"""
+
+    class Meta:
+        database = db
+        options = {
+            "content": FileObjectBase,
+            "content_rowid": "rowid",
+            "tokenize": "trigram"
+        }
+
+
+SEARCH_TRIGGERS = {
+    "filesearch_ai": """AFTER INSERT ON fileobjectbase BEGIN
+        INSERT INTO filesearch(rowid, full_name) VALUES (new.rowid, new.full_name);
+    END""",
+    "filesearch_ad": """AFTER DELETE ON fileobjectbase BEGIN
+        INSERT INTO filesearch(filesearch, rowid, full_name)
+        VALUES ('delete', old.rowid, old.full_name);
+    END""",
+    "filesearch_au": """AFTER UPDATE OF full_name ON fileobjectbase BEGIN
+        INSERT INTO filesearch(filesearch, rowid, full_name)
+        VALUES ('delete', old.rowid, old.full_name);
+        INSERT INTO filesearch(rowid, full_name) VALUES (new.rowid, new.full_name);
+    END""",
+}
+"""Keep FileSearch in sync with every insert, update and delete of FileObjectBase"""
+
+INDEXES = {
+    # Listing folder content sorted by any of SORT_FIELDS. Every index ends
+    # with id (rowid) implicitly, it makes order stable for pagination. Also
+    # used for lookups by parent only.
+    "fileobjectbase_parent_name": ("parent_id", "full_name"),
+    "fileobjectbase_parent_size": ("parent_id", "size"),
+    "fileobjectbase_parent_mtime": ("parent_id", "mtime"),
+    "fileobjectbase_parent_type": ("parent_id", "type"),
+    # Spaces, biggest files and folders of a type
+    "fileobjectbase_type_size": ("type", "size"),
+    # Biggest files and folders
+    "fileobjectbase_size": ("size",),
+}
+"""Secondary indexes of FileObjectBase by their names"""
+
+PRAGMAS = {
+    # Readers are not blocked while index is written
+    "journal_mode": "wal",
+    # No fsync on every commit, database stays consistent in WAL mode
+    "synchronous": "normal",
+    # In KiB when negative
+    "cache_size": -64 * 1024,
+    "temp_store": "memory",
+}
+"""Applied to writer connection"""
+
+READ_PRAGMAS = {
+    "cache_size": -16 * 1024,
+    "temp_store": "memory",
+}
+"""Applied to every read-only connection"""
+
+TRANSACTION_ROWS = 5000
+"""Amount of changed rows written in one transaction while refreshing index"""
+
+TRIGRAM = 3
+"""Shortest query that can be looked up in FileSearch"""
+
+SEARCH_QUERIES = 16
+"""Amount of recent search queries whose matches are kept, see RecentSearches"""
+
+SEARCH_MATCHES = 10_000
+"""
+Most matches of a search query that are kept. Queries with more matches are
+searched in index every time.
+"""
+
+SEARCH_SECONDS = 0.02
+"""Longest time of reading matches of a search query to keep them"""
+
+_MATCH_SORT = {"name": 2, "size": 3, "mtime": 4, "type": 5}
+"""
+Positions of SORT_FIELDS in kept matches of search queries. Match is lowercase
+name, id, full name, size, mtime and type.
+"""
+
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+"""Amount of processes hashing files"""
+
+HASH_BATCH = 1000
+"""Amount of files that are read from index or hashed at once"""
+
+MEDIA_WORKERS = min(4, os.cpu_count() or 1)
+"""Amount of processes reading metadata and making thumbnails"""
+
+MEDIA_BATCH = 200
+"""Amount of media files that are read from index or examined at once"""
+
+DOWNLOAD_BATCH = 1000
+"""
+Amount of rows read from index at once while a folder is downloaded, no read
+transaction is open while files are sent
+"""
+
+WATCH_DELAY = 1.0
+"""
+Seconds to collect file system changes before writing them into index, many
+changes of the same file are written once
+"""
+
+
+class SpaceScan(BaseModel):
+    """Marks the last completed refresh of a space"""
+
+    full_path = TextField(primary_key=True)
+    """Space full path"""
+    completed = FloatField()
+    """When the last refresh of this space was committed (Unix time)"""
+    ignore_rules = TextField(null=True)
+    """
+    ignore_paths and ignore_files the refresh used, see
+    Indexxo._ignore_fingerprint. Every folder is listed when they change.
+    """
+
+
+class FolderStats(BaseModel):
+    """
+    Rollup of files of one type inside of a folder (recursively), one row per
+    folder and type. Folders without files have no rows.
+    """
+
+    folder_id = IntegerField()
+    """Id of the folder or space in FileObjectBase"""
+    type = TextField()
+    """File type, see FileObjectBase.type"""
+    files = IntegerField()
+    """Amount of files"""
+    size = IntegerField()
+    """Total size of files in bytes"""
+    newest = FloatField(null=True)
+    """
+    Last modified date of the newest file. Files removed between refreshes
+    are not taken into account until the next refresh.
+    """
+    oldest = FloatField(null=True)
+    """Last modified date of the oldest file, same as newest"""
+
+    class Meta:
+        primary_key = CompositeKey("folder_id", "type")
+
+
+class FileHash(BaseModel):
+    """
+    Content hashes of a file, see server.duplicates. Hashes are valid while
+    size and last modified date of the file are the same as in FileObjectBase.
+    """
+
+    id = IntegerField(primary_key=True)
+    """Id of the file in FileObjectBase"""
+    size = IntegerField()
+    """File size when it was hashed"""
+    mtime = FloatField()
+    """File last modified date when it was hashed"""
+    partial = TextField(null=True)
+    """Hash of the first and the last block"""
+    full = TextField(null=True)
+    """
+    Hash of the whole file. Only files with the same size and partial hash
+    as other files are hashed whole.
+    """
+
+    class Meta:
+        indexes = (
+            (("size", "partial"), False),
+            (("full", "size"), False),
+        )
+
+
+class FileMedia(BaseModel):
+    """
+    Metadata of an image, video or audio file, see server.media. Valid while
+    size and last modified date of the file are the same as in FileObjectBase,
+    same as FileHash. Thumbnails are files in media_directory named by
+    media_key.
+    """
+
+    id = IntegerField(primary_key=True)
+    """Id of the file in FileObjectBase"""
+    size = IntegerField()
+    """File size when it was examined"""
+    mtime = FloatField()
+    """File last modified date when it was examined"""
+    width = IntegerField(null=True)
+    """Image width in pixels, None if unknown or not an image"""
+    height = IntegerField(null=True)
+    """Image height in pixels, None if unknown or not an image"""
+    duration = FloatField(null=True)
+    """Video or audio duration in seconds, None if unknown"""
+    thumbnail = BooleanField(default=False)
+    """Whether thumbnail was made"""
+
+
+def add_file_stats(stats: dict[str, list], file: dict, sign: int = 1):
+    """
+    Count file in rollup of a folder.
+
+    Args:
+        stats (dict[str, list]): Rollup of a folder, lists of files, size, newest
+        and oldest by type, see FolderStats.
+        file (dict): File row.
+        sign (int): -1 to subtract the file, newest and oldest are not changed then.
+    """
+    mtime = file["mtime"] if sign > 0 else None
+    add_stats(stats, {file["type"]: [sign, sign * file["size"], mtime, mtime]})
+
+
+def add_stats(stats: dict[str, list], other: dict[str, list]):
+    """
+    Add one rollup to another, see add_file_stats.
+
+    Args:
+        stats (dict[str, list]): Rollup that is updated.
+        other (dict[str, list]): Rollup that is added.
+    """
+    for type, (files, size, newest, oldest) in other.items():
+        current = stats.get(type)
+        if current is None:
+            stats[type] = [files, size, newest, oldest]
+            continue
+        current[0] += files
+        current[1] += size
+        if newest is not None:
+            current[2] = newest if current[2] is None else max(current[2], newest)
+        if oldest is not None:
+            current[3] = oldest if current[3] is None else min(current[3], oldest)
+
+
+class IndexWriter():
+    """
+    Writes changes of index in batches. Every batch is one transaction and every
+    insert statement has as many rows as SQLite variables limit allows.
+    """
+
+    def __init__(
+        self,
+        on_commit: Callable[[], None] | None = None,
+        metrics: IndexerMetrics | None = None
+    ):
+        """
+        Initialize IndexWriter
+
+        Args:
+            on_commit (Callable[[], None] | None): Called after a batch is
+            committed. Not called if batch is written inside of an outer
+            transaction, its owner reports the commit.
+            metrics (IndexerMetrics | None): Gets durations of batches and
+            amount of written changes if provided.
+        """
+        self.on_commit = on_commit
+        self.metrics = metrics
+        limit = 999
+        if hasattr(sqlite3.Connection, "getlimit"):
+            limit = db.connection().getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+        self.insert_rows = max(1, limit // len(FileObjectBase._meta.sorted_fields))
+        """Amount of rows in one insert statement"""
+        self.delete_rows = limit
+        """Amount of paths in one delete statement"""
+        self.stats_rows = max(1, limit // len(FolderStats._meta.sorted_fields))
+        """Amount of FolderStats rows in one insert statement"""
+        self.upserts: list[dict] = []
+        self.deletes: list[str] = []
+        self.subtree_deletes: list[tuple[str, bool]] = []
+        self.stats_upserts: list[dict] = []
+        self.stats_deletes: list[tuple[int, str]] = []
+        self.written = 0
+        """Total amount of written changes"""
+
+    def upsert(self, row: dict):
+        """Insert a row or update existing one with the same full path"""
+        self.upserts.append(row)
+        self._flush_if_full()
+
+    def delete(self, full_path: str):
+        """Delete one row"""
+        self.deletes.append(full_path)
+        self._flush_if_full()
+
+    def delete_subtree(self, full_path: str, include_self: bool = True):
+        """Delete a folder and everything inside of it, rollups included"""
+        self.subtree_deletes.append((full_path, include_self))
+        self._flush_if_full()
+
+    def upsert_stats(self, row: dict):
+        """Insert or update one row of FolderStats"""
+        self.stats_upserts.append(row)
+        self._flush_if_full()
+
+    def delete_stats(self, folder_id: int, type: str):
+        """Delete one row of FolderStats"""
+        self.stats_deletes.append((folder_id, type))
+        self._flush_if_full()
+
+    def _pending(self) -> int:
+        return (len(self.upserts) + len(self.deletes) + len(self.subtree_deletes) +
+                len(self.stats_upserts) + len(self.stats_deletes))
+
+    def _flush_if_full(self):
+        if self._pending() >= TRANSACTION_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Write everything that was queued in one transaction"""
+        start = time.perf_counter()
+        with db.atomic():
+            for full_path, include_self in self.subtree_deletes:
+                condition = in_subtree(FileObjectBase.full_path, full_path)
+                # Folder is replaced with a file if it's not included, its
+                # rollups are removed anyway
+                (FolderStats.delete().where(FolderStats.folder_id.in_(
+                    FileObjectBase.select(FileObjectBase.id).where(condition)
+                )).execute())
+                if not include_self:
+                    condition &= FileObjectBase.full_path != full_path
+                FileObjectBase.delete().where(condition).execute()
+            for batch in chunked(self.deletes, self.delete_rows):
+                (FileObjectBase.delete().where(
+                    FileObjectBase.full_path.in_(batch)
+                ).execute())
+            for batch in chunked(self.upserts, self.insert_rows):
+                (FileObjectBase.insert_many(batch).on_conflict(
+                    conflict_target=[FileObjectBase.full_path],
+                    # Row keeps its id
+                    preserve=[f for f in FileObjectBase._meta.sorted_fields
+                              if f is not FileObjectBase.id and
+                              f is not FileObjectBase.full_path]
+                ).execute())
+            # Two variables per row
+            for batch in chunked(self.stats_deletes, self.delete_rows // 2):
+                (FolderStats.delete().where(
+                    Tuple(FolderStats.folder_id, FolderStats.type).in_(batch)
+                ).execute())
+            for batch in chunked(self.stats_upserts, self.stats_rows):
+                (FolderStats.insert_many(batch).on_conflict(
+                    conflict_target=[FolderStats.folder_id, FolderStats.type],
+                    preserve=[FolderStats.files, FolderStats.size,
+                              FolderStats.newest, FolderStats.oldest]
+                ).execute())
+        self.written += self._pending()
+        if self.metrics is not None and self._pending():
+            self.metrics.writes.observe(time.perf_counter() - start)
+            self.metrics.rows_written += self._pending()
+        if self.on_commit is not None and not db.in_transaction():
+            self.on_commit()
+        self.upserts = []
+        self.deletes = []
+        self.subtree_deletes = []
+        self.stats_upserts = []
+        self.stats_deletes = []
+
+
+class Refresh():
+    """
+    State of refreshing one folder, see Indexxo._discover. Folders are walked
+    in one thread and compared with index and written in writer thread.
+    """
+
+    def __init__(
+        self,
+        top: str,
+        space: bool,
+        known: dict | None,
+        top_parent_id: int | None,
+        bulk_load: bool,
+        crawler: Crawler,
+        writer: IndexWriter,
+        relist: bool = False
+    ):
+        """
+        Initialize Refresh
+
+        Args:
+            top (str): Folder full path.
+            space (bool): Whether the folder is a space.
+            known (dict | None): Row of the folder that is currently in index.
+            top_parent_id (int | None): Id of folder above it.
+            bulk_load (bool): Whether index was empty, indexes are built after
+            loading even if refresh fails. False after they are built.
+            crawler (Crawler): Crawler that walks the folder.
+            writer (IndexWriter): Writer of changes.
+            relist (bool): Whether every folder is listed, see Crawler.crawl.
+        """
+        self.top = top
+        self.space = space
+        self.known = known
+        self.top_parent_id = top_parent_id
+        self.bulk_load = bulk_load
+        self.crawler = crawler
+        self.writer = writer
+        self.relist = relist
+        self.known_folders: dict[str, dict] = {top: known} if known else {}
+        """
+        Rows of folders that are currently in index by full path. Walking
+        thread adds children of a folder before the folder is passed on.
+        """
+        self.folders: list[dict] = []
+        """Walked folders, sizes are known after walking, so they are written last"""
+        self.folder_ids: dict[str, int] = {}
+        """Ids of walked folders by full path"""
+        self.stats: dict[str, dict[str, list]] = {}
+        """
+        Rollups of folders, see add_file_stats. Only files of the folder itself
+        while walking, folders inside are added after walking.
+        """
+
+
+def _migrate_to_2():
+    """Indexes are managed by name, see INDEXES"""
+    for old in ("parent_full_name_full_path", "parent_size_full_path",
+                "parent_mtime_full_path", "parent_type_full_path"):
+        db.execute_sql(f'DROP INDEX IF EXISTS "fileobjectbase_{old}"')
+
+
+def _migrate_to_3():
+    """Type index is extended with size, see INDEXES"""
+    db.execute_sql('DROP INDEX IF EXISTS "fileobjectbase_type"')
+
+
+def _migrate_to_4():
+    """
+    Rows get ids and ids of their parents instead of parent paths. Ids are
+    rowids of old rows, so search index stays valid.
+    """
+    db.execute_sql('ALTER TABLE "fileobjectbase" RENAME TO "fileobjectbase_old"')
+    FileObjectBase.create_table()
+    db.execute_sql(
+        'INSERT INTO "fileobjectbase" ("id", "full_path", "full_name", "name", '
+        '"extension", "size", "type", "parent_id", "mtime") '
+        'SELECT f.rowid, f.full_path, f.full_name, f.name, f.extension, f.size, '
+        'f.type, p.rowid, f.mtime FROM "fileobjectbase_old" f '
+        'LEFT JOIN "fileobjectbase_old" p ON p.full_path = f.parent')
+    # Secondary indexes and search triggers are dropped with the table
+    db.execute_sql('DROP TABLE "fileobjectbase_old"')
+    if FileSearch.table_exists():
+        for name, trigger in SEARCH_TRIGGERS.items():
+            db.execute_sql(f'CREATE TRIGGER IF NOT EXISTS "{name}" {trigger}')
+
+
+def _has_column(table: str, column: str) -> bool:
+    """Whether table exists and has the column, tables could be made by any version"""
+    return any(c.name == column for c in db.get_columns(table))
+
+
+def _migrate_to_5():
+    """
+    Rollups and hashes refer to rows by id instead of full path, so they are
+    kept when folders are moved. Metadata is read again, keys of thumbnails
+    changed.
+    """
+    if _has_column("folderstats", "full_path"):
+        db.execute_sql('ALTER TABLE "folderstats" RENAME TO "folderstats_old"')
+        FolderStats.create_table()
+        db.execute_sql(
+            'INSERT INTO "folderstats" ("folder_id", "type", "files", "size", "newest", '
+            '"oldest") SELECT f.id, s.type, s.files, s.size, s.newest, s.oldest '
+            'FROM "folderstats_old" s JOIN "fileobjectbase" f ON f.full_path = s.full_path')
+        db.execute_sql('DROP TABLE "folderstats_old"')
+    if _has_column("filehash", "full_path"):
+        # Names of indexes are kept by renamed table
+        db.execute_sql('DROP INDEX IF EXISTS "filehash_size_partial"')
+        db.execute_sql('DROP INDEX IF EXISTS "filehash_full_size"')
+        db.execute_sql('ALTER TABLE "filehash" RENAME TO "filehash_old"')
+        FileHash.create_table()
+        db.execute_sql(
+            'INSERT INTO "filehash" ("id", "size", "mtime", "partial", "full") '
+            'SELECT f.id, h.size, h.mtime, h.partial, h.full '
+            'FROM "filehash_old" h JOIN "fileobjectbase" f ON f.full_path = h.full_path')
+        db.execute_sql('DROP TABLE "filehash_old"')
+    db.execute_sql('DROP TABLE IF EXISTS "filemedia"')
+
+
+def _migrate_to_6():
+    """Refreshes keep ignore rules they used, see SpaceScan.ignore_rules"""
+    if db.table_exists("spacescan") and not _has_column("spacescan", "ignore_rules"):
+        db.execute_sql('ALTER TABLE "spacescan" ADD COLUMN "ignore_rules" TEXT')
+
+
+MIGRATIONS = {
+    1: _migrate_to_2,
+    2: _migrate_to_3,
+    3: _migrate_to_4,
+    4: _migrate_to_5,
+    5: _migrate_to_6,
+}
+"""Functions that upgrade index from given SCHEMA_VERSION to the next one"""
+
+
+class Indexxo():
+    """File indexer."""
+    filetypes: dict = {}
+    """File types dictionary. Extension (key) and file type (value)."""
+    space_paths: list[Path] = []
+    """List of paths that will be indexed while indexing"""
+    ignore_paths: list[Path | str] = []
+    """Full paths and patterns that will be ignored while indexing, see IgnoreRules"""
+    ignore_files: list[str] = []
+    """Names of files with ignore patterns of the folder they are in"""
+    refresh_interval = 3600
+    """Seconds between refreshing index"""
+    crawler_workers = 8
+    """Maximum amount of threads listing folders while indexing"""
+    hash_rate = 20
+    """MiB per second read while hashing files for duplicate search, 0 disables it"""
+    media_directory: Path | None = None
+    """Cache of thumbnails, metadata of media files is not read if None"""
+    full_text_search = False
+    """Whether FileSearch is available (SQLite needs FTS5 with trigram tokenizer)"""
+    watch_changes = True
+    """Whether file system changes are written into index as they happen"""
+    generation = 0
+    """
+    Incremented every time changes of index are committed. Anything read from
+    index with the same generation is still up to date.
+    """
+    folders: FolderTree | None = None
+    """Indexed folders in memory, None if folders are looked up in index"""
+    watcher: Watcher | None = None
+    """Reports file system changes, None if not watching"""
+    writer: ThreadPoolExecutor
+    """The only thread that writes into index, keeps writer connection open"""
+    loop = asyncio.new_event_loop()
+    """Loop for async tasks"""
+
+    def __init__(
+        self,
+        filetypes: dict,
+        space_paths: list[Path],
+        ignore_paths: list[Path | str],
+        refresh_interval: int,
+        crawler_workers: int,
+        database_path: Path,
+        watch_changes: bool = True,
+        hash_rate: float = 20,
+        folder_tree: bool = True,
+        space_options: dict[str, dict] | None = None,
+        concurrent_refreshes: int = 2,
+        ignore_files: list[str] | None = None,
+        media_directory: Path | None = None
+    ):
+        """
+        Initialize Indexer
+
+        Args:
+            filetypes (dict): Key-value pair of extensions and associated types.
+            space_paths (list[Path]): Paths that will be indexed right after indexer start up.
+            ignore_paths (list[Path | str]): Full paths and .gitignore patterns
+            that will not be indexed, see IgnoreRules.
+            refresh_interval (int): Amount of seconds between successful index refreshes.
+            crawler_workers (int): Maximum amount of threads listing folders while indexing.
+            database_path (Path): Index database file. Created if doesn't exist.
+            watch_changes (bool): Write file system changes into index as they happen
+            (Linux only). Index is kept up to date by refreshes only otherwise.
+            hash_rate (float): MiB per second read while hashing files for duplicate
+            search after refreshes. Duplicates are not searched if 0.
+            folder_tree (bool): Keep indexed folders in memory (see FolderTree), so
+            folders are found and walked without reading index.
+            space_options (dict[str, dict] | None): Options of spaces by full
+            path that override defaults: update_interval, priority and
+            crawler_workers (see SpaceSchedule).
+            concurrent_refreshes (int): Maximum amount of spaces that are
+            refreshed at the same time.
+            ignore_files (list[str] | None): Names of files (like .gitignore)
+            whose patterns are ignored in the folder they are in and below it.
+            media_directory (Path | None): Cache of thumbnails, created if it
+            doesn't exist. Metadata of images, videos and audio is read after
+            refreshes (see _examine_media) if provided.
+        """
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="indexxo-writer")
+        self.setup_database(database_path)
+        self.filetypes = filetypes
+        self.space_paths = space_paths
+        self.ignore_paths = ignore_paths
+        self.ignore_files = ignore_files or []
+        self.refresh_interval = refresh_interval
+        self.crawler_workers = crawler_workers
+        self.space_options = space_options or {}
+        self.scheduler = Scheduler(concurrent_refreshes)
+        """Refresh schedules of spaces"""
+        for space in space_paths:
+            self._schedule(space)
+        # Spaces that are being refreshed
+        self._refreshing: set[str] = set()
+        self.watch_changes = watch_changes
+        self.hash_rate = hash_rate
+        self._hashing: asyncio.Task | None = None
+        self.media_directory = media_directory
+        self._examining: asyncio.Task | None = None
+        # Whether thumbnails without metadata were removed, see _sweep_thumbnails
+        self._thumbnails_swept = False
+        self.searches = RecentSearches(SEARCH_QUERIES)
+        self.metrics = IndexerMetrics()
+        """Progress and timings of indexing, see get_status"""
+        if folder_tree:
+            self.folders = FolderTree()
+            self._load_folders()
+        # Changed paths that are not written yet, see _read_changes
+        self._changed: set[str] = set()
+        # Old and new paths of moves that are not written yet
+        self._moves: list[tuple[str, str]] = []
+        self._writing_changes: asyncio.Task | None = None
+
+    def setup_database(self, database_path: Path):
+        """
+        Connects to database and creates tables if needed. Prepares read-only
+        connections to the same database. Index from previous
+        runs is kept. Index from older SCHEMA_VERSION is upgraded if there are
+        MIGRATIONS for it, otherwise it's rebuilt. Secondary and search indexes
+        are derived from FileObjectBase and are built from it if they are
+        missing.
+
+        Args:
+            database_path (Path): Index database file.
+        """
+        db.init(str(database_path), pragmas=PRAGMAS)
+        db.connect()
+        version = db.pragma("user_version")
+        if 0 < version < SCHEMA_VERSION and all(
+                v in MIGRATIONS for v in range(version, SCHEMA_VERSION)):
+            logging.info(f"Upgrading index schema {version} to {SCHEMA_VERSION}")
+            with db.atomic():
+                for v in range(version, SCHEMA_VERSION):
+                    MIGRATIONS[v]()
+                db.pragma("user_version", SCHEMA_VERSION)
+        elif version != SCHEMA_VERSION:
+            if version != 0:
+                logging.info(f"Index schema {version} is not supported, rebuilding index")
+            db.drop_tables([FileSearch, FileObjectBase, SpaceScan, FolderStats, FileHash,
+                            FileMedia])
+            db.pragma("user_version", SCHEMA_VERSION)
+        # This will not fail even if table already exists.
+        # Rollups, hashes and metadata of index from older version are filled
+        # by the first refresh.
+        db.create_tables([FileObjectBase, SpaceScan, FolderStats, FileHash, FileMedia])
+        self.create_indexes()
+        self.setup_search()
+        # Ids of removed rows are not given again, hashes, metadata and
+        # rollups of removed rows can be left until they are cleaned
+        self._last_id = max(
+            model.select(fn.MAX(field)).scalar() or 0
+            for model, field in ((FileObjectBase, FileObjectBase.id), (FileHash, FileHash.id),
+                                 (FileMedia, FileMedia.id), (FolderStats, FolderStats.folder_id)))
+
+        if not read_db.deferred:
+            # Connections to previous database
+            read_db.close_all()
+        # Pooled connections are used by one thread at a time, but not always
+        # by the thread that opened them
+        read_db.init(database_path.resolve().as_uri() + "?mode=ro",
+                     uri=True, pragmas=READ_PRAGMAS, check_same_thread=False)
+
+        for scan in SpaceScan.select():
+            logging.info(
+                f"Using index of {scan.full_path} from {time.ctime(scan.completed)}")
+
+    def setup_search(self):
+        """
+        Creates search index and triggers that maintain it. Search falls back
+        to scanning the whole index if SQLite doesn't support it.
+        """
+        try:
+            with db.atomic():
+                triggers = {name for name, in db.execute_sql(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+                if not FileSearch.table_exists():
+                    FileSearch.create_table()
+                    # Index from older version, fill search index
+                    FileSearch.rebuild()
+                elif not set(SEARCH_TRIGGERS) <= triggers:
+                    # Bulk load was interrupted, see _refresh
+                    FileSearch.rebuild()
+                self._create_search_triggers()
+            self.full_text_search = True
+        except OperationalError as e:
+            logging.warning(f"Full text search is not available: {e}")
+            self.full_text_search = False
+
+    def _create_search_triggers(self):
+        for name, trigger in SEARCH_TRIGGERS.items():
+            db.execute_sql(f'CREATE TRIGGER IF NOT EXISTS "{name}" {trigger}')
+
+    def _drop_search_triggers(self):
+        for name in SEARCH_TRIGGERS:
+            db.execute_sql(f'DROP TRIGGER IF EXISTS "{name}"')
+
+    def create_indexes(self):
+        """
+        Creates secondary indexes (see INDEXES) that are missing.
+        """
+        table = FileObjectBase._meta.table_name
+        for name, columns in INDEXES.items():
+            columns = ", ".join(f'"{c}"' for c in columns)
+            db.execute_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns})')
+
+    def drop_indexes(self):
+        """
+        Drops secondary indexes (see INDEXES).
+        """
+        for name in INDEXES:
+            db.execute_sql(f'DROP INDEX IF EXISTS "{name}"')
+
+    def start_indexing(self):
+        """
+        Start indexer loop. Refreshes every space after its own interval (see
+        Scheduler) and keeps index up to date between refreshes if watching
+        changes is possible, see start_watching.
+        """
+        async def looper():
+            self._forget_removed_spaces()
+            self._refresh_now = asyncio.Event()
+            self.start_watching()
+            self._verify_on_start()
+
+            refreshes: set[asyncio.Task] = set()
+            refresh_now = self.loop.create_task(self._refresh_now.wait())
+            while True:
+                for schedule in self.scheduler.due(time.time()):
+                    self.scheduler.start(schedule)
+                    refreshes.add(self.loop.create_task(self._scheduled_refresh(schedule)))
+                # Wakes up when a refresh finishes, a space is due or changes
+                # were lost
+                done, _ = await asyncio.wait(
+                    {*refreshes, refresh_now},
+                    timeout=self.scheduler.next_due(time.time()),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                refreshes -= done
+                if refresh_now in done:
+                    self.scheduler.request_all()
+                    self._refresh_now.clear()
+                    refresh_now = self.loop.create_task(self._refresh_now.wait())
+
+        self.loop.run_until_complete(looper())
+
+    async def _scheduled_refresh(self, schedule: SpaceSchedule):
+        """
+        Refresh a space that is due, see start_indexing. Duplicates are searched
+        and media files are examined when no space is being refreshed anymore.
+        """
+        logging.info(f"Refreshing {schedule.path}")
+        try:
+            await self._discover(schedule.path)
+            logging.info(f"Refreshed {schedule.path} in "
+                         f"{self.metrics.last_refresh_seconds:.1f} s")
+        except Exception:
+            # Tried again after interval
+            logging.exception(f"Can't refresh {schedule.path}")
+        self.scheduler.finish(schedule, time.time())
+        if (self.hash_rate > 0 and not self._refreshing and
+                (self._hashing is None or self._hashing.done())):
+            # Takes long with low rate, next refresh doesn't wait for it
+            self._hashing = self.loop.create_task(self._search_duplicates())
+        if (self.media_directory is not None and not self._refreshing and
+                (self._examining is None or self._examining.done())):
+            self._examining = self.loop.create_task(self._examine_media())
+
+    def _verify_on_start(self):
+        """
+        Refresh every space once after start, index from previous run can be
+        outdated and spaces are watched only after they are refreshed. Spaces
+        that were never fully indexed go first, then spaces with the oldest
+        index. Others can be searched while they are verified.
+        """
+        last_scans = {s.full_path: s.completed for s in SpaceScan.select()}
+        for schedule in self.scheduler:
+            schedule.last_scan = last_scans.get(str(schedule.path), 0)
+        self.scheduler.request_all()
+
+    def _schedule(self, path: Path):
+        """Add refresh schedule of a space, see space_options"""
+        options = self.space_options.get(str(path), {})
+        self.scheduler.add(SpaceSchedule(
+            path,
+            interval=options.get("update_interval", self.refresh_interval),
+            priority=options.get("priority", 0),
+            crawler_workers=options.get("crawler_workers")
+        ))
+
+    def start_watching(self):
+        """
+        Start watching changes of indexed folders. Every indexed folder is
+        watched after it's refreshed, see _watch_tree. Changes are collected on
+        the event loop and written into index by writer thread.
+        """
+        if not self.watch_changes:
+            return
+        try:
+            self.watcher = Watcher()
+        except OSError as e:
+            logging.warning(f"Changes can't be watched, index is updated by refresh only: {e}")
+            return
+        self.loop.add_reader(self.watcher.fileno(), self._read_changes)
+
+    def _read_changes(self):
+        """
+        Collect changed paths from watcher, they are written after WATCH_DELAY.
+        """
+        changed, moves, overflow = self.watcher.read_events()
+        if overflow:
+            logging.warning("Too many changes to watch, refreshing index")
+            self._refresh_now.set()
+        self._changed.update(changed)
+        self._moves.extend(moves)
+        self.metrics.pending_changes = len(self._changed)
+        if self._changed and self._writing_changes is None:
+            self._writing_changes = self.loop.create_task(self._write_changes())
+
+    async def _write_changes(self):
+        await asyncio.sleep(WATCH_DELAY)
+        changed, self._changed = self._changed, set()
+        # Changes inside of spaces that are being refreshed wait for the
+        # refresh, they could conflict with rows it writes
+        self._changed = {path for path in changed if any(
+            path == space or path.startswith(os.path.join(space, ""))
+            for space in self._refreshing)}
+        changed -= self._changed
+        # Moves with a waiting end are written as removal and creation
+        moves, self._moves = self._moves, []
+        moves = [(old, new) for old, new in moves if old in changed and new in changed]
+        self.metrics.pending_changes = len(self._changed)
+        self._writing_changes = None
+        if not changed:
+            return
+        try:
+            await self.loop.run_in_executor(self.writer, self._apply_changes, changed, moves)
+        except Exception:
+            # Next refresh fixes the index
+            logging.exception("Can't write changes into index")
+
+    async def add_space(self, path: Path):
+        """
+        Add specified path to list of indexed paths.
+        If space was added while refreshing the index, this space will
+        be indexed concurrently.
+        """
+        await self._discover(path)
+        self.space_paths.append(path)
+        self._schedule(path)
+        self.scheduler.get(str(path)).last_scan = time.time()
+
+    def _forget_removed_spaces(self):
+        """
+        Remove spaces that are no longer in space_paths (and everything inside
+        of them) from index.
+        """
+        space_paths = {str(p) for p in self.space_paths}
+        indexed = {s.full_path for s in FileObjectBase.select().where(
+            FileObjectBase.type == "space"
+        )}
+        indexed.update(s.full_path for s in SpaceScan.select())
+        for space in indexed - space_paths:
+            logging.info(f"{space} is no longer a space, removing it from index")
+            self._forget_folder(space)
+            with db.atomic():
+                (FolderStats.delete().where(FolderStats.folder_id.in_(
+                    FileObjectBase.select(FileObjectBase.id)
+                    .where(in_subtree(FileObjectBase.full_path, space))
+                )).execute())
+                (FileObjectBase.delete().where(
+                    in_subtree(FileObjectBase.full_path, space)
+                ).execute())
+                SpaceScan.delete_by_id(space)
+            self._index_changed()
+
+    def get_spaces(self) -> list[FileObjectBase]:
+        """
+        Get list of all row from database with type 'space'. Reads go through
+        read-only connections, same for other get_ and find_ methods.
+
+        Returns:
+            list[FileObjectBase]: List of spaces (indexed top-level folder)
+        """
+        return (FileObjectBase.select().where(
+            FileObjectBase.type == "space"
+        ).bind(read_db))
+
+    def get_content(
+        self,
+        path: Path,
+        sort: str = "name",
+        order: str = "asc",
+        limit: int | None = None,
+        after: str | None = None
+    ) -> tuple[list[FileObjectBase], FileObjectBase | None, str | None]:
+        """
+        Get content of the specified folder. IF folder doesn't exist, will return same as if 
+        the folder was empty.
+
+        Args:
+            path (Path): Folder full path.
+            sort, order, limit, after: See paginate.
+
+        Returns:
+            tuple[list[FileObjectBase], FileObjectBase | None, str | None]: Returns multiple
+            things: list of children files/folders, parent object and cursor of the next
+            page. Folder can be empty and parent folder is None for top-level folders and
+            spaces.
+        """
+        content, next_page = paginate(
+            self._content_query(path), sort, order, limit, after)
+        return content, self._get_parent(path), next_page
+
+    def stream_content(
+        self,
+        path: Path,
+        sort: str = "name",
+        order: str = "asc",
+        limit: int | None = None,
+        after: str | None = None
+    ) -> tuple[Page, FileObjectBase | None]:
+        """
+        Same as get_content, but content rows are dicts that are read from
+        database while iterating over the page.
+
+        Returns:
+            tuple[Page, FileObjectBase | None]: Page of children files/folders and
+            parent object. Cursor of the next page is in the page.
+        """
+        page = Page(self._content_query(path).dicts(), sort, order, limit, after)
+        return page, self._get_parent(path)
+
+    def _content_query(self, path: Path) -> ModelSelect:
+        parent = self._get_folder_id(str(path), read_db)
+        # Ids start from 1, folder that is not in index has no content
+        return (FileObjectBase.select().where(FileObjectBase.parent_id == (parent or 0))
+                .bind(read_db))
+
+    def _get_parent(self, path: Path) -> FileObjectBase | None:
+        if self.folders is not None and self.folders.find(str(path.parent)) is None:
+            return None
+        return (FileObjectBase.select().where(
+            FileObjectBase.full_path == path.parent
+        ).bind(read_db).first())
+
+    def get_status(self) -> dict:
+        """
+        Get progress of indexing: current refresh with walking rates, duration
+        of the last refresh, queue depths and timings of folder listings and
+        writes (see IndexerMetrics). Doesn't read index.
+
+        Returns:
+            dict: Status of indexer.
+        """
+        status = self.metrics.to_json()
+        status["generation"] = self.generation
+        status["watching"] = self.watcher is not None
+        status["hashing"] = self._hashing is not None and not self._hashing.done()
+        status["examining_media"] = self._examining is not None and not self._examining.done()
+        return status
+
+    def get_stats(self, path: Path | None = None) -> dict | None:
+        """
+        Get rollup of a folder: amount and size of files inside of it by type and
+        modification dates of the newest and the oldest file. Reads a few rows
+        of FolderStats, doesn't depend on amount of files.
+
+        Args:
+            path (Path | None): Folder full path. Every space together if None.
+
+        Returns:
+            dict | None: Rollup of the folder, None if folder is not in index.
+        """
+        if path is None:
+            ids = [s.id for s in self.get_spaces()]
+        else:
+            folder_id = self._get_folder_id(str(path), read_db)
+            if folder_id is None:
+                return None
+            ids = [folder_id]
+
+        types: dict[str, list] = {}
+        for row in (FolderStats.select().where(FolderStats.folder_id.in_(ids))
+                    .bind(read_db)):
+            add_stats(types, {row.type: [row.files, row.size, row.newest, row.oldest]})
+        total: dict[str, list] = {}
+        for stats in types.values():
+            add_stats(total, {"": list(stats)})
+        files, size, newest, oldest = total.get("", [0, 0, None, None])
+        return {
+            "full_path": str(path) if path is not None else None,
+            "files": files,
+            "size": size,
+            "newest": newest,
+            "oldest": oldest,
+            "types": {type: dict(zip(("files", "size", "newest", "oldest"), stats))
+                      for type, stats in types.items()}
+        }
+
+    def find_largest(
+        self,
+        limit: int,
+        path: Path | None = None,
+        type: str | None = None
+    ) -> list[FileObjectBase]:
+        """
+        Find the biggest files (or folders).
+
+        Args:
+            limit (int): Amount of rows to find.
+            path (Path | None): Folder full path to search in. Every space if None.
+            type (str | None): Type of files, "folder" for folders. Every file (not
+            folder) if None.
+
+        Returns:
+            list[FileObjectBase]: Biggest rows, biggest first.
+        """
+        query = FileObjectBase.select().bind(read_db)
+        if type is None:
+            query = query.where(FileObjectBase.type.not_in(("folder", "space")))
+        else:
+            query = query.where(FileObjectBase.type == type)
+
+        if path is not None:
+            full_path = FileObjectBase.full_path
+            # Reading by size stops after about limit * total / inside rows if
+            # files are spread evenly, sorting the subtree reads inside rows.
+            folder_id = self._get_folder_id(str(path), read_db)
+            inside = self._count_files([folder_id] if folder_id is not None else [], type)
+            total = self._count_files([s.id for s in self.get_spaces()], type)
+            if inside * inside > limit * total:
+                # Expression can't use primary key, so SQLite uses size index
+                full_path = full_path.concat("")
+            query = query.where(in_subtree(full_path, str(path)) &
+                                (FileObjectBase.full_path != str(path)))
+        return list(query.order_by(
+            FileObjectBase.size.desc(), FileObjectBase.id.desc()
+        ).limit(limit))
+
+    def _count_files(self, ids: list[int], type: str | None) -> int:
+        """Amount of files (of a type) inside of folders by their ids, see FolderStats"""
+        query = (FolderStats.select(fn.SUM(FolderStats.files))
+                 .where(FolderStats.folder_id.in_(ids)))
+        if type not in (None, "folder", "space"):
+            query = query.where(FolderStats.type == type)
+        return query.bind(read_db).scalar() or 0
+
+    def get_duplicates(self, limit: int) -> dict:
+        """
+        Get groups of files with the same content, groups that free the most
+        space when duplicates are removed go first. Only files that were
+        hashed since they were last modified are included, see _hash_duplicates.
+
+        Args:
+            limit (int): Maximum amount of groups.
+
+        Returns:
+            dict: Groups with their hash, file size, reclaimable bytes and files,
+            and reclaimable bytes of every group together.
+        """
+        count = fn.COUNT(FileHash.id)
+        groups = (FileHash.select(
+            FileHash.full, FileHash.size, (FileHash.size * (count - 1)).alias("reclaimable")
+        ).join(FileObjectBase, on=current_version(FileHash))
+            .where(FileHash.full.is_null(False))
+            .group_by(FileHash.full, FileHash.size).having(count > 1))
+
+        total = (FileHash.select(fn.SUM(groups.c.reclaimable)).from_(groups)
+                 .bind(read_db).scalar())
+        result = []
+        for group in (groups.order_by(SQL("reclaimable").desc()).limit(limit)
+                      .dicts().bind(read_db)):
+            files = (FileObjectBase.select().join(FileHash, on=current_version(FileHash))
+                     .where((FileHash.full == group["full"]) & (FileHash.size == group["size"]))
+                     .order_by(FileObjectBase.full_path).bind(read_db))
+            result.append({
+                "hash": group["full"],
+                "size": group["size"],
+                "reclaimable": group["reclaimable"],
+                "files": [f.to_json() for f in files]
+            })
+        return {"groups": result, "reclaimable": total or 0}
+
+    def find_files(
+        self,
+        query: str,
+        sort: str = "name",
+        order: str = "asc",
+        limit: int | None = None,
+        after: str | None = None
+    ) -> tuple[list[FileObjectBase], str | None]:
+        """Find files and folders whose full name contains every term of the
+        query and that pass its filters (type:, ext:, size:, mtime:, see
+        SearchQuery). Uses search index for terms that are long enough,
+        otherwise scans the whole index. Matches of recent one-term queries
+        are kept, a query that extends one of them is filtered in memory (see
+        RecentSearches).
+
+        Args:
+            query (str): Search query.
+            sort, order, limit, after: See paginate.
+
+        Returns:
+            tuple[list[FileObjectBase], str | None]: List of matches and cursor of
+            the next page.
+
+        Raises:
+            ValueError: Query has no terms and no filters or invalid filter value.
+        """
+        page = self._search_page(query, sort, order, limit, after, dicts=False)
+        rows = list(page)
+        return rows, page.next
+
+    def stream_files(
+        self,
+        query: str,
+        sort: str = "name",
+        order: str = "asc",
+        limit: int | None = None,
+        after: str | None = None
+    ) -> Page:
+        """
+        Same as find_files, but matches are dicts that are read from database
+        while iterating over the page.
+
+        Returns:
+            Page: Page of matches, cursor of the next page is in the page.
+        """
+        return self._search_page(query, sort, order, limit, after, dicts=True)
+
+    def _search_page(
+        self,
+        query: str,
+        sort: str,
+        order: str,
+        limit: int | None,
+        after: str | None,
+        dicts: bool
+    ) -> Page:
+        check_sort(sort, order)
+        search = SearchQuery(query)
+        if search.is_empty():
+            raise ValueError("Please provide query argument")
+        matches = self._get_matches(search.names[0]) if search.is_plain() else None
+        if matches is None:
+            select = self._search_query(search)
+        else:
+            # Page is chosen from matches, query reads only its rows
+            select = self._matches_query(matches, sort, order, limit, after)
+            after = None
+        return Page(select.dicts() if dicts else select, sort, order, limit, after)
+
+    def _search_query(self, search: SearchQuery) -> ModelSelect:
+        """
+        Build query of files and folders that match search query. Name terms
+        that are long enough are looked up in search index, others are matched
+        by scanning. Filters are compared in database.
+
+        Args:
+            search (SearchQuery): Parsed search query.
+
+        Returns:
+            ModelSelect: Query of matching rows.
+        """
+        query = FileObjectBase.select().bind(read_db)
+        indexed = [name for name in search.names
+                   if self.full_text_search and len(name) >= TRIGRAM]
+        if indexed:
+            # Phrases separated by space must all match
+            matches = (FileSearch.select(FileSearch.rowid).where(
+                FileSearch.match(" ".join(_phrase(name) for name in indexed))))
+            query = query.where(FileObjectBase.id.in_(matches))
+        for name in search.names:
+            if name not in indexed:
+                # No need to lower in database
+                query = query.where(FileObjectBase.full_name.contains(name))
+
+        if search.types:
+            query = query.where(FileObjectBase.type.in_(search.types))
+        if search.extensions:
+            query = query.where(fn.LOWER(FileObjectBase.extension).in_(search.extensions))
+        for operator, size in search.sizes:
+            query = query.where(Expression(FileObjectBase.size, operator, size))
+        for operator, mtime in search.mtimes:
+            query = query.where(Expression(FileObjectBase.mtime, operator, mtime))
+        return query
+
+    def _get_matches(self, query: str) -> list[tuple] | None:
+        """
+        Get every match of a search query from matches of a recent query, or
+        read and keep them if there are not too many. Reading stops after
+        SEARCH_MATCHES matches or SEARCH_SECONDS, such queries and queries that
+        extend them are searched in index every time. Only queries that use
+        search index are kept, shorter ones scan the whole index anyway.
+
+        Args:
+            query (str): Lowercase query.
+
+        Returns:
+            list[tuple] | None: Matches (see _MATCH_SORT) or None if query has
+            too many of them.
+        """
+        if not self.full_text_search or len(query) < TRIGRAM:
+            return None
+        # Read before index, matches can't be older than their generation
+        generation = self.generation
+        matches = self.searches.narrow(query, generation)
+        if matches is not None or self.searches.too_many(query, generation):
+            return matches
+
+        deadline = time.monotonic() + SEARCH_SECONDS
+        matches = []
+        # Search index is read first, so reading stops as soon as there are
+        # too many matches
+        select = (FileSearch.select(
+            FileObjectBase.id, FileObjectBase.full_name, FileObjectBase.size,
+            FileObjectBase.mtime, FileObjectBase.type
+        ).join(FileObjectBase, on=(FileObjectBase.id == FileSearch.rowid))
+            .where(FileSearch.match(_phrase(query))).bind(read_db))
+        # Rows are read from cursor as is, converting them takes longer than reading
+        for id, full_name, size, mtime, type in read_db.execute(select):
+            if len(matches) == SEARCH_MATCHES or time.monotonic() > deadline:
+                self.searches.add(query, generation, None)
+                return None
+            matches.append((full_name.lower(), id, full_name, size, mtime, type))
+        self.searches.add(query, generation, matches)
+        return matches
+
+    def _matches_query(
+        self,
+        matches: list[tuple],
+        sort: str,
+        order: str,
+        limit: int | None,
+        after: str | None
+    ) -> ModelSelect:
+        """
+        Choose one page of kept matches the same way as Page does and build
+        query that selects rows of the page, see _get_matches.
+
+        Args:
+            matches (list[tuple]): Kept matches of a search query.
+            sort, order, limit, after: See Page.
+
+        Raises:
+            ValueError: Invalid cursor.
+
+        Returns:
+            ModelSelect: Query of page rows and one row after them.
+        """
+        position = _MATCH_SORT[sort]
+        if after is not None:
+            last = _decode_cursor(after)
+            try:
+                if order == "asc":
+                    matches = [m for m in matches if (m[position], m[1]) > last]
+                else:
+                    matches = [m for m in matches if (m[position], m[1]) < last]
+            except TypeError as e:
+                raise ValueError("Invalid cursor") from e
+        if limit is not None:
+            # One more row tells if there is a next page
+            choose = heapq.nsmallest if order == "asc" else heapq.nlargest
+            matches = choose(limit + 1, matches, key=lambda m: (m[position], m[1]))
+        # One variable for any amount of ids
+        ids = SQL("(SELECT value FROM json_each(?))", (json.dumps([m[1] for m in matches]),))
+        return FileObjectBase.select().where(FileObjectBase.id.in_(ids)).bind(read_db)
+
+    async def _discover(self, path: Path):
+        """Refreshes index of a space. Compares what is on disk with what is
+        already in index and writes only rows that changed. Rows are written in
+        batches while folders are walked, so index is never empty and
+        unchanged rows can be searched during refresh.
+
+        Folders are walked in a pool of threads (see Crawler) outside of writer
+        thread, only comparing and writing rows runs in writer thread. So a few
+        spaces are refreshed at the same time (see Scheduler) and a slow space
+        doesn't hold other spaces back. Watched changes inside of the space
+        wait until it's refreshed.
+
+        Args:
+            path (Path): Space full path.
+        """
+        loop = asyncio.get_running_loop()
+        top = str(path)
+        self._refreshing.add(top)
+        self.metrics.start_refresh(top)
+        refresh = None
+        success = False
+        try:
+            refresh = await loop.run_in_executor(self.writer, self._start_refresh, path, True)
+            await loop.run_in_executor(None, self._walk_into_writer, refresh)
+            await loop.run_in_executor(self.writer, self._finish_refresh, refresh)
+            # Index is committed, watching is set up on top of it
+            success = True
+            if self.watcher is not None:
+                await loop.run_in_executor(self.writer, self._watch_tree, top)
+        finally:
+            if refresh is not None and refresh.bulk_load:
+                # Refresh failed, next one finds rows and is not a bulk load
+                await loop.run_in_executor(self.writer, self._finish_bulk_load)
+            self._refreshing.discard(top)
+            self.metrics.finish_refresh(top, success)
+            if self._changed and self._writing_changes is None:
+                self._writing_changes = self.loop.create_task(self._write_changes())
+
+    def _refresh(self, path: Path, space: bool = True):
+        """Same as _discover, but folders are walked in writer thread. Runs in
+        writer thread.
+
+        Args:
+            path (Path): Folder full path.
+            space (bool): Whether the folder is a space. Otherwise it's a folder
+            inside of a space, sizes of folders above it are not updated.
+        """
+        refresh = self._start_refresh(path, space)
+        try:
+            for walked in self._walk(refresh, db):
+                self._write_walked(refresh, [walked])
+            self._finish_refresh(refresh)
+        finally:
+            if refresh.bulk_load:
+                self._finish_bulk_load()
+
+    def _start_refresh(self, path: Path, space: bool) -> Refresh:
+        """Prepare refreshing a folder, see _refresh. Runs in writer thread."""
+        top = str(path)
+        # Index is empty, indexes are built after loading everything which is
+        # faster than updating them row by row.
+        bulk_load = space and not FileObjectBase.select().exists()
+        if bulk_load:
+            logging.info("Index is empty, indexes are built after loading")
+            with db.atomic():
+                self.drop_indexes()
+                if self.full_text_search:
+                    self._drop_search_triggers()
+
+        known = (FileObjectBase.select().where(
+            FileObjectBase.full_path == top
+        ).dicts().first())
+        if known is not None:
+            top_parent_id = known["parent_id"]
+        elif space:
+            top_parent_id = None
+        else:
+            top_parent_id = self._get_folder_id(os.path.dirname(top), db)
+        schedule = self.scheduler.get(top) if space else None
+        if space:
+            ignore = self._ignore_rules().for_space(top)
+        else:
+            ignore = self._ignore_rules().for_path(os.path.dirname(top), self._get_space(top))
+        crawler = Crawler(
+            workers=(schedule and schedule.crawler_workers) or self.crawler_workers,
+            ignore=ignore,
+            get_file_type=self._get_file_type,
+            metrics=self.metrics
+        )
+        writer = IndexWriter(on_commit=self._index_changed, metrics=self.metrics)
+        # Entries that were ignored could be not ignored anymore
+        relist = space and known is not None and (SpaceScan.select(SpaceScan.ignore_rules).where(
+            SpaceScan.full_path == top).scalar() != self._ignore_fingerprint())
+        if relist:
+            logging.info(f"Ignore rules changed, listing every folder of {top}")
+        return Refresh(top, space, known, top_parent_id, bulk_load, crawler, writer, relist)
+
+    def _walk(self, refresh: Refresh, database: Database) -> Iterator[tuple]:
+        """
+        Walk folders of a refresh, see Crawler.crawl. Known rows are read in
+        the thread that iterates over this generator.
+
+        Args:
+            refresh (Refresh): Refresh of a folder.
+            database (Database): Connection to read index with, db in writer
+            thread and read_db otherwise.
+
+        Yields:
+            tuple: Same as Crawler.crawl.
+        """
+        def known_children(directory: str) -> list[dict]:
+            if refresh.bulk_load or directory not in refresh.known_folders:
+                return []
+            return list(FileObjectBase.select().where(
+                FileObjectBase.parent_id == refresh.known_folders[directory]["id"]
+            ).bind(database).dicts())
+
+        for walked in refresh.crawler.crawl(
+                refresh.top, refresh.known, known_children, refresh.space, refresh.relist):
+            for row in walked[3]:
+                if row["type"] == "folder":
+                    refresh.known_folders[row["full_path"]] = row
+            yield walked
+
+    def _walk_into_writer(self, refresh: Refresh):
+        """
+        Walk folders of a refresh and pass them to writer thread in batches.
+        Runs in its own thread, index is read with a read-only connection.
+        Walked rows of a folder are written only after its children are
+        read, so reading committed rows is enough.
+        """
+        read_db.connect(reuse_if_open=True)
+        try:
+            batch: list[tuple] = []
+            rows = 0
+            written: Future | None = None
+            for walked in self._walk(refresh, read_db):
+                batch.append(walked)
+                rows += len(walked[1]) + 1
+                if rows >= TRANSACTION_ROWS:
+                    if written is not None:
+                        # One batch is written while the next one is walked
+                        written.result()
+                    written = self.writer.submit(self._write_walked, refresh, batch)
+                    batch = []
+                    rows = 0
+            if written is not None:
+                written.result()
+            if batch:
+                self.writer.submit(self._write_walked, refresh, batch).result()
+        finally:
+            read_db.close()
+
+    def _write_walked(self, refresh: Refresh, batch: list[tuple]):
+        """
+        Compare walked folders with known rows and queue changes. Runs in
+        writer thread.
+
+        Args:
+            refresh (Refresh): Refresh of a folder.
+            batch (list[tuple]): Walked folders, see Crawler.crawl.
+        """
+        writer = refresh.writer
+        for folder, files, subfolders, children in batch:
+            old_folder = refresh.known_folders.get(folder["full_path"])
+            folder["id"] = old_folder["id"] if old_folder else self._new_id()
+            # Parents are walked first
+            folder["parent_id"] = (
+                refresh.folder_ids[os.path.dirname(folder["full_path"])]
+                if refresh.folders else refresh.top_parent_id)
+            refresh.folder_ids[folder["full_path"]] = folder["id"]
+            refresh.folders.append(folder)
+            self.metrics.walked(folder["full_path"], len(files))
+            own_stats = refresh.stats[folder["full_path"]] = {}
+            old_rows = {row["full_path"]: row for row in children}
+
+            for file in files:
+                add_file_stats(own_stats, file)
+                old = old_rows.pop(file["full_path"], None)
+                file["id"] = old["id"] if old is not None else self._new_id()
+                file["parent_id"] = folder["id"]
+                if old != file:
+                    writer.upsert(file)
+                if old is not None and old["type"] == "folder":
+                    # Folder was replaced with a file
+                    writer.delete_subtree(file["full_path"], include_self=False)
+            for subfolder in subfolders:
+                old = old_rows.pop(subfolder, None)
+                if old is not None and old["type"] != "folder":
+                    # File was replaced with a folder, folder gets a new id
+                    writer.delete(subfolder)
+            # Everything that is left was removed from disk
+            for full_path, old in old_rows.items():
+                if old["type"] == "folder":
+                    writer.delete_subtree(full_path)
+                else:
+                    writer.delete(full_path)
+
+    def _finish_refresh(self, refresh: Refresh):
+        """
+        Write folders with their sizes and rollups when everything is walked.
+        Runs in writer thread.
+        """
+        top = refresh.top
+        folders = refresh.folders
+        stats = refresh.stats
+        writer = refresh.writer
+        if not folders:
+            # Folder itself is not accessible
+            writer.delete_subtree(top)
+        for folder in folders:
+            if refresh.known_folders.get(folder["full_path"]) != folder:
+                writer.upsert(folder)
+        if folders:
+            # Children go after parents, going backwards adds them bottom-up
+            for folder in reversed(folders[1:]):
+                add_stats(stats[os.path.dirname(folder["full_path"])],
+                          stats[folder["full_path"]])
+            self._write_stats(writer, top, stats, refresh.folder_ids)
+
+        with db.atomic():
+            writer.flush()
+            if refresh.space:
+                (SpaceScan.replace(full_path=top, completed=time.time(),
+                                   ignore_rules=self._ignore_fingerprint())
+                 .execute())
+            if refresh.bulk_load:
+                self._finish_bulk_load()
+        refresh.bulk_load = False
+        self._load_folders(top)
+        self._index_changed()
+        logging.debug(f"{writer.written} changes written for {top}")
+
+    def _finish_bulk_load(self):
+        """
+        Build secondary indexes and search index that were dropped for a bulk
+        load, see _start_refresh. Runs in writer thread.
+        """
+        with db.atomic():
+            self.create_indexes()
+            if self.full_text_search:
+                FileSearch.rebuild()
+                self._create_search_triggers()
+
+    def _load_folders(self, path: str | None = None):
+        """
+        Load indexed folders into folders tree. Runs in writer thread.
+
+        Args:
+            path (str | None): Folder full path, the folder and everything inside
+            of it is loaded again. Every folder is loaded if None.
+        """
+        if self.folders is None:
+            return
+        query = (FileObjectBase.select(
+            FileObjectBase.id, FileObjectBase.full_path, FileObjectBase.type
+        ).where(FileObjectBase.type.in_(("folder", "space"))))
+        if path is not None:
+            self._forget_folder(path)
+            query = query.where(in_subtree(FileObjectBase.full_path, path))
+        # Parents go before children
+        for id, full_path, type in (query.order_by(FileObjectBase.full_path)
+                                    .tuples().iterator()):
+            self.folders.add(id, full_path, type == "space")
+
+    def _forget_folder(self, path: str):
+        """Remove folder and everything inside of it from folders tree"""
+        if self.folders is not None:
+            self.folders.remove(path)
+
+    def _get_folder_id(self, path: str, database: Database) -> int | None:
+        """
+        Get id of a folder (or space) in index.
+
+        Args:
+            path (str): Folder full path.
+            database (Database): Connection to read index with if folders tree is
+            not used, db in writer thread and read_db otherwise.
+
+        Returns:
+            int | None: Folder id, None if folder is not in index.
+        """
+        if self.folders is not None:
+            return self.folders.find(path)
+        return (FileObjectBase.select(FileObjectBase.id).where(
+            (FileObjectBase.full_path == path) &
+            FileObjectBase.type.in_(("folder", "space"))
+        ).bind(database).scalar())
+
+    def _index_changed(self):
+        """
+        Mark that changes were committed, see generation. Runs in writer thread
+        after folders tree is updated too.
+        """
+        self.generation += 1
+
+    def _new_id(self) -> int:
+        """Get id for a new row of FileObjectBase. Runs in writer thread."""
+        self._last_id += 1
+        return self._last_id
+
+    def _write_stats(
+        self,
+        writer: IndexWriter,
+        path: str,
+        stats: dict[str, dict[str, list]],
+        folder_ids: dict[str, int]
+    ):
+        """
+        Compare rollups with FolderStats of the folder and everything inside of it,
+        queue rows that changed.
+
+        Args:
+            writer (IndexWriter): Writer that rows are queued in.
+            path (str): Folder full path.
+            stats (dict[str, dict[str, list]]): Rollups by folder full path, every
+            folder inside is included. Emptied by this method.
+            folder_ids (dict[str, int]): Ids of every folder in stats by full path.
+        """
+        upserts: list[dict] = []
+        deletes: list[tuple[int, str]] = []
+        for row in (FolderStats.select(FolderStats, FileObjectBase.full_path)
+                    .join(FileObjectBase, on=(FolderStats.folder_id == FileObjectBase.id))
+                    .where(in_subtree(FileObjectBase.full_path, path)).dicts().iterator()):
+            new = stats.get(row["full_path"], {}).pop(row["type"], None)
+            if new is None:
+                deletes.append((row["folder_id"], row["type"]))
+            elif new != [row["files"], row["size"], row["newest"], row["oldest"]]:
+                upserts.append(self._stats_row(row["folder_id"], row["type"], new))
+        for folder, types in stats.items():
+            for type, new in types.items():
+                upserts.append(self._stats_row(folder_ids[folder], type, new))
+        stats.clear()
+
+        # Not written while reading, rows would change under the cursor
+        for folder_id, type in deletes:
+            writer.delete_stats(folder_id, type)
+        for row in upserts:
+            writer.upsert_stats(row)
+
+    def _stats_row(self, folder_id: int, type: str, stats: list) -> dict:
+        files, size, newest, oldest = stats
+        return {"folder_id": folder_id, "type": type, "files": files, "size": size,
+                "newest": newest, "oldest": oldest}
+
+    def _get_folder_stats(self, folder_id: int) -> dict[str, list]:
+        """Read rollup of a folder, see add_file_stats. Runs in writer thread."""
+        return {row.type: [row.files, row.size, row.newest, row.oldest]
+                for row in FolderStats.select().where(FolderStats.folder_id == folder_id)}
+
+    def _watch_tree(self, path: str):
+        """
+        Watch every indexed folder inside of the folder. Falls back to refreshing
+        the space periodically if system doesn't allow to watch that many
+        folders. Runs in writer thread.
+
+        Args:
+            path (str): Folder full path.
+        """
+        if self.folders is not None:
+            folders = self.folders.walk(path)
+        else:
+            folders = (FileObjectBase.select(FileObjectBase.id, FileObjectBase.full_path).where(
+                in_subtree(FileObjectBase.full_path, path) &
+                FileObjectBase.type.in_(("folder", "space"))
+            ).tuples())
+        try:
+            for _, folder in folders:
+                self.watcher.watch(folder)
+        except WatchLimitError as e:
+            space = self._get_space(path)
+            logging.warning(f"Can't watch {space}, it's updated by refresh only: {e}. "
+                            "Raise fs.inotify.max_user_watches to watch it.")
+            self.watcher.unwatch_tree(space)
+
+    def _ignore_rules(self) -> IgnoreRules:
+        """Compile ignore_paths and ignore_files, they can change between refreshes"""
+        return IgnoreRules(self.ignore_paths, self.ignore_files)
+
+    def _ignore_fingerprint(self) -> str:
+        """ignore_paths and ignore_files as JSON, order of patterns matters"""
+        return json.dumps([[str(p) for p in self.ignore_paths], list(self.ignore_files)])
+
+    def _get_space(self, path: str) -> str | None:
+        """
+        Get space that contains the path.
+
+        Args:
+            path (str): Full path.
+
+        Returns:
+            str | None: Space full path or None if path is not inside of a space.
+        """
+        spaces = {str(p) for p in self.space_paths}
+        while path not in spaces:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+        return path
+
+    def _apply_changes(self, paths: set[str], moves: Iterable[tuple[str, str]] = ()):
+        """
+        Write changes reported by watcher into index. Moves are written first,
+        see _move. Every path is compared with its row in index, folders that
+        appeared are crawled. Size difference is added to every folder above
+        changed path. Runs in writer thread.
+
+        Args:
+            paths (set[str]): Full paths that changed, both ends of moves included.
+            moves (Iterable[tuple[str, str]]): Old and new full paths of moved
+            files and folders in the order they were moved.
+        """
+        ignore = self._ignore_rules()
+        # Ignore rules by folder that contains changed path
+        folder_rules: dict[str, IgnoreRules] = {}
+        crawler = Crawler(
+            workers=self.crawler_workers,
+            ignore=ignore,
+            get_file_type=self._get_file_type,
+            metrics=self.metrics
+        )
+        for old_path, new_path in moves:
+            self._move(old_path, new_path, ignore, crawler)
+        writer = IndexWriter(on_commit=self._index_changed, metrics=self.metrics)
+        # Differences of rollups by folder that contains changed path
+        changes: dict[str, dict[str, list]] = {}
+        # Folders that are deleted or crawled, changes inside are included
+        replaced: set[str] = set()
+        new_folders: list[str] = []
+        removed_folders: list[str] = []
+
+        # Parents go before children
+        for path in sorted(paths):
+            parent = os.path.dirname(path)
+            space = self._get_space(parent)
+            if space is None or any(p in replaced for p in self._parents(parent)):
+                continue
+            if parent not in folder_rules:
+                folder_rules[parent] = ignore.for_path(parent, space)
+            if folder_rules[parent].ignored(path, os.path.basename(path), os.path.isdir(path)):
+                continue
+            parent_id = self._get_folder_id(parent, db)
+            if parent_id is None:
+                # Parent is not indexed (yet), refresh will handle it
+                continue
+
+            old = (FileObjectBase.select().where(
+                FileObjectBase.full_path == path
+            ).dicts().first())
+            try:
+                path_stat = os.lstat(path)
+            except OSError:
+                path_stat = None
+
+            if path_stat is None:
+                if old is None:
+                    continue
+                # Rollups of removed folder are read before it's deleted
+                self._subtract(changes.setdefault(parent, {}), old)
+                if old["type"] == "folder":
+                    writer.delete_subtree(path)
+                    replaced.add(path)
+                    removed_folders.append(path)
+                else:
+                    writer.delete(path)
+            elif stat.S_ISDIR(path_stat.st_mode):
+                if old is not None and old["type"] == "folder":
+                    # Changes inside are reported separately
+                    continue
+                new_folders.append(path)
+                replaced.add(path)
+            else:
+                row = crawler.file_row(parent, os.path.basename(path), path_stat)
+                row["id"] = old["id"] if old is not None else self._new_id()
+                row["parent_id"] = parent_id
+                if row == old:
+                    continue
+                change = changes.setdefault(parent, {})
+                if old is not None:
+                    self._subtract(change, old)
+                    if old["type"] == "folder":
+                        writer.delete_subtree(path, include_self=False)
+                        removed_folders.append(path)
+                add_file_stats(change, row)
+                writer.upsert(row)
+
+        with db.atomic():
+            writer.flush()
+            for parent, change in changes.items():
+                self._add_stats(parent, change)
+        for path in removed_folders:
+            self._forget_folder(path)
+        self._index_changed()
+
+        for path in new_folders:
+            change: dict[str, list] = {}
+            old = (FileObjectBase.select().where(
+                FileObjectBase.full_path == path
+            ).dicts().first())
+            if old is not None:
+                self._subtract(change, old)
+            self._refresh(Path(path), space=False)
+            folder_id = self._get_folder_id(path, db)
+            if folder_id is not None:
+                add_stats(change, self._get_folder_stats(folder_id))
+            with db.atomic():
+                self._add_stats(os.path.dirname(path), change)
+            self._index_changed()
+            self._watch_tree(path)
+        logging.debug(f"{len(paths)} changed paths written")
+
+    def _move(self, old_path: str, new_path: str, ignore: IgnoreRules, crawler: Crawler):
+        """
+        Write a file or folder that was moved or renamed. Its row keeps its id, so
+        rollups, hashes and metadata are kept, folder is not crawled again.
+        Rows inside of a moved folder get new paths in one statement, their
+        names and search index are not changed. Moves that can't be written
+        like this are left to _apply_changes as removal and creation. Runs in
+        writer thread.
+
+        Args:
+            old_path (str): Full path before moving.
+            new_path (str): Full path after moving.
+            ignore (IgnoreRules): Ignore rules of spaces, see IgnoreRules.for_path.
+            crawler (Crawler): Crawler that builds file rows.
+        """
+        old_parent = os.path.dirname(old_path)
+        new_parent = os.path.dirname(new_path)
+        space = self._get_space(new_parent)
+        if space is None or self._get_space(old_parent) is None:
+            return
+        parent_id = self._get_folder_id(new_parent, db)
+        old = FileObjectBase.select().where(FileObjectBase.full_path == old_path).dicts().first()
+        if (parent_id is None or old is None or old["type"] == "space" or
+                FileObjectBase.select().where(FileObjectBase.full_path == new_path).exists()):
+            return
+        try:
+            path_stat = os.lstat(new_path)
+        except OSError:
+            # Moved again or removed
+            return
+        is_dir = stat.S_ISDIR(path_stat.st_mode)
+        name = os.path.basename(new_path)
+        if (is_dir != (old["type"] == "folder") or
+                ignore.for_path(new_parent, space).ignored(new_path, name, is_dir)):
+            return
+
+        removed: dict[str, list] = {}
+        self._subtract(removed, old)
+        added: dict[str, list] = {}
+        if is_dir:
+            row = dict(old, full_path=new_path, full_name=name, name=name,
+                       parent_id=parent_id, mtime=path_stat.st_mtime)
+            add_stats(added, self._get_folder_stats(old["id"]))
+        else:
+            row = crawler.file_row(new_parent, name, path_stat)
+            row["id"] = old["id"]
+            row["parent_id"] = parent_id
+            add_file_stats(added, row)
+
+        with db.atomic():
+            if is_dir:
+                old_prefix = os.path.join(old_path, "")
+                (FileObjectBase.update(full_path=Value(os.path.join(new_path, "")).concat(
+                    fn.SUBSTR(FileObjectBase.full_path, len(old_prefix) + 1)
+                )).where(
+                    in_subtree(FileObjectBase.full_path, old_path) &
+                    (FileObjectBase.full_path != old_path)
+                ).execute())
+            FileObjectBase.update(row).where(FileObjectBase.id == old["id"]).execute()
+            if old_parent == new_parent:
+                add_stats(removed, added)
+                self._add_stats(new_parent, removed)
+            else:
+                self._add_stats(old_parent, removed)
+                self._add_stats(new_parent, added)
+        if is_dir:
+            if self.folders is not None:
+                self.folders.move(old_path, new_path)
+            self._watch_tree(new_path)
+        self._index_changed()
+
+    def _parents(self, path: str) -> list[str]:
+        """
+        Get the folder and every folder above it up to its space.
+
+        Args:
+            path (str): Folder full path inside of a space.
+
+        Returns:
+            list[str]: Full paths from the folder to the space.
+        """
+        space = self._get_space(path)
+        parents = [path]
+        while path != space:
+            path = os.path.dirname(path)
+            parents.append(path)
+        return parents
+
+    def _subtract(self, change: dict[str, list], old: dict):
+        """
+        Subtract a file or a folder that was removed from index from rollup
+        difference. Runs in writer thread.
+
+        Args:
+            change (dict[str, list]): Rollup difference, see add_file_stats.
+            old (dict): Row that was removed.
+        """
+        if old["type"] != "folder":
+            add_file_stats(change, old, -1)
+            return
+        for type, (files, size, _, _) in self._get_folder_stats(old["id"]).items():
+            add_stats(change, {type: [-files, -size, None, None]})
+
+    def _add_stats(self, path: str, change: dict[str, list]):
+        """
+        Add rollup difference to a folder and every folder above it, sizes of
+        folders are updated too.
+
+        Args:
+            path (str): Folder full path inside of a space.
+            change (dict[str, list]): Rollup difference, see add_file_stats.
+        """
+        parents = self._parents(path)
+        parent_ids = [row.id for row in FileObjectBase.select(FileObjectBase.id).where(
+            FileObjectBase.full_path.in_(parents))]
+        size = sum(size for _, size, _, _ in change.values())
+        if size != 0:
+            (FileObjectBase.update(size=FileObjectBase.size + size).where(
+                FileObjectBase.id.in_(parent_ids)
+            ).execute())
+
+        for type, (files, size, newest, oldest) in change.items():
+            if files == 0 and size == 0 and newest is None:
+                continue
+            (FolderStats.insert_many([
+                self._stats_row(parent_id, type, [files, size, newest, oldest])
+                for parent_id in parent_ids
+            ]).on_conflict(
+                conflict_target=[FolderStats.folder_id, FolderStats.type],
+                update={
+                    FolderStats.files: FolderStats.files + EXCLUDED.files,
+                    FolderStats.size: FolderStats.size + EXCLUDED.size,
+                    FolderStats.newest: fn.MAX(
+                        fn.COALESCE(FolderStats.newest, EXCLUDED.newest),
+                        fn.COALESCE(EXCLUDED.newest, FolderStats.newest)),
+                    FolderStats.oldest: fn.MIN(
+                        fn.COALESCE(FolderStats.oldest, EXCLUDED.oldest),
+                        fn.COALESCE(EXCLUDED.oldest, FolderStats.oldest)),
+                }
+            ).execute())
+        # Last file of a type was removed
+        (FolderStats.delete().where(
+            FolderStats.folder_id.in_(parent_ids) & (FolderStats.files <= 0)
+        ).execute())
+
+    async def _search_duplicates(self):
+        try:
+            await self.loop.run_in_executor(None, self._hash_duplicates)
+        except Exception:
+            logging.exception("Duplicate search failed")
+
+    def _hash_duplicates(self):
+        """
+        Hash files that can have duplicates, see get_duplicates. Files with the
+        same size get partial hash, files with the same size and partial hash get
+        full hash. Files are hashed once while they don't change. Hashing is done
+        in a pool of processes, reading is limited by hash_rate.
+
+        Runs in its own thread, reads index with read-only connection and writes
+        hashes through writer thread.
+        """
+        logging.info("Searching duplicates")
+        self.writer.submit(self._forget_stale_hashes).result()
+        throttle = Throttle(self.hash_rate * 1024 * 1024)
+        with _process_pool(HASH_WORKERS) as executor:
+            groups: list[list[dict]] = []
+            for group in self._size_groups():
+                groups.append(group)
+                if sum(map(len, groups)) >= HASH_BATCH:
+                    self._hash_groups(groups, executor, throttle)
+                    groups = []
+            self._hash_groups(groups, executor, throttle)
+        logging.info("Duplicate search finished")
+
+    def _size_groups(self) -> Iterator[list[dict]]:
+        """
+        Read files that have the same size as other files, with their hashes.
+        Index is read by size in batches, so no read transaction is open for
+        long.
+
+        Yields:
+            list[dict]: Files of the same size (id, full_path, size, mtime, partial
+            and full). Hashes are None if file was not hashed.
+        """
+        last: tuple[int, int] | None = None
+        group: list[dict] = []
+        while True:
+            query = (FileObjectBase.select(
+                FileObjectBase.id, FileObjectBase.full_path, FileObjectBase.size,
+                FileObjectBase.mtime,
+                FileHash.partial, FileHash.full
+            ).join(FileHash, JOIN.LEFT_OUTER, on=current_version(FileHash)).where(
+                FileObjectBase.type.not_in(("folder", "space")) &
+                # Empty files are all the same, removing them frees nothing
+                (FileObjectBase.size > 0)
+            ).order_by(FileObjectBase.size, FileObjectBase.id)
+                .limit(HASH_BATCH).dicts().bind(read_db))
+            if last is not None:
+                query = query.where(
+                    Tuple(FileObjectBase.size, FileObjectBase.id) > Tuple(*last))
+            with read_db.connection_context():
+                rows = list(query)
+            if not rows:
+                break
+
+            for row in rows:
+                if group and group[0]["size"] != row["size"]:
+                    if len(group) > 1:
+                        yield group
+                    group = []
+                group.append(row)
+            last = (rows[-1]["size"], rows[-1]["id"])
+        if len(group) > 1:
+            yield group
+
+    def _hash_groups(self, groups: list[list[dict]], executor: ProcessPoolExecutor,
+                     throttle: Throttle):
+        """
+        Calculate missing hashes of files of the same size, see _hash_duplicates.
+
+        Args:
+            groups (list[list[dict]]): Files grouped by size, see _size_groups.
+            Hashes are set on the same dicts.
+            executor (ProcessPoolExecutor): Pool that hashes files.
+            throttle (Throttle): Limits how fast files are read.
+        """
+        rows = {row["full_path"]: row for group in groups for row in group}
+        hashed = self._hash_rows(
+            [row for row in rows.values() if row["partial"] is None],
+            partial_hash, "partial", executor, throttle)
+        for row in hashed.values():
+            if row["size"] <= 2 * BLOCK:
+                # Whole file was read
+                row["full"] = row["partial"]
+
+        same_partial: dict[tuple[int, str], list[dict]] = {}
+        for row in rows.values():
+            if row["partial"] is not None:
+                same_partial.setdefault((row["size"], row["partial"]), []).append(row)
+        hashed.update(self._hash_rows(
+            [row for group in same_partial.values() if len(group) > 1
+             for row in group if row["full"] is None],
+            full_hash, "full", executor, throttle))
+
+        self.writer.submit(self._write_hashes, [
+            {key: row[key] for key in ("id", "size", "mtime", "partial", "full")}
+            for row in hashed.values()
+        ]).result()
+
+    def _hash_rows(self, rows: list[dict], hash_function, key: str,
+                   executor: ProcessPoolExecutor, throttle: Throttle) -> dict[str, dict]:
+        """Set key of rows to hash of their files, returns rows that were hashed by path"""
+        by_path = {row["full_path"]: row for row in rows}
+        hashed = {}
+        for path, digest in hash_files(
+                [(row["full_path"], row["size"]) for row in rows],
+                hash_function, executor, throttle):
+            if digest is not None:
+                by_path[path][key] = digest
+                hashed[path] = by_path[path]
+        return hashed
+
+    def _write_hashes(self, rows: list[dict]):
+        """Insert or update rows of FileHash. Runs in writer thread."""
+        with db.atomic():
+            for batch in chunked(rows, HASH_BATCH // 10):
+                (FileHash.insert_many(batch).on_conflict(
+                    conflict_target=[FileHash.id],
+                    preserve=[FileHash.size, FileHash.mtime, FileHash.partial, FileHash.full]
+                ).execute())
+
+    def _forget_stale_hashes(self):
+        """
+        Remove hashes of files that were removed or changed. Runs in writer thread.
+        """
+        current = FileObjectBase.select().where(current_version(FileHash))
+        FileHash.delete().where(~fn.EXISTS(current)).execute()
+
+    def get_media(self, path: Path) -> dict | None:
+        """
+        Get metadata of a media file that was examined since it was last
+        modified, see _examine_media.
+
+        Args:
+            path (Path): File full path.
+
+        Returns:
+            dict | None: width, height, duration (None if unknown) and
+            thumbnail (key of thumbnail, see get_thumbnail, None if there is no
+            thumbnail). None if file was not examined.
+        """
+        media = (FileMedia.select().join(FileObjectBase, on=current_version(FileMedia))
+                 .where(FileObjectBase.full_path == str(path)).bind(read_db).first())
+        if media is None:
+            return None
+        return {
+            "width": media.width,
+            "height": media.height,
+            "duration": media.duration,
+            "thumbnail": (media_key(media.id, media.size, media.mtime)
+                          if media.thumbnail else None),
+        }
+
+    def get_thumbnail(self, path: Path) -> tuple[Path, str] | None:
+        """
+        Get thumbnail of an image from cache. Thumbnails are made in the
+        background, nothing is decoded while serving them.
+
+        Args:
+            path (Path): Image full path.
+
+        Returns:
+            tuple[Path, str] | None: Thumbnail file and its key, which changes
+            when the image changes. None if there is no thumbnail (yet).
+        """
+        media = self.get_media(path)
+        if media is None or media["thumbnail"] is None or self.media_directory is None:
+            return None
+        key = media["thumbnail"]
+        return Path(thumbnail_path(str(self.media_directory), key)), key
+
+    def get_download(self, path: Path) -> FileObjectBase | None:
+        """
+        Get file or folder that can be downloaded. Only paths that are in index
+        and inside of a space can be downloaded, so nothing else on disk is
+        reachable with crafted paths.
+
+        Args:
+            path (Path): File/folder full path.
+
+        Returns:
+            FileObjectBase | None: Indexed row or None if path is not in index.
+        """
+        full_path = str(path)
+        if self._get_space(full_path) is None:
+            return None
+        return (FileObjectBase.select()
+                .where(FileObjectBase.full_path == full_path)
+                .bind(read_db).first())
+
+    def walk_download(self, path: Path) -> Iterator[dict]:
+        """
+        Read files and folders inside of a folder for its zip. Rows are read in
+        batches of DOWNLOAD_BATCH by path, so parents go before their children
+        and index is not locked while the zip is sent.
+
+        Args:
+            path (Path): Folder full path.
+
+        Yields:
+            dict: full_path, type, size and mtime of files and folders.
+        """
+        full_path = str(path)
+        after = None
+        while True:
+            query = (FileObjectBase
+                     .select(FileObjectBase.full_path, FileObjectBase.type,
+                             FileObjectBase.size, FileObjectBase.mtime)
+                     .where(in_subtree(FileObjectBase.full_path, full_path) &
+                            (FileObjectBase.full_path != full_path))
+                     .order_by(FileObjectBase.full_path)
+                     .limit(DOWNLOAD_BATCH).dicts().bind(read_db))
+            if after is not None:
+                query = query.where(FileObjectBase.full_path > after)
+            rows = list(query)
+            yield from rows
+            if len(rows) < DOWNLOAD_BATCH:
+                return
+            after = rows[-1]["full_path"]
+
+    async def _examine_media(self):
+        try:
+            await self.loop.run_in_executor(None, self._read_media)
+        except Exception:
+            logging.exception("Reading metadata of media files failed")
+
+    def _read_media(self):
+        """
+        Read metadata of images, videos and audio and make thumbnails of
+        images (see server.media). Files are examined once while they don't
+        change. Work is done in a pool of processes, so decoding images
+        doesn't hold the GIL of the server.
+
+        Runs in its own thread, reads index with read-only connection and
+        writes metadata through writer thread.
+        """
+        logging.info("Reading metadata of media files")
+        self.writer.submit(self._forget_stale_media).result()
+        directory = str(self.media_directory)
+        os.makedirs(directory, exist_ok=True)
+        examined = 0
+        executor = _process_pool(MEDIA_WORKERS)
+        try:
+            last_id = 0
+            while True:
+                query = (FileObjectBase.select(
+                    FileObjectBase.id, FileObjectBase.full_path, FileObjectBase.type,
+                    FileObjectBase.size, FileObjectBase.mtime
+                ).join(FileMedia, JOIN.LEFT_OUTER, on=current_version(FileMedia)).where(
+                    FileObjectBase.type.in_(MEDIA_TYPES) &
+                    FileMedia.id.is_null() &
+                    (FileObjectBase.id > last_id)
+                ).order_by(FileObjectBase.id).limit(MEDIA_BATCH).dicts().bind(read_db))
+                with read_db.connection_context():
+                    rows = list(query)
+                if not rows:
+                    break
+                media, executor = self._extract_media(rows, directory, executor)
+                self.writer.submit(self._write_media, media).result()
+                examined += len(rows)
+                last_id = rows[-1]["id"]
+        finally:
+            executor.shutdown()
+        logging.info(f"Read metadata of {examined} media files")
+
+    def _extract_media(
+        self,
+        rows: list[dict],
+        directory: str,
+        executor: ProcessPoolExecutor
+    ) -> tuple[list[dict], ProcessPoolExecutor]:
+        """
+        Examine media files in a pool of processes, see extract_media. File that
+        can't be examined gets a row without metadata, so it's skipped until it
+        changes. If a file stops a worker process, the pool is replaced and the
+        files that were in it are examined again one at a time, only the file
+        that stopped a worker is skipped.
+
+        Args:
+            rows (list[dict]): Files (id, full_path, type, size and mtime).
+            directory (str): Cache directory of thumbnails.
+            executor (ProcessPoolExecutor): Pool that examines files.
+
+        Returns:
+            tuple[list[dict], ProcessPoolExecutor]: Rows of FileMedia and pool
+            to examine next files in.
+        """
+        def submit(row: dict) -> Future:
+            return executor.submit(extract_media, row["id"], row["full_path"], row["type"],
+                                   row["size"], row["mtime"], directory)
+
+        media: list[dict] = []
+        broken: list[dict] = []
+        futures = [submit(row) for row in rows]
+        for row, future in zip(rows, futures):
+            try:
+                media.append(future.result())
+            except BrokenProcessPool:
+                broken.append(row)
+            except Exception:
+                logging.exception(f"Can't examine {row['full_path']}")
+                media.append(media_row(row["id"], row["size"], row["mtime"]))
+
+        if broken:
+            executor.shutdown()
+            executor = _process_pool(MEDIA_WORKERS)
+        for row in broken:
+            try:
+                media.append(submit(row).result())
+                continue
+            except BrokenProcessPool:
+                logging.warning(f"Worker process stopped while examining {row['full_path']}")
+                executor.shutdown()
+                executor = _process_pool(MEDIA_WORKERS)
+            except Exception:
+                logging.exception(f"Can't examine {row['full_path']}")
+            media.append(media_row(row["id"], row["size"], row["mtime"]))
+        return media, executor
+
+    def _write_media(self, rows: list[dict]):
+        """Insert or update rows of FileMedia. Runs in writer thread."""
+        with db.atomic():
+            for batch in chunked(rows, MEDIA_BATCH):
+                (FileMedia.insert_many(batch).on_conflict(
+                    conflict_target=[FileMedia.id],
+                    preserve=[FileMedia.size, FileMedia.mtime, FileMedia.width,
+                              FileMedia.height, FileMedia.duration, FileMedia.thumbnail]
+                ).execute())
+
+    def _forget_stale_media(self):
+        """
+        Remove metadata and thumbnails of files that were removed or changed.
+        Runs in writer thread.
+        """
+        current = FileObjectBase.select().where(current_version(FileMedia))
+        stale = FileMedia.select().where(~fn.EXISTS(current))
+        for media in stale.where(FileMedia.thumbnail):
+            key = media_key(media.id, media.size, media.mtime)
+            try:
+                os.remove(thumbnail_path(str(self.media_directory), key))
+            except OSError:
+                pass
+        FileMedia.delete().where(~fn.EXISTS(current)).execute()
+        if not self._thumbnails_swept:
+            self._sweep_thumbnails()
+            self._thumbnails_swept = True
+
+    def _sweep_thumbnails(self):
+        """
+        Remove thumbnails that no row of FileMedia refers to: thumbnails of
+        older keys, of rebuilt index and temporary files of interrupted
+        passes. Runs in writer thread once per run, before media is examined.
+        """
+        keys = {f"{media_key(media.id, media.size, media.mtime)}.jpg"
+                for media in FileMedia.select().where(FileMedia.thumbnail)}
+        for directory, _, files in os.walk(str(self.media_directory)):
+            for name in files:
+                if name not in keys:
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
+
+    def _get_file_type(self, ext: str) -> str:
+        """Get file type by it's extension.
+
+        Args:
+            ext (str): Extension
+
+        Returns:
+            str: File type.
+        """
+        try:
+            return self.filetypes[ext]
+        except KeyError:
+            return "other"
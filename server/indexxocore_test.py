@@ -0,0 +1,1009 @@
+import asyncio
+import datetime
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import wave
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+from unittest import mock
+from server.indexxocore import (
+    Indexxo, FileObjectBase, FileHash, SpaceScan, INDEXES, db, _encode_cursor)
+from server.duplicates import BLOCK
+from server.filetypes import filetypes
+from server.media import Image
+from server.watcher import Watcher, WatchLimitError
+
+
+class CrashingPool():
+    """
+    Pool that runs work in the calling thread when a result is needed. A file
+    named crash.* stops the pool like a worker process that died, every
+    file in the pool fails. A file named error.* raises an error.
+    """
+    started = 0
+
+    def __init__(self, workers: int):
+        CrashingPool.started += 1
+        self.broken = False
+        self.pending: list[tuple[Future, Callable, tuple]] = []
+
+    def submit(self, function: Callable, *args) -> Future:
+        future = Future()
+        # Work is done when any result is needed
+        future.result = lambda timeout=None: self._run() or Future.result(future, timeout)
+        self.pending.append((future, function, args))
+        return future
+
+    def shutdown(self):
+        pass
+
+    def _run(self):
+        pending, self.pending = self.pending, []
+        self.broken = self.broken or any(
+            os.path.basename(args[1]).startswith("crash.") for _, _, args in pending)
+        for future, function, args in pending:
+            if self.broken:
+                future.set_exception(BrokenProcessPool())
+            elif os.path.basename(args[1]).startswith("error."):
+                future.set_exception(RuntimeError())
+            else:
+                future.set_result(function(*args))
+
+
+class IndexxoTest(unittest.TestCase):
+    temp_dir: tempfile.TemporaryDirectory
+    temp_dir_path: pathlib.Path
+    space_path: pathlib.Path
+
+    def setUp(self):
+        """
+        Creates temporary directory with a small space in it and indexer
+        that uses database in the same directory.
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = pathlib.Path(self.temp_dir.name)
+        self.space_path = self.temp_dir_path / "space"
+        (self.space_path / "folder1" / "subfolder").mkdir(parents=True)
+        (self.space_path / "folder2").mkdir()
+        (self.space_path / "file.txt").write_bytes(b"1" * 10)
+        (self.space_path / "folder1" / "image.png").write_bytes(b"1" * 20)
+        (self.space_path / "folder1" / "subfolder" / "video.mkv").write_bytes(b"1" * 30)
+        self.indexxo = self.create_indexxo()
+
+    def tearDown(self):
+        """
+        Deletes temporary directory with database
+        """
+        if self.indexxo.watcher is not None:
+            self.indexxo.watcher.close()
+        db.close()
+        self.temp_dir.cleanup()
+
+    def create_indexxo(self) -> Indexxo:
+        return Indexxo(
+            filetypes=filetypes,
+            space_paths=[self.space_path],
+            ignore_paths=[],
+            refresh_interval=3600,
+            crawler_workers=4,
+            database_path=self.temp_dir_path / "database.sqlite"
+        )
+
+    def discover(self):
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+
+    def get_row(self, path: pathlib.Path) -> FileObjectBase:
+        return FileObjectBase.get_or_none(FileObjectBase.full_path == str(path))
+
+    def apply_changes(self):
+        """Write changes that watcher reported so far"""
+        changed, moves, _ = self.indexxo.watcher.read_events()
+        self.indexxo.writer.submit(self.indexxo._apply_changes, changed, moves).result()
+
+    def test_discover(self):
+        """
+        Indexing a space for the first time
+        """
+        self.discover()
+        self.assertEqual(7, FileObjectBase.select().count())
+
+        space = self.get_row(self.space_path)
+        self.assertEqual("space", space.type)
+        self.assertIsNone(space.parent_id)
+        self.assertEqual(60, space.size)
+
+        folder = self.get_row(self.space_path / "folder1")
+        self.assertEqual("folder", folder.type)
+        self.assertEqual(space.id, folder.parent_id)
+        self.assertEqual(50, folder.size)
+
+        image = self.get_row(self.space_path / "folder1" / "image.png")
+        self.assertEqual("image", image.type)
+        self.assertEqual(".png", image.extension)
+        self.assertEqual("image", image.name)
+        self.assertEqual(20, image.size)
+
+    def test_discover_ignore_paths(self):
+        """
+        Ignored folders are not indexed and their size is not counted
+        """
+        self.indexxo.ignore_paths = [self.space_path / "folder1"]
+        self.discover()
+        self.assertIsNone(self.get_row(self.space_path / "folder1"))
+        self.assertIsNone(self.get_row(self.space_path / "folder1" / "image.png"))
+        self.assertEqual(10, self.get_row(self.space_path).size)
+
+    def test_discover_ignore_patterns(self):
+        """
+        Patterns of ignore_paths apply at any depth, patterns of ignore files
+        apply below the file and are read again even if folder didn't change
+        """
+        self.indexxo.ignore_paths = ["*.png", "subfolder/"]
+        self.indexxo.ignore_files = [".indexxoignore"]
+        (self.space_path / "folder2" / ".indexxoignore").write_text("*.log\n!keep.log\n")
+        (self.space_path / "folder2" / "debug.log").write_bytes(b"1" * 3)
+        (self.space_path / "folder2" / "keep.log").write_bytes(b"1" * 4)
+        self.discover()
+        self.assertIsNone(self.get_row(self.space_path / "folder1" / "image.png"))
+        self.assertIsNone(self.get_row(self.space_path / "folder1" / "subfolder"))
+        self.assertEqual(0, self.get_row(self.space_path / "folder1").size)
+        self.assertIsNone(self.get_row(self.space_path / "folder2" / "debug.log"))
+        self.assertEqual(4, self.get_row(self.space_path / "folder2" / "keep.log").size)
+
+        mtime = os.stat(self.space_path / "folder2").st_mtime_ns
+        (self.space_path / "folder2" / ".indexxoignore").write_text("*.log\n")
+        self.assertEqual(mtime, os.stat(self.space_path / "folder2").st_mtime_ns)
+        self.discover()
+        self.assertIsNone(self.get_row(self.space_path / "folder2" / "keep.log"))
+        self.assertIsNotNone(self.get_row(self.space_path / "folder2" / ".indexxoignore"))
+
+    def test_discover_ignore_removed(self):
+        """
+        Entries that are not ignored anymore are indexed although folders
+        didn't change
+        """
+        self.indexxo.ignore_paths = ["subfolder"]
+        self.discover()
+        self.assertIsNone(self.get_row(self.space_path / "folder1" / "subfolder"))
+
+        self.indexxo.ignore_paths = []
+        self.discover()
+        self.assertEqual(
+            30, self.get_row(self.space_path / "folder1" / "subfolder" / "video.mkv").size)
+        self.assertEqual(60, self.get_row(self.space_path).size)
+
+        self.indexxo.ignore_files = [".indexxoignore"]
+        (self.space_path / "folder1" / ".indexxoignore").write_text("*.mkv\n")
+        self.discover()
+        self.assertIsNone(self.get_row(self.space_path / "folder1" / "subfolder" / "video.mkv"))
+
+        mtime = os.stat(self.space_path / "folder1").st_mtime_ns
+        (self.space_path / "folder1" / ".indexxoignore").write_text("")
+        self.assertEqual(mtime, os.stat(self.space_path / "folder1").st_mtime_ns)
+        self.discover()
+        self.assertEqual(
+            30, self.get_row(self.space_path / "folder1" / "subfolder" / "video.mkv").size)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_watch_ignored_changes(self):
+        """
+        Watched changes of ignored paths are not written
+        """
+        self.indexxo.ignore_paths = ["*.png"]
+        self.indexxo.ignore_files = [".indexxoignore"]
+        (self.space_path / "folder2" / ".indexxoignore").write_text("*.log\n")
+        self.indexxo.watcher = Watcher()
+        self.discover()
+        (self.space_path / "folder2" / "new.png").write_bytes(b"1" * 5)
+        (self.space_path / "folder2" / "new.log").write_bytes(b"1" * 5)
+        (self.space_path / "folder2" / "new.txt").write_bytes(b"1" * 5)
+        self.apply_changes()
+
+        self.assertIsNone(self.get_row(self.space_path / "folder2" / "new.png"))
+        self.assertIsNone(self.get_row(self.space_path / "folder2" / "new.log"))
+        self.assertEqual(5, self.get_row(self.space_path / "folder2" / "new.txt").size)
+
+    def test_discover_empty_space(self):
+        """
+        Empty space is still a space
+        """
+        self.space_path = self.temp_dir_path / "empty"
+        self.space_path.mkdir()
+        self.discover()
+        self.assertEqual("space", self.get_row(self.space_path).type)
+
+    def test_refresh_changes(self):
+        """
+        Refreshing index only applies what changed on disk
+        """
+        self.discover()
+        (self.space_path / "file.txt").unlink()
+        (self.space_path / "folder1" / "subfolder" / "new.mp3").write_bytes(b"1" * 5)
+        self.discover()
+
+        self.assertIsNone(self.get_row(self.space_path / "file.txt"))
+        new_file = self.get_row(self.space_path / "folder1" / "subfolder" / "new.mp3")
+        self.assertEqual("audio", new_file.type)
+        self.assertEqual(55, self.get_row(self.space_path / "folder1").size)
+        self.assertEqual(55, self.get_row(self.space_path).size)
+
+    def test_refresh_edited_file(self):
+        """
+        File edited in place is refreshed even though its folder didn't change
+        """
+        self.discover()
+        folder_mtime = (self.space_path / "folder1").stat().st_mtime
+        with open(self.space_path / "folder1" / "image.png", "ab") as file:
+            file.write(b"1" * 1000)
+        self.assertEqual(folder_mtime, (self.space_path / "folder1").stat().st_mtime)
+        self.discover()
+        self.assertEqual(1020, self.get_row(self.space_path / "folder1" / "image.png").size)
+        self.assertEqual(1060, self.get_row(self.space_path).size)
+        self.assertEqual(1060, self.indexxo.get_stats(self.space_path)["size"])
+
+    def test_refresh_listing_failed(self):
+        """
+        Folder that can't be listed keeps what is known inside of it and is
+        listed again on the next refresh
+        """
+        self.discover()
+        folder = self.space_path / "folder1"
+        (folder / "new.txt").write_bytes(b"1" * 5)
+        scandir = os.scandir
+
+        def failing_scandir(path):
+            if path == str(folder):
+                raise OSError(5, "Input/output error")
+            return scandir(path)
+
+        with (mock.patch("server.crawler.os.scandir", failing_scandir),
+              self.assertLogs(level="WARNING")):
+            self.discover()
+        self.assertEqual(20, self.get_row(folder / "image.png").size)
+        self.assertEqual(30, self.get_row(folder / "subfolder" / "video.mkv").size)
+        self.assertIsNone(self.get_row(folder / "new.txt"))
+        self.assertEqual(60, self.get_row(self.space_path).size)
+
+        self.discover()
+        self.assertEqual(5, self.get_row(folder / "new.txt").size)
+        self.assertEqual(20, self.get_row(folder / "image.png").size)
+        self.assertEqual(65, self.get_row(self.space_path).size)
+
+    def test_refresh_small_batches(self):
+        """
+        Refresh gives the same index when changes are split into many transactions
+        """
+        with mock.patch("server.indexxocore.TRANSACTION_ROWS", 2):
+            self.discover()
+            (self.space_path / "folder2" / "new.txt").write_bytes(b"1" * 5)
+            self.discover()
+        self.assertEqual(8, FileObjectBase.select().count())
+        self.assertEqual(65, self.get_row(self.space_path).size)
+
+    def test_refresh_folder_replaced(self):
+        """
+        Folder that was replaced with a file is removed with its content
+        """
+        self.discover()
+        subfolder = self.space_path / "folder1" / "subfolder"
+        (subfolder / "video.mkv").unlink()
+        subfolder.rmdir()
+        subfolder.write_bytes(b"1" * 3)
+        self.discover()
+        self.assertEqual("other", self.get_row(subfolder).type)
+        self.assertIsNone(self.get_row(subfolder / "video.mkv"))
+        self.assertEqual(23, self.get_row(self.space_path / "folder1").size)
+
+    def test_refresh_removed_space(self):
+        """
+        Space that was deleted from disk is removed from index
+        """
+        self.discover()
+        for path in sorted(self.space_path.rglob("*"), reverse=True):
+            path.unlink() if path.is_file() else path.rmdir()
+        self.space_path.rmdir()
+        self.discover()
+        self.assertEqual(0, FileObjectBase.select().count())
+
+    def test_refresh_keeps_other_spaces(self):
+        """
+        Refreshing a space doesn't touch rows of a space with a similar name
+        """
+        other_space = self.temp_dir_path / "space2"
+        other_space.mkdir()
+        (other_space / "file.txt").write_bytes(b"1")
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(other_space))
+        self.discover()
+        self.assertIsNotNone(self.get_row(other_space / "file.txt"))
+
+    def test_refresh_spaces_concurrently(self):
+        """
+        Spaces are walked at the same time, rows of both of them are written
+        through writer thread with their own crawler threads
+        """
+        other_space = self.temp_dir_path / "space2"
+        (other_space / "folder").mkdir(parents=True)
+        (other_space / "folder" / "file.txt").write_bytes(b"1")
+        self.indexxo.space_options[str(other_space)] = {"crawler_workers": 1}
+        self.indexxo._schedule(other_space)
+        async def discover_both():
+            await asyncio.gather(self.indexxo._discover(self.space_path),
+                                 self.indexxo._discover(other_space))
+
+        with mock.patch("server.indexxocore.TRANSACTION_ROWS", 2):
+            self.indexxo.loop.run_until_complete(discover_both())
+        self.assertEqual(10, FileObjectBase.select().count())
+        folder = self.get_row(other_space / "folder")
+        self.assertEqual(self.get_row(other_space).id, folder.parent_id)
+        self.assertEqual(folder.id, self.get_row(other_space / "folder" / "file.txt").parent_id)
+        refresh = self.indexxo.writer.submit(
+            self.indexxo._start_refresh, other_space, True).result()
+        self.assertEqual(1, refresh.crawler.workers)
+
+    def test_changes_wait_for_refresh(self):
+        """
+        Watched changes inside of a space that is being refreshed are written
+        after the refresh, moves from there are written as removal and creation
+        """
+        self.discover()
+        changed = {str(self.space_path / "file.txt"), str(self.temp_dir_path / "space2")}
+        self.indexxo._changed = set(changed)
+        self.indexxo._moves = [(str(self.space_path / "file.txt"),
+                                str(self.temp_dir_path / "space2"))]
+        self.indexxo._refreshing.add(str(self.space_path))
+        with (mock.patch("server.indexxocore.WATCH_DELAY", 0),
+              mock.patch.object(self.indexxo, "_apply_changes") as apply_changes):
+            self.indexxo.loop.run_until_complete(self.indexxo._write_changes())
+            apply_changes.assert_called_once_with({str(self.temp_dir_path / "space2")}, [])
+            self.assertEqual({str(self.space_path / "file.txt")}, self.indexxo._changed)
+
+            self.indexxo._refreshing.clear()
+            self.discover()
+            self.indexxo.loop.run_until_complete(self.indexxo._writing_changes)
+            apply_changes.assert_called_with({str(self.space_path / "file.txt")}, [])
+
+    def test_index_survives_restart(self):
+        """
+        Index from previous run is reused and marked as completed
+        """
+        self.discover()
+        self.assertIsNotNone(SpaceScan.get_or_none(
+            SpaceScan.full_path == str(self.space_path)))
+        self.indexxo = self.create_indexxo()
+        self.assertEqual(7, FileObjectBase.select().count())
+
+    def test_verify_on_start(self):
+        """
+        Every space is refreshed once after restart even if its index is
+        recent, spaces that were never indexed go first
+        """
+        self.discover()
+        other_space = self.temp_dir_path / "space2"
+        other_space.mkdir()
+        self.indexxo = self.create_indexxo()
+        self.indexxo.space_paths.append(other_space)
+        self.indexxo._schedule(other_space)
+        self.indexxo._verify_on_start()
+        self.assertEqual([other_space, self.space_path],
+                         [s.path for s in self.indexxo.scheduler.due(time.time())])
+
+    def test_outdated_schema_is_rebuilt(self):
+        """
+        Index with different schema version is dropped on start
+        """
+        self.discover()
+        db.pragma("user_version", 999)
+        self.indexxo = self.create_indexxo()
+        self.assertEqual(0, FileObjectBase.select().count())
+        self.assertEqual(0, SpaceScan.select().count())
+
+    def test_old_schema_is_migrated(self):
+        """
+        Index with older schema version is upgraded and kept
+        """
+        # Layout of version 1, rows are identified by full path, no search index
+        db.execute_sql('DROP TABLE "filesearch"')
+        db.execute_sql('DROP TABLE "fileobjectbase"')
+        db.execute_sql(
+            'CREATE TABLE "fileobjectbase" ("full_path" TEXT NOT NULL PRIMARY KEY, '
+            '"full_name" TEXT NOT NULL, "name" TEXT NOT NULL, "extension" TEXT, '
+            '"size" INTEGER NOT NULL, "type" TEXT NOT NULL, "parent" TEXT, '
+            '"mtime" REAL NOT NULL)')
+        space = str(self.space_path)
+        folder = str(self.space_path / "folder1")
+        db.execute_sql(
+            'INSERT INTO "fileobjectbase" VALUES '
+            '(?, ?, ?, NULL, 60, "space", NULL, 0), '
+            '(?, "folder1", "folder1", NULL, 50, "folder", ?, 0), '
+            '(?, "image.png", "image", ".png", 20, "image", ?, 0)',
+            (space, space, space, folder, space, folder + "/image.png", folder))
+        db.execute_sql(
+            'CREATE INDEX "fileobjectbase_parent_size_full_path" '
+            'ON "fileobjectbase" ("parent", "size", "full_path")')
+        db.execute_sql('CREATE INDEX "fileobjectbase_type" ON "fileobjectbase" ("type")')
+        db.pragma("user_version", 1)
+        self.indexxo = self.create_indexxo()
+
+        self.assertEqual(3, FileObjectBase.select().count())
+        indexes = {i.name for i in db.get_indexes("fileobjectbase")}
+        self.assertNotIn("fileobjectbase_parent_size_full_path", indexes)
+        self.assertNotIn("fileobjectbase_type", indexes)
+        self.assertTrue(set(INDEXES) <= indexes)
+        self.assertEqual(self.get_row(self.space_path).id,
+                         self.get_row(self.space_path / "folder1").parent_id)
+        content, _, _ = self.indexxo.get_content(self.space_path / "folder1")
+        self.assertEqual(["image.png"], [r.full_name for r in content])
+        self.assertEqual(["image.png"],
+                         [r.full_name for r in self.indexxo.find_files("image")[0]])
+
+    def test_path_keys_are_migrated(self):
+        """
+        Rollups and hashes of version 4 are moved from full paths to ids,
+        metadata is dropped
+        """
+        self.discover()
+        stats = self.indexxo.get_stats(self.space_path)
+        image = self.get_row(self.space_path / "folder1" / "image.png")
+        # Layout of version 4, rows are identified by full path
+        db.execute_sql('DROP TABLE "folderstats"')
+        db.execute_sql('DROP TABLE "filehash"')
+        db.execute_sql('DROP TABLE "filemedia"')
+        db.execute_sql(
+            'CREATE TABLE "folderstats" ("full_path" TEXT NOT NULL, "type" TEXT NOT NULL, '
+            '"files" INTEGER NOT NULL, "size" INTEGER NOT NULL, "newest" REAL, '
+            '"oldest" REAL, PRIMARY KEY ("full_path", "type"))')
+        db.execute_sql(
+            'CREATE TABLE "filehash" ("full_path" TEXT NOT NULL PRIMARY KEY, '
+            '"size" INTEGER NOT NULL, "mtime" REAL NOT NULL, "partial" TEXT, "full" TEXT)')
+        db.execute_sql('CREATE INDEX "filehash_size_partial" ON "filehash" ("size", "partial")')
+        db.execute_sql('CREATE INDEX "filehash_full_size" ON "filehash" ("full", "size")')
+        db.execute_sql(
+            'CREATE TABLE "filemedia" ("full_path" TEXT NOT NULL PRIMARY KEY, '
+            '"size" INTEGER NOT NULL, "mtime" REAL NOT NULL, "width" INTEGER, '
+            '"height" INTEGER, "duration" REAL, "thumbnail" INTEGER NOT NULL)')
+        for type, t in stats["types"].items():
+            db.execute_sql('INSERT INTO "folderstats" VALUES (?, ?, ?, ?, ?, ?)', (
+                str(self.space_path), type, t["files"], t["size"], t["newest"], t["oldest"]))
+        db.execute_sql('INSERT INTO "filehash" VALUES (?, ?, ?, "a", "b")',
+                       (image.full_path, image.size, image.mtime))
+        db.execute_sql('INSERT INTO "filemedia" VALUES (?, ?, ?, 1, 1, NULL, 0)',
+                       (image.full_path, image.size, image.mtime))
+        db.pragma("user_version", 4)
+        self.indexxo = self.create_indexxo()
+
+        self.assertEqual(stats, self.indexxo.get_stats(self.space_path))
+        self.assertEqual("b", FileHash.get_by_id(image.id).full)
+        self.assertIsNone(self.indexxo.get_media(pathlib.Path(image.full_path)))
+        indexes = {i.name for i in db.get_indexes("filehash")}
+        self.assertIn("filehash_size_partial", indexes)
+
+    def test_bulk_load(self):
+        """
+        Indexes are dropped while loading into empty index and created after
+        """
+        with mock.patch.object(self.indexxo, "drop_indexes",
+                               wraps=self.indexxo.drop_indexes) as drop_indexes:
+            self.discover()
+        drop_indexes.assert_called_once()
+        indexes = {i.name for i in db.get_indexes("fileobjectbase")}
+        self.assertTrue(set(INDEXES) <= indexes)
+        names = [r.full_name for r in self.indexxo.find_files("image")[0]]
+        self.assertEqual(["image.png"], names)
+
+    def test_bulk_load_failed(self):
+        """
+        Indexes and search triggers are restored when bulk load fails
+        """
+        with mock.patch.object(self.indexxo, "_write_walked", side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.discover()
+        self.assertEqual((0, 1), (self.indexxo.metrics.refreshes,
+                                  self.indexxo.metrics.refresh_failures))
+        indexes = {i.name for i in db.get_indexes("fileobjectbase")}
+        self.assertTrue(set(INDEXES) <= indexes)
+        self.discover()
+        self.assertEqual(1, self.indexxo.metrics.refreshes)
+        self.assertEqual(["image.png"],
+                         [r.full_name for r in self.indexxo.find_files("image")[0]])
+        (self.space_path / "folder2" / "new_image.png").write_bytes(b"1")
+        self.discover()
+        self.assertEqual(["image.png", "new_image.png"],
+                         [r.full_name for r in self.indexxo.find_files("image")[0]])
+
+    def test_forget_removed_spaces(self):
+        """
+        Spaces that were removed from settings are removed from index
+        """
+        self.discover()
+        self.indexxo.space_paths = []
+        self.indexxo._forget_removed_spaces()
+        self.assertEqual(0, FileObjectBase.select().count())
+        self.assertEqual(0, SpaceScan.select().count())
+
+    def test_find_files(self):
+        """
+        Search finds substrings of names, long queries use search index
+        """
+        self.discover()
+        self.assertTrue(self.indexxo.full_text_search)
+        names = [r.full_name for r in self.indexxo.find_files("IMAGE.p")[0]]
+        self.assertEqual(["image.png"], names)
+        names = [r.full_name for r in self.indexxo.find_files("er")[0]]
+        self.assertEqual(["folder1", "folder2", "subfolder"], names)
+        self.assertEqual(([], None), self.indexxo.find_files('"quoted"'))
+        with self.assertRaises(ValueError):
+            self.indexxo.find_files("ext: ")
+
+    def test_find_files_filters(self):
+        """
+        Filters narrow matches by type, extension, size and date
+        """
+        image = self.space_path / "folder1" / "image.png"
+        mtime = datetime.datetime(2020, 6, 15, 12).timestamp()
+        os.utime(image, (mtime, mtime))
+        self.discover()
+
+        def names(query: str) -> list[str]:
+            return [r.full_name for r in self.indexxo.find_files(query)[0]]
+
+        self.assertEqual(["video.mkv"], names("type:video"))
+        self.assertEqual(["subfolder", "video.mkv"], names("size:>20 size:<50"))
+        self.assertEqual(["file.txt", "image.png"], names("size:<=20b ext:png,TXT"))
+        self.assertEqual(["folder1"], names("type:folder 1 older"))
+        self.assertEqual(["image.png"], names("mtime:2020-06"))
+        self.assertEqual(["image.png"], names("mtime:<2021 type:"))
+        self.assertEqual([], names("mtime:>2020 image"))
+        with self.assertRaises(ValueError):
+            self.indexxo.find_files("size:big")
+
+    def test_find_files_after_refresh(self):
+        """
+        Search index follows changes in index
+        """
+        self.discover()
+        (self.space_path / "file.txt").rename(self.space_path / "renamed.txt")
+        self.discover()
+        self.assertEqual(([], None), self.indexxo.find_files("file.txt"))
+        names = [r.full_name for r in self.indexxo.find_files("renamed")[0]]
+        self.assertEqual(["renamed.txt"], names)
+
+    def test_find_files_narrowed(self):
+        """
+        Query that extends a recent query filters its matches, pages are the
+        same as from index
+        """
+        self.discover()
+        self.assertEqual(["folder1", "folder2", "subfolder"],
+                         [r.full_name for r in self.indexxo.find_files("fol")[0]])
+        with mock.patch.object(self.indexxo, "_search_query") as search_query:
+            names = []
+            next_page = None
+            while True:
+                page, next_page = self.indexxo.find_files(
+                    "FOLDER", order="desc", limit=1, after=next_page)
+                names.extend(r.full_name for r in page)
+                if next_page is None:
+                    break
+            self.assertEqual(["subfolder", "folder2", "folder1"], names)
+            self.assertEqual(([], None), self.indexxo.find_files("folder3"))
+        search_query.assert_not_called()
+
+        (self.space_path / "folder3").mkdir()
+        self.discover()
+        self.assertEqual(["folder1", "folder2", "folder3", "subfolder"],
+                         [r.full_name for r in self.indexxo.find_files("folder")[0]])
+
+    def test_find_files_too_many_matches(self):
+        """
+        Matches of a query are not kept if there are too many of them
+        """
+        self.discover()
+        with mock.patch("server.indexxocore.SEARCH_MATCHES", 1):
+            self.assertEqual(["folder1", "folder2", "subfolder"],
+                             [r.full_name for r in self.indexxo.find_files("fol")[0]])
+            self.assertTrue(self.indexxo.searches.too_many("fold", self.indexxo.generation))
+            self.assertEqual(["folder1", "folder2", "subfolder"],
+                             [r.full_name for r in self.indexxo.find_files("fold")[0]])
+        self.assertEqual(1, len(self.indexxo.searches))
+
+    def test_get_content_pages(self):
+        """
+        Folder content is sorted and split into pages
+        """
+        self.discover()
+        content, parent, next_page = self.indexxo.get_content(self.space_path, sort="size")
+        self.assertEqual(["folder2", "file.txt", "folder1"], [c.full_name for c in content])
+        self.assertIsNone(parent)
+        self.assertIsNone(next_page)
+
+        names = []
+        next_page = None
+        while True:
+            content, _, next_page = self.indexxo.get_content(
+                self.space_path, sort="size", order="desc", limit=2, after=next_page)
+            names.extend(c.full_name for c in content)
+            if next_page is None:
+                break
+        self.assertEqual(["folder1", "file.txt", "folder2"], names)
+
+    def test_read_during_write(self):
+        """
+        Reads are not blocked by uncommitted writes and don't see them
+        """
+        self.discover()
+        with db.atomic():
+            FileObjectBase.delete().execute()
+            content, _, _ = self.indexxo.get_content(self.space_path)
+            self.assertEqual(3, len(content))
+            self.assertEqual(1, len(self.indexxo.get_spaces()))
+
+    def test_get_content_invalid_page(self):
+        """
+        Unknown sort and broken cursors are rejected
+        """
+        self.discover()
+        with self.assertRaises(ValueError):
+            self.indexxo.get_content(self.space_path, sort="color")
+        with self.assertRaises(ValueError):
+            self.indexxo.get_content(self.space_path, after="not a cursor")
+        for cursor in ([{"a": 1}, 1], [None, 1], ["a", True], [True, 1], ["a", 1.5]):
+            with self.assertRaises(ValueError):
+                self.indexxo.get_content(self.space_path, after=_encode_cursor(*cursor))
+
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_watch_file_changes(self):
+        """
+        Watched changes of files are written without refresh, sizes of folders
+        above them are updated
+        """
+        self.indexxo.watcher = Watcher()
+        self.discover()
+        (self.space_path / "file.txt").unlink()
+        (self.space_path / "folder1" / "subfolder" / "video.mkv").write_bytes(b"1" * 35)
+        (self.space_path / "folder2" / "new.mp3").write_bytes(b"1" * 5)
+        self.apply_changes()
+
+        self.assertIsNone(self.get_row(self.space_path / "file.txt"))
+        self.assertEqual(35, self.get_row(self.space_path / "folder1" / "subfolder").size)
+        self.assertEqual(55, self.get_row(self.space_path / "folder1").size)
+        self.assertEqual("audio", self.get_row(self.space_path / "folder2" / "new.mp3").type)
+        self.assertEqual(5, self.get_row(self.space_path / "folder2").size)
+        self.assertEqual(60, self.get_row(self.space_path).size)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_watch_folder_changes(self):
+        """
+        Folders that were moved are crawled and watched, folders that were
+        removed are removed with their content
+        """
+        self.indexxo.watcher = Watcher()
+        self.discover()
+        moved = self.space_path / "folder2" / "moved"
+        (self.space_path / "folder1" / "subfolder").rename(moved)
+        shutil.rmtree(self.space_path / "folder1")
+        self.apply_changes()
+
+        self.assertIsNone(self.get_row(self.space_path / "folder1"))
+        self.assertIsNone(self.get_row(self.space_path / "folder1" / "image.png"))
+        self.assertEqual("folder", self.get_row(moved).type)
+        self.assertEqual(30, self.get_row(moved / "video.mkv").size)
+        self.assertEqual(40, self.get_row(self.space_path).size)
+
+        # Moved folder is watched too
+        (moved / "new.txt").write_bytes(b"1" * 5)
+        self.apply_changes()
+        self.assertEqual(35, self.get_row(moved).size)
+        self.assertEqual(45, self.get_row(self.space_path).size)
+        self.assertIsNone(self.indexxo.folders.find(str(self.space_path / "folder1")))
+        self.assertIsNotNone(self.indexxo.folders.find(str(moved)))
+        stats = self.indexxo.get_stats(self.space_path)
+        self.assertEqual(
+            {"document": 2, "video": 1},
+            {type: t["files"] for type, t in stats["types"].items()}
+        )
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_watch_moves(self):
+        """
+        Moved files and folders keep their ids, rollups and hashes, rows inside
+        of a moved folder get new paths without crawling
+        """
+        self.indexxo.watcher = Watcher()
+        (self.space_path / "folder2" / "copy.png").write_bytes(b"1" * 20)
+        self.discover()
+        self.indexxo._hash_duplicates()
+        folder = self.get_row(self.space_path / "folder1")
+        video = self.get_row(self.space_path / "folder1" / "subfolder" / "video.mkv")
+        file = self.get_row(self.space_path / "file.txt")
+        moved = self.space_path / "folder2" / "moved"
+        (self.space_path / "folder1").rename(moved)
+        (self.space_path / "file.txt").rename(self.space_path / "notes.md")
+        with mock.patch.object(self.indexxo, "_refresh") as refresh:
+            self.apply_changes()
+            refresh.assert_not_called()
+
+        self.assertIsNone(self.get_row(self.space_path / "folder1"))
+        self.assertEqual(folder.id, self.get_row(moved).id)
+        self.assertEqual(self.get_row(self.space_path / "folder2").id,
+                         self.get_row(moved).parent_id)
+        self.assertEqual(video.id, self.get_row(moved / "subfolder" / "video.mkv").id)
+        self.assertEqual(file.id, self.get_row(self.space_path / "notes.md").id)
+        self.assertEqual(".md", self.get_row(self.space_path / "notes.md").extension)
+        self.assertEqual(70, self.get_row(self.space_path / "folder2").size)
+        self.assertEqual(80, self.get_row(self.space_path).size)
+        self.assertEqual({"image", "video"}, set(self.indexxo.get_stats(moved)["types"]))
+        self.assertEqual(4, self.indexxo.get_stats(self.space_path)["files"])
+        self.assertEqual([str(moved / "subfolder")],
+                         [r.full_path for r in self.indexxo.find_files("subfolder")[0]])
+        self.assertEqual(
+            [[str(self.space_path / "folder2" / "copy.png"), str(moved / "image.png")]],
+            [[f["full_path"] for f in g["files"]]
+             for g in self.indexxo.get_duplicates(10)["groups"]]
+        )
+        self.assertEqual(folder.id, self.indexxo.folders.find(str(moved)))
+        self.assertIsNotNone(self.indexxo.folders.find(str(moved / "subfolder")))
+
+        # Moved folder is still watched
+        (moved / "subfolder" / "new.txt").write_bytes(b"1" * 5)
+        self.apply_changes()
+        self.assertEqual(85, self.get_row(self.space_path).size)
+
+    def test_stats(self):
+        """
+        Rollups count files inside of folders by type and follow refreshes
+        """
+        self.discover()
+        stats = self.indexxo.get_stats(self.space_path)
+        self.assertEqual(3, stats["files"])
+        self.assertEqual(60, stats["size"])
+        self.assertEqual({"files": 1, "size": 20}, {
+            k: stats["types"]["image"][k] for k in ("files", "size")})
+        folder_stats = self.indexxo.get_stats(self.space_path / "folder1")
+        self.assertEqual({"image", "video"}, set(folder_stats["types"]))
+        self.assertEqual(0, self.indexxo.get_stats(self.space_path / "folder2")["files"])
+        self.assertIsNone(self.indexxo.get_stats(self.space_path / "file.txt"))
+
+        (self.space_path / "folder1" / "image.png").unlink()
+        (self.space_path / "folder2" / "new.png").write_bytes(b"1" * 5)
+        self.discover()
+        stats = self.indexxo.get_stats(self.space_path)
+        self.assertEqual(45, stats["size"])
+        self.assertEqual(5, stats["types"]["image"]["size"])
+        self.assertEqual({"video"}, set(self.indexxo.get_stats(
+            self.space_path / "folder1")["types"]))
+        self.assertEqual(45, self.indexxo.get_stats()["size"])
+
+    def test_folder_tree(self):
+        """
+        Folders tree follows refreshes and is loaded from index on start
+        """
+        self.discover()
+        folders = self.indexxo.folders
+        self.assertEqual(4, len(folders))
+        subfolder = str(self.space_path / "folder1" / "subfolder")
+        self.assertEqual(
+            self.get_row(self.space_path / "folder1" / "subfolder").id,
+            folders.find(subfolder)
+        )
+
+        shutil.rmtree(self.space_path / "folder1")
+        (self.space_path / "folder3").mkdir()
+        self.discover()
+        self.assertIsNone(folders.find(str(self.space_path / "folder1")))
+        self.assertIsNotNone(folders.find(str(self.space_path / "folder3")))
+
+        self.indexxo = self.create_indexxo()
+        self.assertEqual(3, len(self.indexxo.folders))
+
+    def test_without_folder_tree(self):
+        """
+        Folders are looked up in index when tree is not used
+        """
+        self.indexxo.folders = None
+        self.discover()
+        self.assertIsNone(self.indexxo.get_stats(self.space_path / "file.txt"))
+        self.assertEqual(50, self.indexxo.get_stats(self.space_path / "folder1")["size"])
+
+    def test_find_largest(self):
+        """
+        Biggest files or folders in a subtree, scope itself is not included
+        """
+        self.discover()
+        self.assertEqual(
+            ["video.mkv", "image.png", "file.txt"],
+            [r.full_name for r in self.indexxo.find_largest(10)]
+        )
+        folder1 = self.space_path / "folder1"
+        self.assertEqual(
+            ["video.mkv", "image.png"],
+            [r.full_name for r in self.indexxo.find_largest(10, folder1)]
+        )
+        # Most files are in the subtree, it's read by size instead of path
+        self.assertEqual(
+            ["video.mkv"],
+            [r.full_name for r in self.indexxo.find_largest(1, folder1)]
+        )
+        self.assertEqual(
+            ["subfolder"],
+            [r.full_name for r in self.indexxo.find_largest(10, folder1, "folder")]
+        )
+        self.assertEqual(
+            ["image.png"],
+            [r.full_name for r in self.indexxo.find_largest(10, self.space_path, "image")]
+        )
+
+    def test_duplicates(self):
+        """
+        Files with the same content are grouped, files with the same size and
+        the same first and last blocks are not
+        """
+        big = b"1" * BLOCK + b"2" * BLOCK + b"3" * BLOCK
+        (self.space_path / "big1.bin").write_bytes(big)
+        (self.space_path / "folder2" / "big2.bin").write_bytes(big)
+        (self.space_path / "folder2" / "big3.bin").write_bytes(
+            b"1" * BLOCK + b"4" * BLOCK + b"3" * BLOCK)
+        (self.space_path / "folder2" / "big4.bin").write_bytes(
+            b"5" * BLOCK + b"2" * BLOCK + b"3" * BLOCK)
+        (self.space_path / "folder2" / "file.txt").write_bytes(b"1" * 10)
+        self.discover()
+        self.indexxo._hash_duplicates()
+
+        duplicates = self.indexxo.get_duplicates(10)
+        self.assertEqual(3 * BLOCK + 10, duplicates["reclaimable"])
+        self.assertEqual(
+            [[str(self.space_path / "big1.bin"), str(self.space_path / "folder2" / "big2.bin")],
+             [str(self.space_path / "file.txt"), str(self.space_path / "folder2" / "file.txt")]],
+            [[f["full_path"] for f in g["files"]] for g in duplicates["groups"]]
+        )
+        # Files with unique size are not hashed, unique partial hash is enough
+        self.assertIsNone(FileHash.get_or_none(
+            FileHash.id == self.get_row(self.space_path / "folder1" / "image.png").id))
+        self.assertIsNone(FileHash.get_by_id(
+            self.get_row(self.space_path / "folder2" / "big4.bin").id).full)
+        self.assertIsNotNone(FileHash.get_by_id(
+            self.get_row(self.space_path / "folder2" / "big3.bin").id).full)
+
+    def test_duplicates_changed(self):
+        """
+        Changed files are not duplicates until they are hashed again
+        """
+        (self.space_path / "folder2" / "file.txt").write_bytes(b"1" * 10)
+        self.discover()
+        self.indexxo._hash_duplicates()
+        # Replaced, so folder modification date changes
+        (self.space_path / "folder2" / "new.txt").write_bytes(b"2" * 10)
+        (self.space_path / "folder2" / "new.txt").replace(self.space_path / "folder2" / "file.txt")
+        self.discover()
+        self.assertEqual([], self.indexxo.get_duplicates(10)["groups"])
+
+        self.indexxo._hash_duplicates()
+        self.assertEqual(2, FileHash.select().count())
+        self.assertEqual(0, self.indexxo.get_duplicates(10)["reclaimable"])
+
+    def test_media(self):
+        """
+        Metadata of media files is read once while they don't change
+        """
+        self.indexxo.media_directory = self.temp_dir_path / "thumbnails"
+        sound = self.space_path / "folder2" / "sound.wav"
+        with wave.open(str(sound), "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(1)
+            file.setframerate(8000)
+            file.writeframes(b"\x00" * 16000)
+        self.discover()
+        self.indexxo._read_media()
+
+        self.assertEqual({"width": None, "height": None, "duration": 2.0, "thumbnail": None},
+                         self.indexxo.get_media(sound))
+        self.assertIsNone(self.indexxo.get_media(self.space_path / "file.txt"))
+        # Not a real image, examined anyway
+        image = self.space_path / "folder1" / "image.png"
+        self.assertIsNotNone(self.indexxo.get_media(image))
+        self.assertIsNone(self.indexxo.get_thumbnail(image))
+        with self.assertLogs(level="INFO") as logs:
+            self.indexxo._read_media()
+        self.assertIn("Read metadata of 0 media files", logs.output[-1])
+
+    def test_media_errors(self):
+        """
+        File that can't be examined or stops a worker process is written
+        without metadata and not examined again, other files are examined
+        """
+        self.indexxo.media_directory = self.temp_dir_path / "thumbnails"
+        sound = self.space_path / "folder2" / "sound.wav"
+        with wave.open(str(sound), "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(1)
+            file.setframerate(8000)
+            file.writeframes(b"\x00" * 16000)
+        (self.space_path / "folder2" / "crash.png").write_bytes(b"1")
+        (self.space_path / "folder2" / "error.png").write_bytes(b"1")
+        self.discover()
+        CrashingPool.started = 0
+        with (mock.patch("server.indexxocore._process_pool", CrashingPool),
+              self.assertLogs(level="WARNING")):
+            self.indexxo._read_media()
+        # Pool is replaced after it breaks and after the file that broke it
+        self.assertEqual(3, CrashingPool.started)
+        self.assertEqual(2.0, self.indexxo.get_media(sound)["duration"])
+        empty = {"width": None, "height": None, "duration": None, "thumbnail": None}
+        self.assertEqual(empty, self.indexxo.get_media(self.space_path / "folder2" / "crash.png"))
+        self.assertEqual(empty, self.indexxo.get_media(self.space_path / "folder2" / "error.png"))
+
+        with (mock.patch("server.indexxocore._process_pool", CrashingPool),
+              self.assertLogs(level="INFO") as logs):
+            self.indexxo._read_media()
+        self.assertIn("Read metadata of 0 media files", logs.output[-1])
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_media_thumbnails(self):
+        """
+        Thumbnails of changed images are replaced
+        """
+        self.indexxo.media_directory = self.temp_dir_path / "thumbnails"
+        image = self.space_path / "folder1" / "image.png"
+        Image.new("RGB", (640, 480), "red").save(image)
+        self.discover()
+        self.indexxo._read_media()
+        media = self.indexxo.get_media(image)
+        self.assertEqual((640, 480), (media["width"], media["height"]))
+        old, key = self.indexxo.get_thumbnail(image)
+        self.assertTrue(old.is_file())
+
+        # Replaced, so folder is listed again
+        image.unlink()
+        Image.new("RGB", (100, 200), "blue").save(image)
+        self.discover()
+        self.indexxo._read_media()
+        self.assertFalse(old.exists())
+        new, new_key = self.indexxo.get_thumbnail(image)
+        self.assertNotEqual(key, new_key)
+        self.assertTrue(new.is_file())
+        self.assertEqual(200, self.indexxo.get_media(image)["height"])
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_watch_stats(self):
+        """
+        Watched changes update rollups of every folder above them
+        """
+        self.indexxo.watcher = Watcher()
+        self.discover()
+        shutil.rmtree(self.space_path / "folder1" / "subfolder")
+        (self.space_path / "folder2" / "new.png").write_bytes(b"1" * 5)
+        (self.space_path / "file.txt").write_bytes(b"1" * 15)
+        self.apply_changes()
+
+        stats = self.indexxo.get_stats(self.space_path)
+        self.assertEqual(
+            {"document": (1, 15), "image": (2, 25)},
+            {type: (t["files"], t["size"]) for type, t in stats["types"].items()}
+        )
+        self.assertEqual(40, stats["size"])
+        self.assertEqual({"image"}, set(self.indexxo.get_stats(
+            self.space_path / "folder1")["types"]))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_watch_limit(self):
+        """
+        Space is not watched when watch limit is reached, refresh still works
+        """
+        self.indexxo.watcher = Watcher()
+        with mock.patch.object(Watcher, "watch", side_effect=WatchLimitError()):
+            self.discover()
+        self.assertEqual(0, self.indexxo.watcher.watched())
+        self.assertEqual(60, self.get_row(self.space_path).size)
+
+
+if __name__ == '__main__':
+    unittest.main(
+        failfast=False,
+        catchbreak=False
+    )
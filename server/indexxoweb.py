@@ -1,74 +1,432 @@
-import logging
-from pathlib import Path
-
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-
-from server.indexxocore import Indexxo
-
-
-class IndexxoServer:
-    """TODO"""
-
-    def __init__(self, indexxo: Indexxo):
-        """TODO"""
-        self.app = Flask(__name__)
-        CORS(self.app)
-        self.indexxo = indexxo
-        # Frontend
-        self.app.add_url_rule("/", "web", self.indexxo_web)
-        # Anything will lead back to index.html (for Vue Router)
-        self.app.add_url_rule("/<anything>", "web", self.indexxo_web)
-        self.app.add_url_rule("/assets/<file>", "file", self.serve_file)
-
-        # Backend
-        self.app.add_url_rule("/api/folder", "folder", self.get_folder_info)
-        self.app.add_url_rule("/api/search", "search", self.search_files)
-
-    def run_server(self):
-        """TODO"""
-        self.app.run(host="localhost", debug=False)
-
-    def indexxo_web(self):
-        return send_from_directory('../client/dist', 'index.html')
-    
-    def serve_file(self, file):
-        return send_from_directory('../client/dist/assets', file)
-
-    def get_folder_info(self):
-        """
-        See: indexxo.get_spaces if no path is provided.
-        See: indexxo.get_content if path is provided.
-        """
-        path = request.args.get("path")
-        if path is None or path == "":
-            return jsonify({
-                "content": [s.to_json() for s in self.indexxo.get_spaces()]
-            })
-
-        try:
-            content, parent = self.indexxo.get_content(Path(path))
-
-            return jsonify({
-                "content": [c.to_json() for c in content],
-                "parent": parent.to_json() if parent else None
-            })
-        except Exception as e:
-            logging.error(e)
-            return jsonify({
-                "error": f"{path} is not found in index"
-            }), 404
-
-    def search_files(self):
-        """
-        See: indexxo.find_files
-        """
-        query = request.args.get("query")
-        if (query is None) or (query == ""):
-            return jsonify({
-                "error": "Please provide query argument"
-            }), 400
-        result = self.indexxo.find_files(query)
-        return jsonify({
-            "result": [r.to_json() for r in result]
-        })
+import json
+import logging
+import mimetypes
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator
+
+from flask import (Flask, Response, request, jsonify, send_file, send_from_directory,
+                   stream_with_context)
+from flask_cors import CORS
+from peewee import chunked
+from werkzeug.datastructures import ContentRange
+
+from server.download import BLOCK, open_file, read_range, set_attachment, stream_zip
+from server.indexxocore import (READ_CONNECTIONS, FileObjectBase, Indexxo, Page, read_db,
+                                row_json)
+from server.responsecache import ResponseCache
+
+MAX_PAGE_SIZE = 500_000
+"""
+Biggest allowed limit. Pages are streamed from database, so big pages don't
+take more memory than small ones.
+"""
+LARGEST_LIMIT = 100
+"""Amount of rows in /api/largest if limit is not provided"""
+STREAM_ROWS = 500
+"""Amount of rows that are sent in one chunk of streamed response"""
+CACHE_BYTES = 64 * 1024 * 1024
+"""Total size of cached responses, see ResponseCache"""
+CACHE_ENTRY_BYTES = 4 * 1024 * 1024
+"""Biggest response that is cached"""
+THUMBNAIL_MAX_AGE = 24 * 3600
+"""
+Seconds browser keeps a thumbnail without asking again. After that it asks
+with ETag (key of the image version) and gets 304 if image didn't change.
+"""
+HOST = "localhost"
+PORT = 5000
+CORS_ORIGINS = ["http://localhost:5173", "http://127.0.0.1:5173"]
+"""
+Origins of frontend development server that can read index listings. Frontend
+served by this server is the same origin and doesn't need them.
+"""
+CORS_PATHS = r"/api/(folder|search|stats|largest|duplicates|status)$"
+"""
+Endpoints that are shared with CORS_ORIGINS. File contents and metadata
+(download, thumbnail, media) are never shared with other origins.
+"""
+
+
+def download_etag(size: int, mtime: float) -> str:
+    """ETag of a file version, same for index and disk when file didn't change"""
+    return f"{size:x}-{round(mtime * 1e6):x}"
+
+
+class IndexxoServer:
+    """TODO"""
+
+    def __init__(self, indexxo: Indexxo):
+        """TODO"""
+        self.app = Flask(__name__)
+        CORS(self.app, resources={CORS_PATHS: {"origins": CORS_ORIGINS}})
+        self.indexxo = indexxo
+        self.cache = ResponseCache(CACHE_BYTES, CACHE_ENTRY_BYTES)
+        # Every request reads index with its own read-only connection
+        self.app.before_request(self.connect_reader)
+        self.app.teardown_request(self.close_reader)
+        # Frontend
+        self.app.add_url_rule("/", "web", self.indexxo_web)
+        # Anything will lead back to index.html (for Vue Router)
+        self.app.add_url_rule("/<anything>", "web", self.indexxo_web)
+        self.app.add_url_rule("/assets/<file>", "file", self.serve_file)
+
+        # Backend
+        self.app.add_url_rule("/api/folder", "folder", self.cached(self.get_folder_info))
+        self.app.add_url_rule("/api/search", "search", self.cached(self.search_files))
+        self.app.add_url_rule("/api/stats", "stats", self.get_stats)
+        self.app.add_url_rule("/api/largest", "largest", self.find_largest)
+        self.app.add_url_rule("/api/duplicates", "duplicates", self.get_duplicates)
+        self.app.add_url_rule("/api/media", "media", self.get_media)
+        self.app.add_url_rule("/api/thumbnail", "thumbnail", self.get_thumbnail)
+        self.app.add_url_rule("/api/download", "download", self.download)
+        self.app.add_url_rule("/api/status", "status", self.get_status)
+        # Prometheus scrapes this path by default
+        self.app.add_url_rule("/metrics", "metrics", self.get_metrics)
+
+    def run_server(self, server: str = "waitress", threads: int = READ_CONNECTIONS):
+        """
+        Serve WEB API and frontend.
+
+        Args:
+            server (str): "waitress" (production) or "development" (Flask
+            development server).
+            threads (int): Amount of requests that are handled at the same time
+            by production server.
+        """
+        if server == "waitress":
+            try:
+                from waitress import serve
+            except ImportError:
+                logging.warning("waitress is not installed, using development server")
+            else:
+                logging.info(f"Serving on http://{HOST}:{PORT} with {threads} threads")
+                serve(self.app, host=HOST, port=PORT, threads=threads)
+                return
+        self.app.run(host=HOST, port=PORT, debug=False, threaded=True)
+
+    def connect_reader(self):
+        read_db.connect(reuse_if_open=True)
+
+    def close_reader(self, exception):
+        # Returns connection to the pool
+        if not read_db.is_closed():
+            read_db.close()
+
+    def cached(self, view: Callable) -> Callable[[], Response]:
+        """
+        Wrap view, so its responses are served from cache while index doesn't
+        change (see Indexxo.generation). Responses have ETag of the generation,
+        requests with the same ETag in If-None-Match get 304 without reading
+        index at all. Only successful responses are cached.
+
+        Args:
+            view (Callable): View function that depends on request arguments
+            and index only.
+
+        Returns:
+            Callable[[], Response]: Wrapped view function.
+        """
+        def cached_view() -> Response:
+            # Read before index, response can't be older than its generation
+            generation = self.indexxo.generation
+            etag = self.cache.etag(generation)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                body = self.cache.get(key, generation)
+                if body is not None:
+                    response = Response(body, mimetype="application/json")
+                else:
+                    response = self.app.make_response(view())
+                    if response.status_code != 200:
+                        return response
+                    # Streamed body is cached after it's sent
+                    response.response = self.cache.put_while_sending(
+                        key, generation, response.response)
+            response.set_etag(etag)
+            # Browser asks every time, unchanged responses are not sent again
+            response.cache_control.no_cache = True
+            return response
+        return cached_view
+
+    def indexxo_web(self):
+        return send_from_directory('../client/dist', 'index.html')
+    
+    def serve_file(self, file):
+        return send_from_directory('../client/dist/assets', file)
+
+    def page_args(self) -> dict:
+        """
+        Get pagination arguments from request: sort, order, limit and after.
+        Every row is returned in one streamed response if limit is not
+        provided, same as before pagination. See: indexxocore.paginate
+        """
+        limit = request.args.get("limit", type=int)
+        return {
+            "sort": request.args.get("sort", "name"),
+            "order": request.args.get("order", "asc"),
+            "limit": min(max(limit, 1), MAX_PAGE_SIZE) if limit is not None else None,
+            "after": request.args.get("after") or None
+        }
+
+    def get_folder_info(self):
+        """
+        See: indexxo.get_spaces if no path is provided.
+        See: indexxo.get_content if path is provided. Content is paginated, use
+        "next" from response as "after" argument to get the next page.
+        """
+        path = request.args.get("path")
+        if path is None or path == "":
+            return jsonify({
+                "content": [s.to_json() for s in self.indexxo.get_spaces()]
+            })
+
+        try:
+            content, parent = self.indexxo.stream_content(Path(path), **self.page_args())
+            return self.stream_page("content", content, {
+                "parent": parent.to_json() if parent else None
+            })
+        except ValueError as e:
+            return jsonify({
+                "error": str(e)
+            }), 400
+        except Exception as e:
+            logging.error(e)
+            return jsonify({
+                "error": f"{path} is not found in index"
+            }), 404
+
+    def search_files(self):
+        """
+        See: indexxo.find_files. Result is paginated, use "next" from response
+        as "after" argument to get the next page. Query without terms and
+        filters (like "type:") is rejected, it would list the whole index.
+        """
+        query = request.args.get("query")
+        if (query is None) or (query == ""):
+            return jsonify({
+                "error": "Please provide query argument"
+            }), 400
+        try:
+            result = self.indexxo.stream_files(query, **self.page_args())
+        except ValueError as e:
+            return jsonify({
+                "error": str(e)
+            }), 400
+        return self.stream_page("result", result)
+
+    def get_stats(self):
+        """
+        See: indexxo.get_stats. Rollup of every space if no path is provided.
+        """
+        path = request.args.get("path")
+        stats = self.indexxo.get_stats(Path(path) if path else None)
+        if stats is None:
+            return jsonify({
+                "error": f"{path} is not found in index"
+            }), 404
+        return jsonify(stats)
+
+    def find_largest(self):
+        """
+        See: indexxo.find_largest. Optional arguments: path to search in a folder,
+        type to search files of a type (or folders) and limit.
+        """
+        path = request.args.get("path")
+        limit = request.args.get("limit", LARGEST_LIMIT, type=int)
+        result = self.indexxo.find_largest(
+            limit=min(max(limit, 1), MAX_PAGE_SIZE),
+            path=Path(path) if path else None,
+            type=request.args.get("type") or None
+        )
+        return jsonify({
+            "result": [r.to_json() for r in result]
+        })
+
+    def get_duplicates(self):
+        """
+        See: indexxo.get_duplicates. Optional argument limit is amount of groups.
+        """
+        limit = request.args.get("limit", LARGEST_LIMIT, type=int)
+        return jsonify(self.indexxo.get_duplicates(min(max(limit, 1), MAX_PAGE_SIZE)))
+
+    def get_media(self):
+        """
+        See: indexxo.get_media. Dimensions and duration of a media file.
+        """
+        path = request.args.get("path")
+        media = self.indexxo.get_media(Path(path)) if path else None
+        if media is None:
+            return jsonify({
+                "error": f"{path} has no metadata"
+            }), 404
+        return jsonify(media)
+
+    def get_thumbnail(self):
+        """
+        See: indexxo.get_thumbnail. JPEG thumbnail of an image from cache.
+        Thumbnail is sent with the kernel sendfile if server supports it,
+        ETag is the key of the image version, so repeated requests get 304.
+        """
+        path = request.args.get("path")
+        thumbnail = self.indexxo.get_thumbnail(Path(path)) if path else None
+        if thumbnail is None or not thumbnail[0].is_file():
+            return jsonify({
+                "error": f"{path} has no thumbnail"
+            }), 404
+        file, key = thumbnail
+        return send_file(file, mimetype="image/jpeg", etag=key, conditional=True,
+                         max_age=THUMBNAIL_MAX_AGE)
+
+    def download(self):
+        """
+        See: indexxo.get_download. Send an indexed file or zip of an indexed
+        folder. Files support Range requests (resuming and seeking).
+        download_file opens the file and builds ETag and Last-Modified from
+        its fstat, so a file that changed since the last refresh never gets
+        304 or a stale ETag.
+        """
+        path = request.args.get("path")
+        row = self.indexxo.get_download(Path(path)) if path else None
+        if row is None:
+            return jsonify({
+                "error": f"{path} is not found in index"
+            }), 404
+        if row.type in ("space", "folder"):
+            return self.download_folder(row)
+        return self.download_file(row)
+
+    def download_file(self, row: FileObjectBase) -> Response:
+        """
+        Send a file or a single range of it. File is not read into memory, it's
+        sent with wsgi.file_wrapper if server has it (gunicorn and uWSGI use
+        the kernel sendfile) or in blocks of BLOCK bytes.
+
+        Args:
+            row (FileObjectBase): Indexed file.
+
+        Returns:
+            Response: 200, 206, 304 or 416 response.
+        """
+        try:
+            file, file_stat = open_file(row.full_path)
+        except OSError:
+            return jsonify({
+                "error": f"{row.full_path} can't be read"
+            }), 404
+        # File could change since the last refresh, headers and 304 describe
+        # the file on disk
+        size = file_stat.st_size
+        etag = download_etag(size, file_stat.st_mtime)
+        if self.not_modified(etag, file_stat.st_mtime):
+            file.close()
+            return Response(status=304)
+        start, end, status = 0, size, 200
+        if (request.range is not None and len(request.range.ranges) == 1
+                and self.range_applies(etag, file_stat.st_mtime)):
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                file.close()
+                response = Response(status=416)
+                response.content_range = ContentRange("bytes", None, None, size)
+                return response
+            start, end = byte_range
+            status = 206
+        file.seek(start)
+        file_wrapper = request.environ.get("wsgi.file_wrapper")
+        if file_wrapper is not None:
+            # Server stops after Content-Length bytes
+            body = file_wrapper(file, BLOCK)
+        else:
+            body = read_range(file, end - start)
+        mimetype = mimetypes.guess_type(row.full_name)[0] or "application/octet-stream"
+        response = Response(body, status, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = end - start
+        if status == 206:
+            response.content_range = ContentRange("bytes", start, end, size)
+        response.accept_ranges = "bytes"
+        response.set_etag(etag)
+        response.last_modified = int(file_stat.st_mtime)
+        response.cache_control.no_cache = True
+        set_attachment(response.headers, row.full_name)
+        return response
+
+    def download_folder(self, row: FileObjectBase) -> Response:
+        """
+        Stream zip of a folder with everything that is indexed inside of it.
+        Zip is built while it's sent, so its size is not known beforehand and
+        it can't be resumed.
+
+        Args:
+            row (FileObjectBase): Indexed folder or space.
+
+        Returns:
+            Response: Chunked zip response.
+        """
+        name = row.full_name or os.path.basename(row.full_path.rstrip(os.sep)) or "download"
+        rows = self.indexxo.walk_download(Path(row.full_path))
+        # Request (and its read connection) lives until response is sent
+        response = Response(stream_with_context(stream_zip(row.full_path, name, rows)),
+                            mimetype="application/zip")
+        response.cache_control.no_store = True
+        set_attachment(response.headers, f"{name}.zip")
+        return response
+
+    def not_modified(self, etag: str, mtime: float) -> bool:
+        """Check If-None-Match and If-Modified-Since of request"""
+        if request.if_none_match:
+            return request.if_none_match.contains(etag)
+        if request.if_modified_since is not None:
+            return int(mtime) <= request.if_modified_since.timestamp()
+        return False
+
+    def range_applies(self, etag: str, mtime: float) -> bool:
+        """Range is ignored if If-Range doesn't match the file, whole file is sent"""
+        if_range = request.if_range
+        if if_range.etag is not None:
+            return if_range.etag == etag
+        if if_range.date is not None:
+            return if_range.date == datetime.fromtimestamp(int(mtime), timezone.utc)
+        return True
+
+    def get_status(self):
+        """
+        See: indexxo.get_status. Progress of the current refresh, queues and
+        timings of indexing.
+        """
+        return jsonify(self.indexxo.get_status())
+
+    def get_metrics(self):
+        """
+        Same as /api/status in Prometheus text format.
+        """
+        return Response(self.indexxo.metrics.to_prometheus(),
+                        mimetype="text/plain; version=0.0.4")
+
+    def stream_page(self, key: str, page: Page, fields: dict | None = None) -> Response:
+        """
+        Stream JSON object with page rows in key, other fields and cursor of
+        the next page in "next". Rows are sent while they are read from database.
+
+        Args:
+            key (str): Key of rows list.
+            page (Page): Page with dict rows.
+            fields (dict | None): Other fields of object.
+
+        Returns:
+            Response: Chunked JSON response.
+        """
+        def generate() -> Iterator[str]:
+            yield "{" + json.dumps(key) + ": ["
+            separator = ""
+            for rows in chunked(page, STREAM_ROWS):
+                yield separator + ", ".join(json.dumps(row_json(row)) for row in rows)
+                separator = ", "
+            # Cursor is known after reading the page
+            yield "], " + json.dumps(dict(fields or {}, next=page.next))[1:]
+
+        # Request (and its read connection) lives until response is sent
+        return Response(stream_with_context(generate()), mimetype="application/json")
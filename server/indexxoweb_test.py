@@ -0,0 +1,370 @@
+import io
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+import zipfile
+from unittest import mock
+from server.indexxocore import Indexxo, db
+from server.indexxoweb import IndexxoServer
+from server.filetypes import filetypes
+from server.media import Image
+
+
+class IndexxoServerTest(unittest.TestCase):
+    temp_dir: tempfile.TemporaryDirectory
+    temp_dir_path: pathlib.Path
+    space_path: pathlib.Path
+
+    def setUp(self):
+        """
+        Creates temporary directory with an indexed space in it and a test
+        client for the WEB API.
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = pathlib.Path(self.temp_dir.name)
+        self.space_path = self.temp_dir_path / "space"
+        self.space_path.mkdir()
+        for i in range(5):
+            (self.space_path / f"file{i}.txt").write_bytes(b"1" * i)
+
+        self.indexxo = Indexxo(
+            filetypes=filetypes,
+            space_paths=[self.space_path],
+            ignore_paths=[],
+            refresh_interval=3600,
+            crawler_workers=4,
+            database_path=self.temp_dir_path / "database.sqlite"
+        )
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+        self.client = IndexxoServer(self.indexxo).app.test_client()
+
+    def tearDown(self):
+        """
+        Deletes temporary directory with database
+        """
+        db.close()
+        self.temp_dir.cleanup()
+
+    def test_folder_spaces(self):
+        """
+        Spaces are listed when no path is provided
+        """
+        response = self.client.get("/api/folder")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            [str(self.space_path)],
+            [c["full_path"] for c in response.json["content"]]
+        )
+
+    def test_folder_pages(self):
+        """
+        Folder content can be read page by page
+        """
+        response = self.client.get("/api/folder", query_string={
+            "path": str(self.space_path), "sort": "size", "order": "desc", "limit": 3
+        })
+        self.assertEqual(
+            ["file4.txt", "file3.txt", "file2.txt"],
+            [c["full_name"] for c in response.json["content"]]
+        )
+        response = self.client.get("/api/folder", query_string={
+            "path": str(self.space_path), "sort": "size", "order": "desc", "limit": 3,
+            "after": response.json["next"]
+        })
+        self.assertEqual(
+            ["file1.txt", "file0.txt"],
+            [c["full_name"] for c in response.json["content"]]
+        )
+        self.assertIsNone(response.json["next"])
+
+    def test_folder_without_limit(self):
+        """
+        Every row is returned when limit is not provided
+        """
+        for i in range(5, 1000):
+            (self.space_path / f"file{i}.txt").touch()
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+        for url, query, key in (("/api/folder", {"path": str(self.space_path)}, "content"),
+                                ("/api/search", {"query": "file"}, "result")):
+            response = self.client.get(url, query_string=query)
+            self.assertEqual(1000, len(response.json[key]))
+            self.assertIsNone(response.json["next"])
+
+    def test_folder_streamed(self):
+        """
+        Content is streamed in chunks and is still one JSON object
+        """
+        with mock.patch("server.indexxoweb.STREAM_ROWS", 2):
+            response = self.client.get("/api/folder", query_string={
+                "path": str(self.space_path), "limit": 4
+            })
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(
+                ["file0.txt", "file1.txt", "file2.txt", "file3.txt"],
+                [c["full_name"] for c in response.json["content"]]
+            )
+        self.assertIsNone(response.json["parent"])
+        self.assertIsNotNone(response.json["next"])
+        self.assertEqual(str(self.space_path), response.json["content"][0]["parent"])
+
+    def test_folder_invalid_sort(self):
+        """
+        Unknown sort is a bad request
+        """
+        response = self.client.get("/api/folder", query_string={
+            "path": str(self.space_path), "sort": "color"
+        })
+        self.assertEqual(400, response.status_code)
+
+    def test_folder_cached(self):
+        """
+        Same request is served from cache until index changes, browser gets 304
+        for unchanged content
+        """
+        query = {"path": str(self.space_path)}
+        response = self.client.get("/api/folder", query_string=query)
+        etag = response.headers["ETag"]
+        self.assertEqual(5, len(response.json["content"]))
+
+        with mock.patch.object(self.indexxo, "stream_content") as stream_content:
+            response = self.client.get("/api/folder", query_string=query)
+            self.assertEqual(5, len(response.json["content"]))
+            response = self.client.get("/api/folder", query_string=query,
+                                       headers={"If-None-Match": etag})
+            self.assertEqual(304, response.status_code)
+        stream_content.assert_not_called()
+
+        (self.space_path / "file5.txt").write_bytes(b"")
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+        response = self.client.get("/api/folder", query_string=query,
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["ETag"])
+        self.assertEqual(6, len(response.json["content"]))
+
+    def test_search(self):
+        """
+        Search returns matches and requires query
+        """
+        response = self.client.get("/api/search", query_string={"query": "file", "limit": 2})
+        self.assertEqual(["file0.txt", "file1.txt"], [r["full_name"] for r in response.json["result"]])
+        self.assertIsNotNone(response.json["next"])
+
+        response = self.client.get("/api/search")
+        self.assertEqual(400, response.status_code)
+        for query in (" ", "type:"):
+            response = self.client.get("/api/search", query_string={"query": query})
+            self.assertEqual(400, response.status_code)
+        response = self.client.get("/api/search",
+                                   query_string={"query": "size:>99999999999999999999T"})
+        self.assertEqual(400, response.status_code)
+
+    def test_stats(self):
+        """
+        Stats of a folder and of every space, unknown folder is not found
+        """
+        response = self.client.get("/api/stats", query_string={"path": str(self.space_path)})
+        self.assertEqual(5, response.json["files"])
+        self.assertEqual(10, response.json["types"]["document"]["size"])
+        self.assertEqual(10, self.client.get("/api/stats").json["size"])
+
+        response = self.client.get("/api/stats", query_string={"path": "/not/indexed"})
+        self.assertEqual(404, response.status_code)
+
+    def test_largest(self):
+        """
+        Biggest files first, limited and filtered by type
+        """
+        response = self.client.get("/api/largest", query_string={"limit": 2})
+        self.assertEqual(["file4.txt", "file3.txt"], [r["full_name"] for r in response.json["result"]])
+        response = self.client.get("/api/largest", query_string={"type": "image"})
+        self.assertEqual([], response.json["result"])
+
+    def test_duplicates(self):
+        """
+        Duplicates are empty until files are hashed
+        """
+        response = self.client.get("/api/duplicates")
+        self.assertEqual({"groups": [], "reclaimable": 0}, response.json)
+        (self.space_path / "copy.txt").write_bytes(b"1" * 4)
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+        self.indexxo._hash_duplicates()
+
+        response = self.client.get("/api/duplicates", query_string={"limit": 1})
+        self.assertEqual(4, response.json["reclaimable"])
+        self.assertEqual(
+            ["copy.txt", "file4.txt"],
+            [f["full_name"] for f in response.json["groups"][0]["files"]]
+        )
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_thumbnail(self):
+        """
+        Thumbnails are served from cache after media files are examined,
+        unchanged thumbnails are not sent again
+        """
+        image = self.space_path / "image.png"
+        Image.new("RGB", (64, 32), "red").save(image)
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+        response = self.client.get("/api/thumbnail", query_string={"path": str(image)})
+        self.assertEqual(404, response.status_code)
+
+        self.indexxo.media_directory = self.temp_dir_path / "thumbnails"
+        self.indexxo._read_media()
+        response = self.client.get("/api/media", query_string={"path": str(image)})
+        self.assertEqual((64, 32), (response.json["width"], response.json["height"]))
+        response = self.client.get("/api/thumbnail", query_string={"path": str(image)})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("image/jpeg", response.content_type)
+        self.assertTrue(response.cache_control.max_age > 0)
+        etag = response.headers["ETag"]
+        response.close()
+
+        response = self.client.get("/api/thumbnail", query_string={"path": str(image)},
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        response = self.client.get("/api/media", query_string={
+            "path": str(self.space_path / "file1.txt")})
+        self.assertEqual(404, response.status_code)
+
+    def test_download(self):
+        """
+        File is sent as attachment, unchanged file is not sent again and only
+        indexed paths can be downloaded
+        """
+        path = self.space_path / "file4.txt"
+        response = self.client.get("/api/download", query_string={"path": str(path)})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b"1111", response.data)
+        self.assertEqual("bytes", response.headers["Accept-Ranges"])
+        self.assertIn("filename=file4.txt", response.headers["Content-Disposition"])
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get("/api/download", query_string={"path": str(path)},
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        response = self.client.get("/api/download", query_string={"path": str(path)},
+                                   headers={"If-Modified-Since": last_modified})
+        self.assertEqual(304, response.status_code)
+
+        # Edited after it was indexed
+        path.write_bytes(b"22222")
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        for headers in ({"If-None-Match": etag}, {"If-Modified-Since": last_modified}):
+            response = self.client.get("/api/download", query_string={"path": str(path)},
+                                       headers=headers)
+            self.assertEqual((200, b"22222"), (response.status_code, response.data))
+
+        outside = self.temp_dir_path / "outside.txt"
+        outside.write_bytes(b"secret")
+        for path in (outside, self.space_path / ".." / "outside.txt",
+                     self.space_path / "missing.txt"):
+            response = self.client.get("/api/download", query_string={"path": str(path)})
+            self.assertEqual(404, response.status_code, path)
+
+    def test_cors(self):
+        """
+        Listings are shared with frontend development server only, files are
+        not shared with other origins
+        """
+        frontend = {"Origin": "http://localhost:5173"}
+        other = {"Origin": "http://example.com"}
+        query = {"path": str(self.space_path)}
+        response = self.client.get("/api/stats", query_string=query, headers=frontend)
+        self.assertEqual("http://localhost:5173",
+                         response.headers["Access-Control-Allow-Origin"])
+        response = self.client.get("/api/stats", query_string=query, headers=other)
+        self.assertNotIn("Access-Control-Allow-Origin", response.headers)
+        for url in ("/api/download", "/api/thumbnail", "/api/media"):
+            response = self.client.get(url, query_string={
+                "path": str(self.space_path / "file4.txt")}, headers=frontend)
+            self.assertNotIn("Access-Control-Allow-Origin", response.headers, url)
+
+    def test_download_range(self):
+        """
+        Single range is sent with 206, unsatisfiable range gets 416 and
+        If-Range that doesn't match the file sends the whole file
+        """
+        path = self.space_path / "file4.txt"
+        path.write_bytes(b"0123")
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+        query = {"path": str(path)}
+        response = self.client.get("/api/download", query_string=query,
+                                   headers={"Range": "bytes=1-2"})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b"12", response.data)
+        self.assertEqual("bytes 1-2/4", response.headers["Content-Range"])
+        etag = response.headers["ETag"]
+
+        response = self.client.get("/api/download", query_string=query,
+                                   headers={"Range": "bytes=-3", "If-Range": etag})
+        self.assertEqual((206, b"123"), (response.status_code, response.data))
+        response = self.client.get("/api/download", query_string=query,
+                                   headers={"Range": "bytes=10-"})
+        self.assertEqual(416, response.status_code)
+        self.assertEqual("bytes */4", response.headers["Content-Range"])
+        response = self.client.get("/api/download", query_string=query,
+                                   headers={"Range": "bytes=1-2", "If-Range": '"old"'})
+        self.assertEqual((200, b"0123"), (response.status_code, response.data))
+
+    def test_download_folder(self):
+        """
+        Folder is streamed as zip with its subfolders, read from index in
+        batches
+        """
+        (self.space_path / "folder" / "empty").mkdir(parents=True)
+        (self.space_path / "folder" / "nested.txt").write_bytes(b"nested")
+        self.indexxo.loop.run_until_complete(self.indexxo._discover(self.space_path))
+        with mock.patch("server.indexxocore.DOWNLOAD_BATCH", 2):
+            response = self.client.get("/api/download",
+                                       query_string={"path": str(self.space_path)})
+            # Zip is built while it's read
+            data = response.data
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/zip", response.content_type)
+        self.assertIn("filename=space.zip", response.headers["Content-Disposition"])
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(
+                sorted(["space/folder/", "space/folder/empty/", "space/folder/nested.txt"]
+                       + [f"space/file{i}.txt" for i in range(5)]),
+                sorted(archive.namelist())
+            )
+            self.assertEqual(b"nested", archive.read("space/folder/nested.txt"))
+            self.assertEqual(b"111", archive.read("space/file3.txt"))
+
+    def test_status(self):
+        """
+        Status has totals of the refresh that indexed the space
+        """
+        response = self.client.get("/api/status")
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json["refresh"])
+        self.assertEqual(1, response.json["folders"])
+        self.assertEqual(5, response.json["files"])
+        # Rollups are written too
+        self.assertLess(6, response.json["rows_written"])
+        self.assertEqual(1, response.json["listing_seconds"]["count"])
+
+    def test_metrics(self):
+        """
+        Metrics are in Prometheus text format
+        """
+        response = self.client.get("/metrics")
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        lines = response.text.splitlines()
+        self.assertIn("# TYPE indexxo_files_total counter", lines)
+        self.assertIn("indexxo_files_total 5", lines)
+        self.assertIn('indexxo_listing_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn("indexxo_refreshes_total 1", lines)
+
+
+if __name__ == '__main__':
+    unittest.main(
+        failfast=False,
+        catchbreak=False
+    )
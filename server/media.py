@@ -0,0 +1,340 @@
+"""
+Metadata and thumbnails of images, videos and audio. Dimensions and
+durations are read from file headers without decoding anything. Thumbnails
+of images need Pillow, they are not made if it's not installed.
+"""
+import hashlib
+import os
+import struct
+from typing import BinaryIO
+
+from server.download import open_file
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+MEDIA_TYPES = ("image", "video", "audio")
+"""File types that are examined, see filetypes"""
+
+HEADER_BYTES = 64 * 1024
+"""Bytes read from the start of a file to find its dimensions or duration"""
+
+THUMBNAIL_SIZE = 256
+"""Thumbnails fit into a square of this many pixels"""
+
+THUMBNAIL_QUALITY = 80
+"""JPEG quality of thumbnails"""
+
+MAX_THUMBNAIL_PIXELS = 100_000_000
+"""Bigger images get no thumbnail, decoding them takes too much memory"""
+
+
+def media_key(id: int, size: int, mtime: float) -> str:
+    """
+    Key of one version of a file in the cache of thumbnails. Key changes when
+    file is modified, so stale thumbnails are never served. Key is kept when
+    file is moved, its row keeps its id.
+
+    Args:
+        id (int): File id in index.
+        size (int): File size.
+        mtime (float): File last modified date.
+
+    Returns:
+        str: Hex digest of id, size and mtime.
+    """
+    version = f"{id}\0{size}\0{mtime!r}".encode()
+    return hashlib.blake2b(version, digest_size=16).hexdigest()
+
+
+def thumbnail_path(directory: str, key: str) -> str:
+    """Full path of thumbnail in cache directory, files are spread over 256 folders"""
+    return os.path.join(directory, key[:2], f"{key}.jpg")
+
+
+def image_size(header: bytes) -> tuple[int, int] | None:
+    """
+    Get dimensions of PNG, GIF, BMP, WebP or JPEG image from the start of it.
+
+    Args:
+        header (bytes): First HEADER_BYTES of file.
+
+    Returns:
+        tuple[int, int] | None: Width and height, None if format is not
+        supported or dimensions are not in the header.
+    """
+    if header.startswith(b"\x89PNG\r\n\x1a\n") and header[12:16] == b"IHDR":
+        return struct.unpack(">II", header[16:24])
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", header[6:10])
+    if header.startswith(b"BM") and len(header) >= 26:
+        width, height = struct.unpack("<ii", header[18:26])
+        # Negative height means rows go top-down
+        return width, abs(height)
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        chunk = header[12:16]
+        if chunk == b"VP8 " and len(header) >= 30:
+            width, height = struct.unpack("<HH", header[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b"VP8L" and len(header) >= 25:
+            bits = int.from_bytes(header[21:25], "little")
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b"VP8X" and len(header) >= 30:
+            return (int.from_bytes(header[24:27], "little") + 1,
+                    int.from_bytes(header[27:30], "little") + 1)
+        return None
+    if header.startswith(b"\xff\xd8"):
+        return _jpeg_size(header)
+    return None
+
+
+def _jpeg_size(header: bytes) -> tuple[int, int] | None:
+    """Find start of frame marker, dimensions are in it"""
+    i = 2
+    while i + 9 <= len(header):
+        if header[i] != 0xff:
+            return None
+        marker = header[i + 1]
+        if marker == 0xff:
+            # Padding
+            i += 1
+            continue
+        if 0xd0 <= marker <= 0xd9 or marker == 0x01:
+            # Markers without length
+            i += 2
+            continue
+        length = struct.unpack(">H", header[i + 2:i + 4])[0]
+        # Start of frame, except huffman and arithmetic coding tables
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack(">HH", header[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def _wav_duration(header: bytes) -> float | None:
+    """Size of data chunk divided by bytes per second of fmt chunk"""
+    if not (header.startswith(b"RIFF") and header[8:12] == b"WAVE"):
+        return None
+    byte_rate = None
+    i = 12
+    while i + 8 <= len(header):
+        chunk, size = header[i:i + 4], int.from_bytes(header[i + 4:i + 8], "little")
+        if chunk == b"fmt " and i + 16 <= len(header):
+            byte_rate = int.from_bytes(header[i + 16:i + 20], "little")
+        elif chunk == b"data":
+            return size / byte_rate if byte_rate else None
+        # Chunks are padded to even size
+        i += 8 + size + (size & 1)
+    return None
+
+
+def _flac_duration(header: bytes) -> float | None:
+    """Total samples and sample rate of STREAMINFO block"""
+    if not header.startswith(b"fLaC") or len(header) < 26:
+        return None
+    bits = int.from_bytes(header[18:26], "big")
+    sample_rate = bits >> 44
+    total_samples = bits & 0xfffffffff
+    return total_samples / sample_rate if sample_rate and total_samples else None
+
+
+def _mp4_duration(file: BinaryIO, size: int) -> float | None:
+    """
+    Duration from mvhd box of moov box. Boxes are skipped by their size, moov
+    box at the end of a big file is found without reading the file.
+    """
+    end = size
+    position = 0
+    while position + 8 <= end:
+        file.seek(position)
+        box = file.read(16)
+        box_size, kind = struct.unpack(">I4s", box[:8])
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", box[8:16])[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - position
+        if box_size < header_size:
+            return None
+        if kind == b"moov":
+            # Boxes inside of moov
+            end = position + box_size
+            position += header_size
+            continue
+        if kind == b"mvhd":
+            file.seek(position + header_size)
+            mvhd = file.read(32)
+            if mvhd[:1] == b"\x01":
+                timescale, duration = struct.unpack(">IQ", mvhd[20:32])
+            else:
+                timescale, duration = struct.unpack(">II", mvhd[12:20])
+            return duration / timescale if timescale else None
+        position += box_size
+    return None
+
+
+def _read_vint(data: bytes, i: int, marker: bool) -> tuple[int, int] | None:
+    """Read EBML variable size integer, returns value and position after it"""
+    if i >= len(data) or data[i] == 0:
+        return None
+    length = 9 - data[i].bit_length()
+    if i + length > len(data):
+        return None
+    value = int.from_bytes(data[i:i + length], "big")
+    if not marker:
+        value &= (1 << (7 * length)) - 1
+    return value, i + length
+
+
+def _matroska_duration(header: bytes) -> float | None:
+    """Duration and TimestampScale of Info element of MKV and WebM segment"""
+    if not header.startswith(b"\x1a\x45\xdf\xa3"):
+        return None
+    scale = 1_000_000
+    duration = None
+    i = 0
+    while True:
+        vint = _read_vint(header, i, marker=True)
+        if vint is None:
+            break
+        element, i = vint
+        vint = _read_vint(header, i, marker=False)
+        if vint is None:
+            break
+        size, i = vint
+        if element in (0x18538067, 0x1549a966):
+            # Segment and Info, elements inside of them go next
+            continue
+        if element == 0x2ad7b1:
+            scale = int.from_bytes(header[i:i + size], "big")
+        elif element == 0x4489 and size in (4, 8):
+            duration = struct.unpack(">f" if size == 4 else ">d", header[i:i + size])[0]
+        elif element == 0x1f43b675:
+            # Clusters of frames go after Info
+            break
+        i += size
+    return duration * scale / 1e9 if duration is not None else None
+
+
+def read_metadata(path: str, size: int) -> dict:
+    """
+    Read dimensions of an image or duration of a video or audio from the
+    start of a file (and boxes of MP4 and MOV that can be anywhere). Only
+    regular files are read, symlinks are not followed.
+
+    Args:
+        path (str): File full path.
+        size (int): File size.
+
+    Returns:
+        dict: width and height or duration in seconds, empty if format is not
+        supported.
+
+    Raises:
+        OSError: File can't be read, is a symlink or isn't a regular file.
+    """
+    file, _ = open_file(path)
+    with file:
+        header = file.read(HEADER_BYTES)
+        dimensions = image_size(header)
+        if dimensions is not None:
+            return {"width": dimensions[0], "height": dimensions[1]}
+        if header[4:8] == b"ftyp":
+            duration = _mp4_duration(file, size)
+        else:
+            duration = (_wav_duration(header) or _flac_duration(header)
+                        or _matroska_duration(header))
+    return {"duration": round(duration, 3)} if duration else {}
+
+
+def make_thumbnail(path: str, target: str) -> tuple[int, int] | None:
+    """
+    Make JPEG thumbnail of an image that fits into THUMBNAIL_SIZE. JPEG images
+    are decoded at reduced size, which is several times faster than decoding
+    them whole. Only regular files are decoded, symlinks are not followed.
+    File is written under a temporary name and renamed, so readers never see
+    a part of it.
+
+    Args:
+        path (str): Image full path.
+        target (str): Thumbnail full path.
+
+    Returns:
+        tuple[int, int] | None: Dimensions of image, None if Pillow is not
+        installed, image isn't a regular file or can't be decoded.
+    """
+    if Image is None:
+        return None
+    try:
+        file, _ = open_file(path)
+        with file, Image.open(file) as image:
+            dimensions = image.size
+            if dimensions[0] * dimensions[1] > MAX_THUMBNAIL_PIXELS:
+                return None
+            image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            if image.mode in ("RGBA", "LA", "P"):
+                # Transparent pixels become white
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temporary = f"{target}.{os.getpid()}.tmp"
+            image.save(temporary, "JPEG", quality=THUMBNAIL_QUALITY)
+            os.replace(temporary, target)
+    except Exception:
+        # Pillow raises many kinds of errors for broken files
+        return None
+    return dimensions
+
+
+def media_row(id: int, size: int, mtime: float) -> dict:
+    """Row of FileMedia without metadata and thumbnail, see extract_media"""
+    return {"id": id, "size": size, "mtime": mtime, "width": None, "height": None,
+            "duration": None, "thumbnail": False}
+
+
+def extract_media(
+    id: int,
+    path: str,
+    type: str,
+    size: int,
+    mtime: float,
+    directory: str
+) -> dict:
+    """
+    Read metadata of a file and make thumbnail of an image. Runs in a pool
+    of processes, see Indexxo._read_media.
+
+    Args:
+        id (int): File id in index.
+        path (str): File full path.
+        type (str): File type, one of MEDIA_TYPES.
+        size (int): File size.
+        mtime (float): File last modified date.
+        directory (str): Cache directory of thumbnails.
+
+    Returns:
+        dict: Row of FileMedia. Dimensions and duration are None if they are
+        unknown.
+    """
+    row = media_row(id, size, mtime)
+    try:
+        row.update(read_metadata(path, size))
+    except (OSError, struct.error):
+        return row
+    if type == "image":
+        dimensions = make_thumbnail(path, thumbnail_path(directory, media_key(id, size, mtime)))
+        if dimensions is not None:
+            row["thumbnail"] = True
+            # Formats without header parser (TIFF, PSD and others)
+            row["width"], row["height"] = dimensions
+    return row
@@ -0,0 +1,145 @@
+import os
+import pathlib
+import struct
+import tempfile
+import unittest
+import wave
+from server.media import Image, extract_media, media_key, read_metadata, thumbnail_path
+
+
+def box(kind: bytes, payload: bytes) -> bytes:
+    """MP4 box"""
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def element(id: bytes, payload: bytes) -> bytes:
+    """Matroska element with one byte size"""
+    return id + bytes([0x80 | len(payload)]) + payload
+
+
+class MediaTest(unittest.TestCase):
+    temp_dir: tempfile.TemporaryDirectory
+    temp_dir_path: pathlib.Path
+
+    def setUp(self):
+        """
+        Creates temporary directory for media files and thumbnails
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = pathlib.Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self, name: str, data: bytes) -> dict:
+        path = self.temp_dir_path / name
+        path.write_bytes(data)
+        return read_metadata(str(path), len(data))
+
+    def test_image_size(self):
+        """
+        Dimensions are read from headers of PNG and GIF
+        """
+        png = (b"\x89PNG\r\n\x1a\n" + struct.pack(">I4sII", 13, b"IHDR", 640, 480)
+               + b"\x08\x02\x00\x00\x00")
+        self.assertEqual({"width": 640, "height": 480}, self.read("a.png", png))
+        gif = b"GIF89a" + struct.pack("<HH", 32, 16) + b"\x00" * 10
+        self.assertEqual({"width": 32, "height": 16}, self.read("a.gif", gif))
+        self.assertEqual({}, self.read("a.txt", b"not an image"))
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_image_formats(self):
+        """
+        Dimensions are read from headers of images that Pillow writes
+        """
+        for format, ext in (("BMP", "bmp"), ("WEBP", "webp"), ("JPEG", "jpg")):
+            path = self.temp_dir_path / f"image.{ext}"
+            Image.new("RGB", (321, 123), "red").save(path, format)
+            self.assertEqual({"width": 321, "height": 123},
+                             read_metadata(str(path), path.stat().st_size), format)
+
+    def test_duration(self):
+        """
+        Durations of WAV, FLAC, MP4 (moov box after media data) and Matroska
+        """
+        path = self.temp_dir_path / "a.wav"
+        with wave.open(str(path), "wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(8000)
+            file.writeframes(b"\x00" * 8000 * 4 * 3)
+        self.assertEqual({"duration": 3.0}, read_metadata(str(path), path.stat().st_size))
+
+        # 44100 Hz, 2 channels, 16 bits, 441000 samples
+        streaminfo = (44100 << 44) | (1 << 41) | (15 << 36) | 441000
+        flac = b"fLaC\x80\x00\x00\x22" + b"\x00" * 10 + streaminfo.to_bytes(8, "big")
+        self.assertEqual({"duration": 10.0}, self.read("a.flac", flac + b"\x00" * 16))
+
+        mvhd = box(b"mvhd", b"\x00" * 12 + struct.pack(">II", 600, 600 * 90) + b"\x00" * 80)
+        mp4 = (box(b"ftyp", b"isom\x00\x00\x00\x00") + box(b"mdat", b"\x00" * 100_000)
+               + box(b"moov", mvhd))
+        self.assertEqual({"duration": 90.0}, self.read("a.mp4", mp4))
+
+        info = (element(b"\x2a\xd7\xb1", (1_000_000).to_bytes(3, "big"))
+                + element(b"\x44\x89", struct.pack(">d", 12500.0)))
+        # Segment of unknown size
+        mkv = (element(b"\x1a\x45\xdf\xa3", element(b"\x42\x82", b"webm"))
+               + b"\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff"
+               + element(b"\x15\x49\xa9\x66", info))
+        self.assertEqual({"duration": 12.5}, self.read("a.webm", mkv))
+
+    def test_media_key(self):
+        """
+        Key changes with every version of a file
+        """
+        key = media_key(1, 10, 1.5)
+        self.assertEqual(key, media_key(1, 10, 1.5))
+        self.assertNotEqual(key, media_key(1, 10, 1.6))
+        self.assertNotEqual(key, media_key(1, 11, 1.5))
+        self.assertNotEqual(key, media_key(2, 10, 1.5))
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_thumbnail(self):
+        """
+        Thumbnail fits into a square and is stored by key of the image
+        """
+        path = self.temp_dir_path / "image.png"
+        Image.new("RGBA", (1000, 500), (255, 0, 0, 128)).save(path)
+        size = path.stat().st_size
+        cache = str(self.temp_dir_path / "thumbnails")
+        row = extract_media(1, str(path), "image", size, 1.5, cache)
+        self.assertEqual((1000, 500, True), (row["width"], row["height"], row["thumbnail"]))
+        thumbnail = thumbnail_path(cache, media_key(1, size, 1.5))
+        with Image.open(thumbnail) as image:
+            self.assertEqual(("JPEG", (256, 128)), (image.format, image.size))
+        self.assertEqual([os.path.basename(thumbnail)], os.listdir(os.path.dirname(thumbnail)))
+
+        broken = self.temp_dir_path / "broken.png"
+        broken.write_bytes(b"\x89PNG\r\n\x1a\n")
+        row = extract_media(2, str(broken), "image", 8, 1.5, cache)
+        self.assertFalse(row["thumbnail"])
+
+    @unittest.skipIf(os.name == "nt", "Symlinks and FIFOs need privileges or are missing")
+    def test_special_files(self):
+        """
+        Symlinks and FIFOs are not read and get no thumbnail
+        """
+        path = self.temp_dir_path / "image.png"
+        path.write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR" + struct.pack(">II", 3, 2))
+        size = path.stat().st_size
+        cache = str(self.temp_dir_path / "thumbnails")
+        link = self.temp_dir_path / "link.png"
+        link.symlink_to(path)
+        with self.assertRaises(OSError):
+            read_metadata(str(link), size)
+        row = extract_media(1, str(link), "image", size, 1.5, cache)
+        self.assertEqual((None, None, False), (row["width"], row["height"], row["thumbnail"]))
+
+        fifo = self.temp_dir_path / "fifo.png"
+        os.mkfifo(fifo)
+        row = extract_media(2, str(fifo), "image", 0, 1.5, cache)
+        self.assertEqual((None, None, False), (row["width"], row["height"], row["thumbnail"]))
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=False, catchbreak=False)
@@ -0,0 +1,242 @@
+"""Progress and timings of indexing for status and metrics endpoints"""
+import threading
+import time
+from bisect import bisect_left
+
+LISTING_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+"""Upper bounds of folder listing durations in seconds"""
+
+WRITE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+"""Upper bounds of write batch durations in seconds"""
+
+
+class Histogram():
+    """
+    Amounts of durations in fixed buckets, same as Prometheus histogram.
+    Observing is a lookup and two additions, cheap enough for every folder.
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        """
+        Initialize Histogram
+
+        Args:
+            buckets (tuple[float, ...]): Sorted upper bounds of buckets, the
+            last bucket has no upper bound.
+        """
+        self.buckets = buckets
+        self.count = 0
+        """Amount of observed durations"""
+        self.sum = 0.0
+        """Total of observed durations"""
+        self._counts = [0] * (len(buckets) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """Add one duration"""
+        with self._lock:
+            self._counts[bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """
+        Get amount of durations that are not longer than every upper bound.
+
+        Returns:
+            list[tuple[str, int]]: Upper bound ("+Inf" for the last bucket) and
+            amount of durations up to it.
+        """
+        with self._lock:
+            counts = list(self._counts)
+        result = []
+        total = 0
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_json(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": dict(self.cumulative())
+        }
+
+
+class IndexerMetrics():
+    """
+    Progress of the current refresh and totals since start. Counters are
+    changed by writer thread only, queues and histograms are changed from
+    crawler threads too.
+    """
+
+    def __init__(self):
+        self.spaces: dict[str, float] = {}
+        """Unix time when refresh started by space that is being refreshed"""
+        self.path: str | None = None
+        """Last listed folder"""
+        self.refresh_started: float | None = None
+        """
+        Unix time when the current refresh started, None if not refreshing.
+        Refresh lasts while any space is being refreshed.
+        """
+        self.refresh_folders = 0
+        """Folders walked by the current refresh"""
+        self.refresh_files = 0
+        """Files walked by the current refresh"""
+        self.last_refresh_space: str | None = None
+        """Space that was refreshed last (successfully)"""
+        self.last_refresh_completed: float | None = None
+        """Unix time when the last successful refresh of a space completed"""
+        self.last_refresh_seconds: float | None = None
+        """Duration of the last successful refresh of a space"""
+        self.refreshes = 0
+        """Completed refreshes of spaces"""
+        self.refresh_failures = 0
+        """Refreshes of spaces that failed"""
+        self.folders = 0
+        """Folders walked since start"""
+        self.files = 0
+        """Files walked since start"""
+        self.rows_written = 0
+        """Changes written into index since start"""
+        self.crawl_queue = 0
+        """Folders that are waiting to be listed, see crawling"""
+        self.crawl_listing = 0
+        """Folders that are being listed, see crawling"""
+        self.pending_changes = 0
+        """Watched changes that are not written yet"""
+        self.listing = Histogram(LISTING_BUCKETS)
+        """Duration of listing one folder, stat of every entry included"""
+        self.writes = Histogram(WRITE_BUCKETS)
+        """Duration of writing one batch of changes"""
+        self._lock = threading.Lock()
+
+    def start_refresh(self, space: str):
+        """Mark that a space is being refreshed"""
+        now = time.time()
+        if not self.spaces:
+            self.refresh_started = now
+            self.refresh_folders = 0
+            self.refresh_files = 0
+        self.spaces[space] = now
+
+    def finish_refresh(self, space: str, success: bool):
+        """
+        Mark that refresh of a space ended. Failed refresh is only counted,
+        last refresh stays the last one that completed.
+
+        Args:
+            space (str): Space full path.
+            success (bool): Whether refresh completed.
+        """
+        now = time.time()
+        started = self.spaces.pop(space)
+        if success:
+            self.last_refresh_space = space
+            self.last_refresh_completed = now
+            self.last_refresh_seconds = now - started
+            self.refreshes += 1
+        else:
+            self.refresh_failures += 1
+        if not self.spaces:
+            self.refresh_started = None
+            self.path = None
+
+    def crawling(self, queue: int, listing: int):
+        """
+        Change amount of folders that are waiting and being listed. Spaces
+        are crawled at the same time, every crawler adds its own changes.
+        """
+        with self._lock:
+            self.crawl_queue += queue
+            self.crawl_listing += listing
+
+    def walked(self, path: str, files: int):
+        """Count a walked folder and its files"""
+        self.path = path
+        self.folders += 1
+        self.files += files
+        if self.refresh_started is not None:
+            self.refresh_folders += 1
+            self.refresh_files += files
+
+    def to_json(self) -> dict:
+        """Status for /api/status"""
+        refresh = None
+        if self.refresh_started is not None:
+            seconds = max(time.time() - self.refresh_started, 1e-6)
+            refresh = {
+                "spaces": sorted(self.spaces),
+                "path": self.path,
+                "started": self.refresh_started,
+                "seconds": round(seconds, 3),
+                "folders": self.refresh_folders,
+                "files": self.refresh_files,
+                "folders_per_second": round(self.refresh_folders / seconds, 1),
+                "files_per_second": round(self.refresh_files / seconds, 1),
+            }
+        return {
+            "refresh": refresh,
+            "last_refresh": {
+                "space": self.last_refresh_space,
+                "completed": self.last_refresh_completed,
+                "seconds": self.last_refresh_seconds,
+            },
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "folders": self.folders,
+            "files": self.files,
+            "rows_written": self.rows_written,
+            "queues": {
+                "crawl": self.crawl_queue,
+                "listing": self.crawl_listing,
+                "changes": self.pending_changes,
+            },
+            "listing_seconds": self.listing.to_json(),
+            "write_seconds": self.writes.to_json(),
+        }
+
+    def to_prometheus(self) -> str:
+        """Metrics in Prometheus text format for /metrics"""
+        lines = []
+
+        def metric(name: str, kind: str, help: str, value: float | None):
+            lines.append(f"# HELP indexxo_{name} {help}")
+            lines.append(f"# TYPE indexxo_{name} {kind}")
+            lines.append(f"indexxo_{name} {'NaN' if value is None else value}")
+
+        def histogram(name: str, help: str, histogram: Histogram):
+            lines.append(f"# HELP indexxo_{name} {help}")
+            lines.append(f"# TYPE indexxo_{name} histogram")
+            for bound, count in histogram.cumulative():
+                lines.append(f'indexxo_{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"indexxo_{name}_sum {histogram.sum}")
+            lines.append(f"indexxo_{name}_count {histogram.count}")
+
+        metric("refreshing", "gauge", "Spaces that are being refreshed.", len(self.spaces))
+        metric("refresh_folders", "gauge", "Folders walked by the current refresh.",
+               self.refresh_folders)
+        metric("refresh_files", "gauge", "Files walked by the current refresh.",
+               self.refresh_files)
+        metric("last_refresh_seconds", "gauge",
+               "Duration of the last completed refresh of a space.",
+               self.last_refresh_seconds)
+        metric("last_refresh_timestamp_seconds", "gauge",
+               "Unix time when the last completed refresh of a space finished.",
+               self.last_refresh_completed)
+        metric("refreshes_total", "counter", "Completed refreshes of spaces.", self.refreshes)
+        metric("refresh_failures_total", "counter", "Failed refreshes of spaces.",
+               self.refresh_failures)
+        metric("folders_total", "counter", "Walked folders.", self.folders)
+        metric("files_total", "counter", "Walked files.", self.files)
+        metric("rows_written_total", "counter", "Changes written into index.",
+               self.rows_written)
+        metric("crawl_queue", "gauge", "Folders waiting to be listed.", self.crawl_queue)
+        metric("crawl_listing", "gauge", "Folders being listed.", self.crawl_listing)
+        metric("pending_changes", "gauge", "Watched changes not written yet.",
+               self.pending_changes)
+        histogram("listing_seconds", "Duration of listing one folder.", self.listing)
+        histogram("write_seconds", "Duration of writing one batch of changes.", self.writes)
+        return "\n".join(lines) + "\n"
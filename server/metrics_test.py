@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+from server.metrics import Histogram, IndexerMetrics
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_cumulative(self):
+        """
+        Durations are counted in the first bucket that fits them, buckets are
+        cumulative like in Prometheus
+        """
+        histogram = Histogram((0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 2):
+            histogram.observe(seconds)
+        self.assertEqual([("0.1", 2), ("1.0", 3), ("+Inf", 4)], histogram.cumulative())
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(2.65, histogram.sum)
+
+
+class IndexerMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates metrics of a refresh that is running
+        """
+        self.metrics = IndexerMetrics()
+        with mock.patch("time.time", return_value=100):
+            self.metrics.start_refresh("/space")
+        self.metrics.walked("/space", 10)
+        self.metrics.walked("/space/folder", 30)
+
+    def test_refresh_progress(self):
+        """
+        Rates are counted from the start of the current refresh
+        """
+        with mock.patch("time.time", return_value=102):
+            status = self.metrics.to_json()
+        self.assertEqual(["/space"], status["refresh"]["spaces"])
+        self.assertEqual("/space/folder", status["refresh"]["path"])
+        self.assertEqual(1, status["refresh"]["folders_per_second"])
+        self.assertEqual(20, status["refresh"]["files_per_second"])
+
+    def test_finish_refresh(self):
+        """
+        Refresh lasts while any space is refreshed, totals are kept
+        """
+        with mock.patch("time.time", return_value=104):
+            self.metrics.start_refresh("/nas")
+        self.metrics.walked("/nas", 0)
+        with mock.patch("time.time", return_value=105):
+            self.metrics.finish_refresh("/space", True)
+        self.assertEqual(3, self.metrics.to_json()["refresh"]["folders"])
+        with mock.patch("time.time", return_value=110):
+            self.metrics.finish_refresh("/nas", True)
+        self.metrics.start_refresh("/space")
+        self.metrics.walked("/space", 10)
+        status = self.metrics.to_json()
+        self.assertEqual({"space": "/nas", "completed": 110, "seconds": 6},
+                         status["last_refresh"])
+        self.assertEqual(1, status["refresh"]["folders"])
+        self.assertEqual(4, status["folders"])
+        self.assertEqual(50, status["files"])
+        self.assertIn("indexxo_last_refresh_seconds 6", self.metrics.to_prometheus())
+
+    def test_failed_refresh(self):
+        """
+        Failed refresh is counted apart and doesn't change the last refresh
+        """
+        with mock.patch("time.time", return_value=105):
+            self.metrics.finish_refresh("/space", False)
+        status = self.metrics.to_json()
+        self.assertIsNone(status["refresh"])
+        self.assertEqual({"space": None, "completed": None, "seconds": None},
+                         status["last_refresh"])
+        self.assertEqual((0, 1), (status["refreshes"], status["refresh_failures"]))
+        prometheus = self.metrics.to_prometheus()
+        self.assertIn("indexxo_refreshes_total 0", prometheus)
+        self.assertIn("indexxo_refresh_failures_total 1", prometheus)
+        self.assertIn("indexxo_last_refresh_timestamp_seconds NaN", prometheus)
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=False, catchbreak=False)
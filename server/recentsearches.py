@@ -0,0 +1,99 @@
+"""Matches of recent search queries for type-ahead search"""
+import threading
+from collections import OrderedDict
+
+
+class RecentSearches():
+    """
+    Keeps every match of recent search queries, so a query that extends one of
+    them (contains it) filters its matches in memory instead of searching the
+    whole index again. Matches are tuples that start with lowercase name, the
+    rest is up to the caller.
+
+    Queries with too many matches are kept without matches, queries that
+    extend them are not worth keeping either.
+
+    Matches belong to a generation of index (see Indexxo.generation), matches
+    of older generations are dropped as soon as a newer generation is seen.
+    """
+
+    def __init__(self, max_queries: int):
+        """
+        Initialize RecentSearches
+
+        Args:
+            max_queries (int): Amount of queries that are kept, least recently
+            used are dropped.
+        """
+        self.max_queries = max_queries
+        self.generation = 0
+        """Generation of kept matches"""
+        # None for queries with too many matches
+        self._matches: OrderedDict[str, list[tuple] | None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._matches)
+
+    def add(self, query: str, generation: int, matches: list[tuple] | None):
+        """
+        Keep matches of a query.
+
+        Args:
+            query (str): Lowercase query.
+            generation (int): Generation of index that matches were read from.
+            matches (list[tuple] | None): Every match of the query, None if it
+            has too many of them.
+        """
+        with self._lock:
+            self._set_generation(generation)
+            if generation != self.generation:
+                return
+            self._matches[query] = matches
+            self._matches.move_to_end(query)
+            while len(self._matches) > self.max_queries:
+                self._matches.popitem(last=False)
+
+    def narrow(self, query: str, generation: int) -> list[tuple] | None:
+        """
+        Get matches of a query from matches of the longest kept query that it
+        contains. Matches of the query are kept too, so the next extension
+        filters even less.
+
+        Args:
+            query (str): Lowercase query.
+            generation (int): Current generation of index.
+
+        Returns:
+            list[tuple] | None: Every match of the query, None if no kept query
+            is contained in it or it has too many matches.
+        """
+        base, matches = self._find(query, generation)
+        if matches is None:
+            return None
+        if base != query:
+            matches = [m for m in matches if query in m[0]]
+        self.add(query, generation, matches)
+        return matches
+
+    def too_many(self, query: str, generation: int) -> bool:
+        """
+        Check if the longest kept query that the query contains had too many
+        matches, see add.
+        """
+        base, matches = self._find(query, generation)
+        return base is not None and matches is None
+
+    def _find(self, query: str, generation: int) -> tuple[str | None, list[tuple] | None]:
+        with self._lock:
+            self._set_generation(generation)
+            known = [q for q in self._matches if q in query]
+            if not known:
+                return None, None
+            base = max(known, key=len)
+            return base, self._matches[base]
+
+    def _set_generation(self, generation: int):
+        if generation > self.generation:
+            self._matches.clear()
+            self.generation = generation
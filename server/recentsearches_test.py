@@ -0,0 +1,45 @@
+import unittest
+from server.recentsearches import RecentSearches
+
+
+class RecentSearchesTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates matches of one query
+        """
+        self.searches = RecentSearches(max_queries=2)
+        self.searches.add("doc", 0, [("docs.txt",), ("my doc.pdf",), ("documents",)])
+
+    def test_narrow(self):
+        """
+        Query is narrowed from the longest kept query that it contains
+        """
+        self.assertEqual([("docs.txt",)], self.searches.narrow("docs", 0))
+        self.assertEqual([("docs.txt",)], self.searches.narrow("docs.", 0))
+        self.assertIsNone(self.searches.narrow("do", 0))
+        self.assertEqual(2, len(self.searches))
+
+    def test_too_many(self):
+        """
+        Queries that extend a query with too many matches are not narrowed
+        """
+        self.searches.add("do", 0, None)
+        self.assertFalse(self.searches.too_many("doc", 0))
+        self.assertTrue(self.searches.too_many("dot", 0))
+        self.assertIsNone(self.searches.narrow("dot", 0))
+
+    def test_generation(self):
+        """
+        Matches of older generation are dropped
+        """
+        self.assertIsNone(self.searches.narrow("docs", 1))
+        self.searches.add("doc", 0, [])
+        self.assertEqual(0, len(self.searches))
+
+
+if __name__ == '__main__':
+    unittest.main(
+        failfast=False,
+        catchbreak=False
+    )
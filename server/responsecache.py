@@ -0,0 +1,121 @@
+"""Cache of serialized WEB API responses"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Iterable, Iterator
+
+
+class ResponseCache():
+    """
+    Bounded LRU cache of response bodies. Every body belongs to a generation
+    of index (see Indexxo.generation), bodies of older generations are dropped
+    as soon as a newer generation is seen.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        """
+        Initialize ResponseCache
+
+        Args:
+            max_bytes (int): Total size of cached bodies.
+            max_entry_bytes (int): Biggest body that is cached.
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.generation = 0
+        """Generation of cached bodies"""
+        self.size = 0
+        """Total size of cached bodies"""
+        # Differs between runs, generation starts from 0 every time
+        self._instance = os.urandom(4).hex()
+        self._entries: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def etag(self, generation: int) -> str:
+        """ETag of every response that was built from index of the generation"""
+        return f"{self._instance}-{generation}"
+
+    def get(self, key: Hashable, generation: int) -> bytes | None:
+        """
+        Get cached body.
+
+        Args:
+            key (Hashable): Endpoint and its arguments.
+            generation (int): Current generation of index.
+
+        Returns:
+            bytes | None: Body or None if it's not cached.
+        """
+        with self._lock:
+            self._set_generation(generation)
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: Hashable, generation: int, body: bytes):
+        """
+        Cache body, least recently used bodies are dropped to fit it. Does
+        nothing if body is too big or it's from an older generation.
+
+        Args:
+            key (Hashable): Endpoint and its arguments.
+            generation (int): Generation of index that body was built from.
+            body (bytes): Response body.
+        """
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._set_generation(generation)
+            if generation != self.generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.size -= len(dropped)
+
+    def put_while_sending(
+        self,
+        key: Hashable,
+        generation: int,
+        chunks: Iterable[str | bytes]
+    ) -> Iterator[str | bytes]:
+        """
+        Pass chunks of a streamed body through and cache the body when every
+        chunk was sent, see put. Body is not collected once it's too big.
+
+        Args:
+            key (Hashable): Endpoint and its arguments.
+            generation (int): Generation of index that body is built from.
+            chunks (Iterable[str | bytes]): Body chunks.
+
+        Yields:
+            str | bytes: Same chunks.
+        """
+        body: list[bytes] | None = []
+        size = 0
+        for chunk in chunks:
+            yield chunk
+            if body is None:
+                continue
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            size += len(data)
+            if size > self.max_entry_bytes:
+                body = None
+            else:
+                body.append(data)
+        if body is not None:
+            self.put(key, generation, b"".join(body))
+
+    def _set_generation(self, generation: int):
+        if generation > self.generation:
+            self._entries.clear()
+            self.size = 0
+            self.generation = generation
@@ -0,0 +1,53 @@
+import unittest
+from server.responsecache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates cache that fits three bodies of 10 bytes
+        """
+        self.cache = ResponseCache(max_bytes=30, max_entry_bytes=20)
+
+    def test_least_recently_used(self):
+        """
+        Least recently used body is dropped when cache is full
+        """
+        for key in ("a", "b", "c"):
+            self.cache.put(key, 0, b"0123456789")
+        self.cache.get("a", 0)
+        self.cache.put("d", 0, b"0123456789")
+        self.assertIsNone(self.cache.get("b", 0))
+        self.assertEqual(b"0123456789", self.cache.get("a", 0))
+        self.assertEqual(30, self.cache.size)
+
+    def test_generation(self):
+        """
+        Newer generation drops everything, bodies of older generation are not cached
+        """
+        self.cache.put("a", 0, b"old")
+        self.assertIsNone(self.cache.get("a", 1))
+        self.cache.put("a", 0, b"old")
+        self.assertEqual(0, len(self.cache))
+        self.assertNotEqual(self.cache.etag(0), self.cache.etag(1))
+
+    def test_put_while_sending(self):
+        """
+        Streamed body is cached after the last chunk, too big body is not cached
+        """
+        chunks = self.cache.put_while_sending("a", 0, ["{", b"}"])
+        self.assertEqual("{", next(chunks))
+        self.assertIsNone(self.cache.get("a", 0))
+        self.assertEqual([b"}"], list(chunks))
+        self.assertEqual(b"{}", self.cache.get("a", 0))
+
+        list(self.cache.put_while_sending("b", 0, ["0123456789"] * 3))
+        self.assertIsNone(self.cache.get("b", 0))
+
+
+if __name__ == '__main__':
+    unittest.main(
+        failfast=False,
+        catchbreak=False
+    )
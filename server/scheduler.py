@@ -0,0 +1,117 @@
+"""Refresh schedules of spaces"""
+from pathlib import Path
+from typing import Iterator
+
+
+class SpaceSchedule():
+    """When and how a space is refreshed"""
+
+    def __init__(
+        self,
+        path: Path,
+        interval: int,
+        priority: int = 0,
+        crawler_workers: int | None = None
+    ):
+        """
+        Initialize SpaceSchedule
+
+        Args:
+            path (Path): Space full path.
+            interval (int): Amount of seconds between refreshes.
+            priority (int): Due spaces with higher priority are refreshed first.
+            crawler_workers (int | None): Threads listing folders of this space,
+            default of indexer if None.
+        """
+        self.path = path
+        self.interval = interval
+        self.priority = priority
+        self.crawler_workers = crawler_workers
+        self.last_scan = 0.0
+        """Unix time when the last refresh completed, 0 if never"""
+        self.running = False
+        """Whether space is being refreshed"""
+        self.requested = False
+        """Whether space is refreshed as soon as possible, see Scheduler.request_all"""
+
+    def due_in(self, now: float) -> float:
+        """Seconds until the next refresh, 0 or less if it's due"""
+        if self.requested:
+            return 0
+        return self.last_scan + self.interval - now
+
+
+class Scheduler():
+    """
+    Schedules of every space. Every space is refreshed after its own interval,
+    so slow spaces don't delay refreshes of other spaces. A few spaces are
+    refreshed at the same time. Used from event loop only.
+    """
+
+    def __init__(self, concurrent_refreshes: int):
+        """
+        Initialize Scheduler
+
+        Args:
+            concurrent_refreshes (int): Maximum amount of spaces that are
+            refreshed at the same time.
+        """
+        self.concurrent_refreshes = concurrent_refreshes
+        self._schedules: dict[str, SpaceSchedule] = {}
+
+    def __iter__(self) -> Iterator[SpaceSchedule]:
+        return iter(self._schedules.values())
+
+    def add(self, schedule: SpaceSchedule):
+        """Add a space, replaces its previous schedule"""
+        self._schedules[str(schedule.path)] = schedule
+
+    def get(self, path: str) -> SpaceSchedule | None:
+        """Get schedule of a space by full path"""
+        return self._schedules.get(path)
+
+    def due(self, now: float) -> list[SpaceSchedule]:
+        """
+        Get spaces that should start refreshing now. Spaces with higher
+        priority go first, then spaces that were refreshed the longest time
+        ago (never refreshed spaces are the first of them).
+
+        Args:
+            now (float): Current Unix time.
+
+        Returns:
+            list[SpaceSchedule]: Due spaces that are not running, no more than
+            free slots allow.
+        """
+        running = sum(s.running for s in self)
+        due = sorted((s for s in self if not s.running and s.due_in(now) <= 0),
+                     key=lambda s: (-s.priority, s.last_scan))
+        return due[:max(self.concurrent_refreshes - running, 0)]
+
+    def next_due(self, now: float) -> float | None:
+        """
+        Get seconds until a space that is not running is due.
+
+        Returns:
+            float | None: Seconds, 0 if a space is already due. None if no
+            space can start until a running space finishes.
+        """
+        if sum(s.running for s in self) >= self.concurrent_refreshes:
+            return None
+        waiting = [s.due_in(now) for s in self if not s.running]
+        return max(min(waiting), 0) if waiting else None
+
+    def start(self, schedule: SpaceSchedule):
+        """Mark space as running"""
+        schedule.running = True
+        schedule.requested = False
+
+    def finish(self, schedule: SpaceSchedule, now: float):
+        """Mark space as refreshed at now"""
+        schedule.running = False
+        schedule.last_scan = now
+
+    def request_all(self):
+        """Refresh every space as soon as possible, running spaces once again"""
+        for schedule in self:
+            schedule.requested = True
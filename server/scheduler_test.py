@@ -0,0 +1,59 @@
+import unittest
+from pathlib import Path
+from server.scheduler import Scheduler, SpaceSchedule
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates schedules of a fast space, a slow space with low priority and
+        a space that was never refreshed
+        """
+        self.scheduler = Scheduler(concurrent_refreshes=2)
+        self.ssd = SpaceSchedule(Path("/ssd"), interval=60)
+        self.nas = SpaceSchedule(Path("/nas"), interval=3600, priority=-1)
+        self.new = SpaceSchedule(Path("/new"), interval=60)
+        for schedule in (self.ssd, self.nas, self.new):
+            self.scheduler.add(schedule)
+        self.ssd.last_scan = 1000
+        self.nas.last_scan = 900
+
+    def test_due(self):
+        """
+        Priority goes first, then spaces refreshed the longest time ago
+        """
+        self.assertEqual([self.new, self.ssd], self.scheduler.due(1060))
+        self.assertEqual([self.new], self.scheduler.due(1059))
+        self.assertEqual(0, self.scheduler.next_due(1059))
+        self.scheduler.start(self.new)
+        self.assertEqual(1, self.scheduler.next_due(1059))
+
+    def test_concurrent_refreshes(self):
+        """
+        No more spaces than allowed run at the same time, every space keeps
+        its own interval
+        """
+        for schedule in self.scheduler.due(1060):
+            self.scheduler.start(schedule)
+        self.assertEqual([], self.scheduler.due(5000))
+        self.assertIsNone(self.scheduler.next_due(5000))
+
+        self.scheduler.finish(self.ssd, 1100)
+        self.assertEqual(60, self.scheduler.next_due(1100))
+        self.assertEqual([self.ssd], self.scheduler.due(1160))
+        self.assertEqual(3340, self.nas.due_in(1160))
+
+    def test_request_all(self):
+        """
+        Requested spaces are due right away, running spaces once they finish
+        """
+        self.scheduler.start(self.new)
+        self.scheduler.request_all()
+        self.assertEqual([self.ssd], self.scheduler.due(1000))
+        self.scheduler.finish(self.new, 1000)
+        self.assertEqual([self.ssd, self.new], self.scheduler.due(1000))
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=False, catchbreak=False)
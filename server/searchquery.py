@@ -0,0 +1,157 @@
+"""Search query syntax: name terms and filters by type, extension, size and date"""
+import re
+from datetime import datetime, timedelta
+
+SIZE_UNITS = {
+    "": 1,
+    "b": 1,
+    "k": 1024,
+    "m": 1024 ** 2,
+    "g": 1024 ** 3,
+    "t": 1024 ** 4,
+}
+"""Multipliers of size suffixes, KB/KiB are the same as K"""
+
+MAX_SIZE = 2 ** 63 - 1
+"""Biggest size that can be compared, SQLite integers are 64-bit"""
+
+DATE_FORMATS = {
+    "%Y": "year",
+    "%Y-%m": "month",
+    "%Y-%m-%d": "day",
+    "%Y-%m-%dT%H:%M": "minute",
+}
+"""Accepted dates (local time) and the period that each of them means"""
+
+FILTERS = ("type", "ext", "size", "mtime")
+"""Names of filters, see SearchQuery"""
+
+_TOKEN = re.compile(r'(\w+):("[^"]*"|\S*)|"([^"]*)"?|(\S+)')
+"""Filter with (quoted) value, quoted term or plain term"""
+
+_COMPARISON = re.compile(r"(>=|<=|>|<|=)?(.*)")
+"""Optional operator and value"""
+
+
+class SearchQuery():
+    """
+    Parsed search query. Everything that is not a filter is a name term, file
+    or folder matches if its full name contains every term. Filters:
+
+    type:video — Type of file, see FileObjectBase.type. Comma separated or
+    repeated values match any of them.
+
+    ext:mkv — Extension with or without dot, same as type.
+
+    size:>1G — Size compared with >, >=, <, <= or = (default). Suffixes are
+    B, K, M, G and T (1024 based).
+
+    mtime:>2025-01-01 — Last modified date, YYYY, YYYY-MM, YYYY-MM-DD or
+    YYYY-MM-DDTHH:MM. Date is a period: mtime:2025 is any time in 2025 and
+    mtime:>2025 is after 2025.
+
+    Values with spaces are quoted: "my file" or ext:"tar gz". Every filter
+    must match. Filter without value is ignored.
+    """
+    names: list[str]
+    """Lowercase name terms"""
+    types: list[str]
+    """Types, any of them matches"""
+    extensions: list[str]
+    """Lowercase extensions with dot, any of them matches"""
+    sizes: list[tuple[str, int]]
+    """Comparisons of size: SQL operator (>, >=, <, <= or =) and bytes"""
+    mtimes: list[tuple[str, float]]
+    """Comparisons of last modified date: operator and Unix time"""
+
+    def __init__(self, query: str):
+        """
+        Parse search query.
+
+        Args:
+            query (str): Query as user typed it.
+
+        Raises:
+            ValueError: Invalid size or date.
+        """
+        self.names = []
+        self.types = []
+        self.extensions = []
+        self.sizes = []
+        self.mtimes = []
+        for key, value, quoted, term in _TOKEN.findall(query):
+            key = key.lower()
+            value = value.strip('"')
+            if key in FILTERS and not value:
+                # Filter is not typed yet
+                continue
+            if key == "type":
+                self.types.extend(v.lower() for v in value.split(",") if v)
+            elif key == "ext":
+                self.extensions.extend("." + v.lower().lstrip(".")
+                                       for v in value.split(",") if v)
+            elif key == "size":
+                self.sizes.append(_parse_size(value))
+            elif key == "mtime":
+                self.mtimes.extend(_parse_date(value))
+            elif key:
+                # Not a filter, like C:\\
+                self.names.append(f"{key}:{value}".lower())
+            elif quoted or term:
+                self.names.append((quoted or term).lower())
+
+    def is_empty(self) -> bool:
+        """Whether query has no name terms and no filters, it would match everything"""
+        return (not self.names and not self.types and not self.extensions and
+                not self.sizes and not self.mtimes)
+
+    def is_plain(self) -> bool:
+        """Whether query is one name term without filters"""
+        return (len(self.names) == 1 and not self.types and not self.extensions and
+                not self.sizes and not self.mtimes)
+
+
+def _parse_size(value: str) -> tuple[str, int]:
+    """Parse size comparison like >1.5G"""
+    operator, size = _COMPARISON.fullmatch(value).groups()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([a-z]?)(?:i?b)?", size.lower())
+    if match is None or match.group(2) not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {value}, use a number with B, K, M, G or T")
+    number, unit = match.groups()
+    size = float(number) * SIZE_UNITS[unit]
+    if size > MAX_SIZE:
+        raise ValueError(f"Invalid size: {value}, it's bigger than any file")
+    return operator or "=", int(size)
+
+
+def _parse_date(value: str) -> list[tuple[str, float]]:
+    """Parse date comparison like >2025-01-01 into comparisons of Unix time"""
+    operator, date = _COMPARISON.fullmatch(value).groups()
+    for date_format, period in DATE_FORMATS.items():
+        try:
+            start = datetime.strptime(date, date_format)
+        except ValueError:
+            continue
+        break
+    else:
+        raise ValueError(f"Invalid date: {value}, use YYYY, YYYY-MM, YYYY-MM-DD "
+                         "or YYYY-MM-DDTHH:MM")
+
+    if period == "year":
+        end = start.replace(year=start.year + 1)
+    elif period == "month":
+        end = (start + timedelta(days=32)).replace(day=1)
+    elif period == "day":
+        end = start + timedelta(days=1)
+    else:
+        end = start + timedelta(minutes=1)
+    # Naive dates are local time
+    start, end = start.timestamp(), end.timestamp()
+    return {
+        ">": [(">=", end)],
+        ">=": [(">=", start)],
+        "<": [("<", start)],
+        "<=": [("<", end)],
+        "=": [(">=", start), ("<", end)],
+    }[operator or "="]
+
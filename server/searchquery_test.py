@@ -0,0 +1,63 @@
+import unittest
+from datetime import datetime
+from server.searchquery import SearchQuery
+
+
+class SearchQueryTest(unittest.TestCase):
+
+    def test_names(self):
+        """
+        Everything that is not a filter is a lowercase name term
+        """
+        search = SearchQuery('My "Holiday Photos" C:\\Users  ')
+        self.assertEqual(["my", "holiday photos", "c:\\users"], search.names)
+        self.assertFalse(search.is_plain())
+        self.assertTrue(SearchQuery('"unfinished quote').is_plain())
+        self.assertEqual(["unfinished quote"], SearchQuery('"unfinished quote').names)
+        for query in ("", "   ", '""', "type: size:"):
+            self.assertTrue(SearchQuery(query).is_empty())
+        self.assertFalse(SearchQuery("type:video").is_empty())
+
+    def test_types_and_extensions(self):
+        """
+        Comma separated and repeated values are collected
+        """
+        search = SearchQuery("type:Video,image ext:MKV,.png ext:\"tar gz\" type:")
+        self.assertEqual(["video", "image"], search.types)
+        self.assertEqual([".mkv", ".png", ".tar gz"], search.extensions)
+        self.assertEqual([], search.names)
+
+    def test_sizes(self):
+        """
+        Sizes have optional operator and 1024 based suffix
+        """
+        search = SearchQuery("size:>1.5G size:<=10kb size:100 size:=2MiB")
+        self.assertEqual([(">", 1610612736), ("<=", 10240), ("=", 100), ("=", 2097152)],
+                         search.sizes)
+        for size in ("size:big", "size:>", "size:1x", "size:-1",
+                     "size:>99999999999999999999T", "size:" + "9" * 400):
+            with self.assertRaises(ValueError):
+                SearchQuery(size)
+
+    def test_mtimes(self):
+        """
+        Date is a period, comparisons include or exclude the whole period
+        """
+        start = datetime(2024, 2, 1).timestamp()
+        end = datetime(2024, 3, 1).timestamp()
+        self.assertEqual([(">=", start), ("<", end)], SearchQuery("mtime:2024-02").mtimes)
+        self.assertEqual([(">=", end)], SearchQuery("mtime:>2024-02").mtimes)
+        self.assertEqual([(">=", start)], SearchQuery("mtime:>=2024-02").mtimes)
+        self.assertEqual([("<", start)], SearchQuery("mtime:<2024-02").mtimes)
+        self.assertEqual([("<", end)], SearchQuery("mtime:<=2024-02").mtimes)
+        self.assertEqual([("<", datetime(2025, 1, 1).timestamp())],
+                         SearchQuery("mtime:<=2024").mtimes)
+        self.assertEqual([(">=", datetime(2024, 2, 1, 10, 31).timestamp())],
+                         SearchQuery("mtime:>2024-02-01T10:30").mtimes)
+        for date in ("mtime:yesterday", "mtime:2024-13", "mtime:>=24"):
+            with self.assertRaises(ValueError):
+                SearchQuery(date)
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=False, catchbreak=False)
@@ -5,6 +5,50 @@ import logging
 import pathlib
 from typing import Any
 
+SPACE_OPTIONS = ("update_interval", "priority", "crawler_workers")
+"""Options that a space in space_paths can override"""
+
+
+def parse_space_paths(entries: Any) -> tuple[list[str], dict[str, dict]]:
+    """
+    Parse space_paths of config file. Every entry is a path or an object with
+    path and options of the space, for example:
+    {"path": "/mnt/nas", "update_interval": 86400, "priority": -1, "crawler_workers": 32}
+
+    Args:
+        entries (Any): space_paths from config file.
+
+    Returns:
+        tuple[list[str], dict[str, dict]]: Paths and options by path of spaces
+        that have them.
+
+    Raises:
+        TypeError: Entries or options have wrong types.
+    """
+    if not isinstance(entries, list):
+        raise TypeError("space_paths must be a list of strings or objects")
+    paths = []
+    options = {}
+    for entry in entries:
+        if isinstance(entry, str):
+            paths.append(entry)
+            continue
+        if not isinstance(entry, dict) or not isinstance(entry.get("path"), str):
+            raise TypeError("space_paths entry must be a string or an object with path")
+        space_options = {k: v for k, v in entry.items() if k != "path"}
+        for key, value in space_options.items():
+            if key not in SPACE_OPTIONS:
+                raise TypeError(f"Unknown option {key} of space {entry['path']}, "
+                                f"use {', '.join(SPACE_OPTIONS)}")
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise TypeError(f"{key} of space {entry['path']} must be an integer")
+            if key != "priority" and value < 1:
+                raise TypeError(f"{key} of space {entry['path']} must be positive")
+        paths.append(entry["path"])
+        if space_options:
+            options[entry["path"]] = space_options
+    return paths, options
+
 
 class IndexxoSettings():
     # Config file name
@@ -15,8 +59,18 @@ class IndexxoSettings():
     config_path: pathlib.Path
 
     space_paths: list[pathlib.Path] = []
-    ignore_paths: list[pathlib.Path] = []
+    # Options of spaces by path, see parse_space_paths
+    space_options: dict[str, dict] = {}
+    # Full paths and .gitignore patterns, see IgnoreRules
+    ignore_paths: list[str] = []
+    # Names of per-folder ignore files like .gitignore
+    ignore_files: list[str] = []
     update_interval: int = 3600
+    crawler_workers: int = 8
+    watch_changes: bool = True
+    hash_rate: int = 20
+    concurrent_refreshes: int = 2
+    media_metadata: bool = True
 
     def __init__(
             self,
@@ -41,9 +95,16 @@ class IndexxoSettings():
         # Now we load data from config file
         config_data = json.load(open(self.config_path))
         logging.info("Successfully loaded config file")
-        self.space_paths = config_data['space_paths']
+        self.space_paths, self.space_options = parse_space_paths(config_data['space_paths'])
         self.ignore_paths = config_data['ignore_paths']
+        self.ignore_files = config_data.get('ignore_files', [])
         self.update_interval = config_data['update_interval']
+        # Config files from older versions don't have it
+        self.crawler_workers = config_data.get('crawler_workers', 8)
+        self.watch_changes = config_data.get('watch_changes', True)
+        self.hash_rate = config_data.get('hash_rate', 20)
+        self.concurrent_refreshes = config_data.get('concurrent_refreshes', 2)
+        self.media_metadata = config_data.get('media_metadata', True)
         logging.info("All settings have been applied")
 
     def load_dummy_config_file(self):
@@ -52,8 +113,15 @@ class IndexxoSettings():
         """
         logging.info(f"Creating default config.json file at {self.config_path}")
         self.space_paths = []
+        self.space_options = {}
         self.ignore_paths = []
+        self.ignore_files = []
         self.update_interval = 3600
+        self.crawler_workers = 8
+        self.watch_changes = True
+        self.hash_rate = 20
+        self.concurrent_refreshes = 2
+        self.media_metadata = True
         self.dump_settings()
         logging.info(f"Created default config.json file at {self.config_path}")
 
@@ -69,10 +137,7 @@ class IndexxoSettings():
         # Now we get data from it and check if everything is ok
 
         # Space paths
-        space_paths = data['space_paths']
-        if not isinstance(space_paths, list):
-            raise TypeError("space_paths must be a list of strings")
-        self.space_paths = space_paths
+        self.space_paths, self.space_options = parse_space_paths(data['space_paths'])
 
         # Space paths
         ignore_paths = data['ignore_paths']
@@ -80,12 +145,49 @@ class IndexxoSettings():
             raise TypeError("ignore_paths must be a list of strings")
         self.ignore_paths = ignore_paths
 
+        # Ignore files
+        ignore_files = data.get('ignore_files', self.ignore_files)
+        if not isinstance(ignore_files, list) or not all(isinstance(f, str) for f in ignore_files):
+            raise TypeError("ignore_files must be a list of strings")
+        self.ignore_files = ignore_files
+
         # Space paths
         update_interval = data['update_interval']
         if not isinstance(update_interval, int):
             raise TypeError("update_interval must be an integer")
         self.update_interval = update_interval
 
+        # Crawler workers
+        crawler_workers = data.get('crawler_workers', self.crawler_workers)
+        if not isinstance(crawler_workers, int) or crawler_workers < 1:
+            raise TypeError("crawler_workers must be a positive integer")
+        self.crawler_workers = crawler_workers
+
+        # Watching changes
+        watch_changes = data.get('watch_changes', self.watch_changes)
+        if not isinstance(watch_changes, bool):
+            raise TypeError("watch_changes must be a boolean")
+        self.watch_changes = watch_changes
+
+        # Duplicate search
+        hash_rate = data.get('hash_rate', self.hash_rate)
+        if isinstance(hash_rate, bool) or not isinstance(hash_rate, (int, float)) or hash_rate < 0:
+            raise TypeError("hash_rate must be a non-negative number")
+        self.hash_rate = hash_rate
+
+        # Spaces refreshed at the same time
+        concurrent_refreshes = data.get('concurrent_refreshes', self.concurrent_refreshes)
+        if (isinstance(concurrent_refreshes, bool) or not isinstance(concurrent_refreshes, int)
+                or concurrent_refreshes < 1):
+            raise TypeError("concurrent_refreshes must be a positive integer")
+        self.concurrent_refreshes = concurrent_refreshes
+
+        # Metadata and thumbnails of media files
+        media_metadata = data.get('media_metadata', self.media_metadata)
+        if not isinstance(media_metadata, bool):
+            raise TypeError("media_metadata must be a boolean")
+        self.media_metadata = media_metadata
+
         self.dump_settings()
 
     def get_config_file(self):
@@ -94,7 +196,13 @@ class IndexxoSettings():
         data = {
             "space_paths": [],
             "ignore_paths": [],
-            "update_interval": 3600
+            "ignore_files": [],
+            "update_interval": 3600,
+            "crawler_workers": 8,
+            "watch_changes": True,
+            "hash_rate": 20,
+            "concurrent_refreshes": 2,
+            "media_metadata": True
         }
         with open(generated_file_path, 'w') as f:
             json.dump(data, f)
@@ -105,9 +213,18 @@ class IndexxoSettings():
         Dump all settings into config.json file in app data folder
         """
         data = {
-            "space_paths": self.space_paths,
+            "space_paths": [
+                {"path": p, **self.space_options[p]} if p in self.space_options else p
+                for p in self.space_paths
+            ],
             "ignore_paths": self.ignore_paths,
-            "update_interval": self.update_interval
+            "ignore_files": self.ignore_files,
+            "update_interval": self.update_interval,
+            "crawler_workers": self.crawler_workers,
+            "watch_changes": self.watch_changes,
+            "hash_rate": self.hash_rate,
+            "concurrent_refreshes": self.concurrent_refreshes,
+            "media_metadata": self.media_metadata
         }
         with open(self.config_path, 'w') as f:
             json.dump(data, f)
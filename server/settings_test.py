@@ -43,7 +43,9 @@ class SettingsTest(unittest.TestCase):
         print("Config file here", settings.config_path)
         self.assertEqual(
             config,
-            {'space_paths': [], 'ignore_paths': [], 'update_interval': 3600}
+            {'space_paths': [], 'ignore_paths': [], 'ignore_files': [], 'update_interval': 3600,
+             'crawler_workers': 8, 'watch_changes': True, 'hash_rate': 20,
+             'concurrent_refreshes': 2, 'media_metadata': True}
         )
 
     def test_load_config_file_no_file(self):
@@ -58,7 +60,9 @@ class SettingsTest(unittest.TestCase):
         config: dict = json.load(open(settings.config_path))
         self.assertEqual(
             config,
-            {'space_paths': [], 'ignore_paths': [], 'update_interval': 3600}
+            {'space_paths': [], 'ignore_paths': [], 'ignore_files': [], 'update_interval': 3600,
+             'crawler_workers': 8, 'watch_changes': True, 'hash_rate': 20,
+             'concurrent_refreshes': 2, 'media_metadata': True}
         )
 
     def test_load_config_file_ok(self):
@@ -80,6 +84,10 @@ class SettingsTest(unittest.TestCase):
         self.assertEqual(['/folder1/subfolder', '/folder2/subfolder'], settings.space_paths)
         self.assertEqual(['/folder3/subfolder', '/folder4/subfolder'], settings.ignore_paths)
         self.assertEqual(2800, settings.update_interval)
+        # Not in config file, default value is used
+        self.assertEqual(8, settings.crawler_workers)
+        self.assertTrue(settings.watch_changes)
+        self.assertEqual(20, settings.hash_rate)
 
     def test_update_config_file(self):
         """
@@ -90,16 +98,58 @@ class SettingsTest(unittest.TestCase):
         # Writing settings before loading them from file
         settings_data = {
             "space_paths": ['/folder1/subfolder', '/folder2/subfolder'],
-            "ignore_paths": ['/folder3/subfolder', '/folder4/subfolder'],
-            "update_interval": 2800
+            "ignore_paths": ['/folder3/subfolder', 'node_modules', '*.tmp'],
+            "ignore_files": ['.gitignore'],
+            "update_interval": 2800,
+            "crawler_workers": 16,
+            "watch_changes": False,
+            "hash_rate": 0,
+            "media_metadata": False
         }
         with open(self.temp_dir_path / "dummy.json", 'w') as f:
             json.dump(settings_data, open(self.temp_dir_path / "dummy.json", 'w'))
             settings.update_config_file(open(self.temp_dir_path / "dummy.json"))
         # Now checking if config has been updated
         self.assertEqual(['/folder1/subfolder', '/folder2/subfolder'], settings.space_paths)
-        self.assertEqual(['/folder3/subfolder', '/folder4/subfolder'], settings.ignore_paths)
+        self.assertEqual(['/folder3/subfolder', 'node_modules', '*.tmp'], settings.ignore_paths)
+        self.assertEqual(['.gitignore'], settings.ignore_files)
         self.assertEqual(2800, settings.update_interval)
+        self.assertEqual(16, settings.crawler_workers)
+        self.assertFalse(settings.watch_changes)
+        self.assertEqual(0, settings.hash_rate)
+        self.assertFalse(settings.media_metadata)
+
+    def test_space_options(self):
+        """
+        Spaces can have their own refresh interval, priority and crawler threads
+        """
+        settings = IndexxoSettings(indexxo_directory=self.temp_dir_path)
+        settings_data = {
+            "space_paths": ['/ssd', {"path": '/nas', "update_interval": 86400, "priority": -1}],
+            "ignore_paths": [],
+            "update_interval": 600,
+            "concurrent_refreshes": 3
+        }
+        json.dump(settings_data, open(settings.config_path, 'w'))
+        settings.load_config_file()
+        self.assertEqual(['/ssd', '/nas'], settings.space_paths)
+        self.assertEqual({'/nas': {"update_interval": 86400, "priority": -1}},
+                         settings.space_options)
+        self.assertEqual(3, settings.concurrent_refreshes)
+
+        # Spaces without options stay strings
+        settings.dump_settings()
+        self.assertEqual(settings_data["space_paths"],
+                         json.load(open(settings.config_path))["space_paths"])
+
+        for space_paths in (['/nas', {"update_interval": 60}],
+                            [{"path": '/nas', "update_interval": "daily"}],
+                            [{"path": '/nas', "crawler_workers": 0}],
+                            [{"path": '/nas', "interval": 60}]):
+            with open(self.temp_dir_path / "dummy.json", 'w') as f:
+                json.dump(dict(settings_data, space_paths=space_paths), f)
+            with self.assertRaises(TypeError):
+                settings.update_config_file(open(self.temp_dir_path / "dummy.json"))
 
 if __name__ == '__main__':
     unittest.main(
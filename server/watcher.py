@@ -0,0 +1,171 @@
+"""File system watcher, uses inotify (Linux only)"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+"""Events of folder content that change index"""
+
+_EVENT = struct.Struct("iIII")
+"""struct inotify_event without name: wd, mask, cookie, len"""
+
+
+class WatchLimitError(OSError):
+    """Raised when system limit of watched folders is reached"""
+
+
+class Watcher():
+    """
+    Watches folders (not recursive, every folder is watched separately) and
+    reports paths that changed inside of them. Doesn't tell what happened to a
+    path, only that something did, so it must be checked on disk.
+    """
+
+    def __init__(self):
+        """
+        Initialize Watcher
+
+        Raises:
+            OSError: inotify is not available on this system.
+        """
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "libc is not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported")
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "Can't initialize inotify")
+        # Watch descriptors and watched folders in both directions
+        self._paths: dict[int, str] = {}
+        self._descriptors: dict[str, int] = {}
+        # Watches are added from writer thread and removed while reading events
+        self._lock = threading.Lock()
+
+    def fileno(self) -> int:
+        """File descriptor that is readable when there are events"""
+        return self._fd
+
+    def watch(self, path: str):
+        """
+        Start watching content of a folder. Does nothing if it's already watched.
+
+        Args:
+            path (str): Folder full path.
+
+        Raises:
+            WatchLimitError: Too many folders are watched.
+        """
+        with self._lock:
+            if path in self._descriptors:
+                return
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise WatchLimitError(error, "inotify watch limit is reached", path)
+                # Folder was removed or is not accessible, refresh will handle it
+                return
+            self._paths[wd] = path
+            self._descriptors[path] = wd
+
+    def unwatch_tree(self, path: str):
+        """
+        Stop watching a folder and every folder inside of it.
+
+        Args:
+            path (str): Folder full path.
+        """
+        prefix = os.path.join(path, "")
+        with self._lock:
+            for watched in [p for p in self._descriptors
+                            if p == path or p.startswith(prefix)]:
+                wd = self._descriptors.pop(watched)
+                del self._paths[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def watched(self) -> int:
+        """Amount of watched folders"""
+        return len(self._descriptors)
+
+    def read_events(self) -> tuple[set[str], list[tuple[str, str]], bool]:
+        """
+        Read all events that are ready. Folders that were removed or moved away
+        are not watched anymore.
+
+        Both ends of a move are in changed paths too. Moves are paired by
+        their cookie, so only moves whose both ends were read together and
+        are watched are reported, in the order they happened.
+
+        Returns:
+            tuple[set[str], list[tuple[str, str]], bool]: Full paths that
+            changed, old and new full paths of moved entries and whether some
+            events were lost because there were too many of them.
+        """
+        changed: set[str] = set()
+        moves: list[tuple[str, str]] = []
+        # Old paths of moves waiting for their other end, by cookie
+        moved_from: dict[int, str] = {}
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                with self._lock:
+                    if mask & IN_IGNORED:
+                        path = self._paths.pop(wd, None)
+                        if path is not None:
+                            self._descriptors.pop(path, None)
+                        continue
+                    folder = self._paths.get(wd)
+                if folder is None or not name:
+                    continue
+
+                path = os.path.join(folder, os.fsdecode(name))
+                changed.add(path)
+                if mask & IN_MOVED_FROM:
+                    moved_from[cookie] = path
+                elif mask & IN_MOVED_TO and cookie in moved_from:
+                    moves.append((moved_from.pop(cookie), path))
+                if mask & IN_ISDIR and mask & (IN_MOVED_FROM | IN_DELETE):
+                    self.unwatch_tree(path)
+        return changed, moves, overflow
+
+    def close(self):
+        """Stop watching everything"""
+        with self._lock:
+            self._paths.clear()
+            self._descriptors.clear()
+        os.close(self._fd)
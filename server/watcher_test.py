@@ -0,0 +1,81 @@
+import pathlib
+import sys
+import tempfile
+import unittest
+from server.watcher import Watcher
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class WatcherTest(unittest.TestCase):
+    temp_dir: tempfile.TemporaryDirectory
+    temp_dir_path: pathlib.Path
+
+    def setUp(self):
+        """
+        Creates temporary directory with a folder in it and watches both
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = pathlib.Path(self.temp_dir.name)
+        (self.temp_dir_path / "folder").mkdir()
+        self.watcher = Watcher()
+        self.watcher.watch(str(self.temp_dir_path))
+        self.watcher.watch(str(self.temp_dir_path / "folder"))
+
+    def tearDown(self):
+        """
+        Stops watching and deletes temporary directory
+        """
+        self.watcher.close()
+        self.temp_dir.cleanup()
+
+    def test_read_events(self):
+        """
+        Every changed path is reported once
+        """
+        file = self.temp_dir_path / "folder" / "file.txt"
+        file.write_bytes(b"1")
+        file.write_bytes(b"12")
+        (self.temp_dir_path / "other.txt").touch()
+        changed, moves, overflow = self.watcher.read_events()
+        self.assertEqual({str(file), str(self.temp_dir_path / "other.txt")}, changed)
+        self.assertFalse(overflow)
+        self.assertEqual([], moves)
+        self.assertEqual((set(), [], False), self.watcher.read_events())
+
+    def test_removed_folder(self):
+        """
+        Removed folders are not watched anymore
+        """
+        (self.temp_dir_path / "folder").rmdir()
+        changed, _, _ = self.watcher.read_events()
+        self.assertEqual({str(self.temp_dir_path / "folder")}, changed)
+        self.assertEqual(1, self.watcher.watched())
+
+    def test_moved_folder(self):
+        """
+        Both ends of a move are reported together, moved folder is not watched
+        """
+        old = self.temp_dir_path / "folder"
+        new = self.temp_dir_path / "renamed"
+        old.rename(new)
+        (self.temp_dir_path / "file.txt").touch()
+        changed, moves, _ = self.watcher.read_events()
+        self.assertEqual({str(old), str(new), str(self.temp_dir_path / "file.txt")}, changed)
+        self.assertEqual([(str(old), str(new))], moves)
+        self.assertEqual(1, self.watcher.watched())
+
+    def test_unwatch_tree(self):
+        """
+        Folder and everything inside of it is not watched
+        """
+        self.watcher.unwatch_tree(str(self.temp_dir_path))
+        (self.temp_dir_path / "folder" / "file.txt").touch()
+        self.assertEqual(0, self.watcher.watched())
+        self.assertEqual((set(), [], False), self.watcher.read_events())
+
+
+if __name__ == '__main__':
+    unittest.main(
+        failfast=False,
+        catchbreak=False
+    )
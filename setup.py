@@ -22,8 +22,13 @@ setup(
         'setuptools==59.6.0',
         'six==1.16.0',
         'toml==0.10.2',
+        'waitress==2.1.2',
         'Werkzeug==2.2.2',
     ],
+    extras_require={
+        # Thumbnails of images
+        'thumbnails': ['Pillow'],
+    },
     entry_points={
         'console_scripts': ['indexxo=server.main:main']
     }